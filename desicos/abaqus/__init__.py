@@ -17,6 +17,8 @@ User Interface (GUI) or using the Python API.
     :members:
 .. automodule:: desicos.abaqus.study
     :members:
+.. automodule:: desicos.abaqus.results_store
+    :members:
 .. automodule:: desicos.abaqus.utils
     :members:
 .. automodule:: desicos.abaqus.abaqus_functions
@@ -43,7 +43,9 @@ def calc_translations_ABAQUS(imperfection_file_name,
                              ignore_bot_h=None,
                              ignore_top_h=None,
                              sample_size=None,
-                             T=None):
+                             T=None,
+                             cache_dir=None,
+                             workers=None):
     r"""Reads an imperfection file and calculates the nodal translations
 
     Parameters
@@ -105,6 +107,16 @@ def calc_translations_ABAQUS(imperfection_file_name,
     T : None or np.ndarray, optional
         A transformation matrix (cf. :func:`.transf_matrix`) required when the
         mesh is not in the :ref:`default coordinate system <figure_conecyl>`.
+    cache_dir : None or str, optional
+        Directory where the interpolation operators are stored and reused
+        when the same mesh and imperfection data are found again (cf.
+        :func:`.get_inv_weighted_operator`). Only used when
+        ``use_theta_z_format=True``. Note that a ``sample_size`` smaller
+        than the number of measured points selects a random sample and
+        therefore prevents the reuse of the stored operators.
+    workers : None or int, optional
+        Number of threads used in the interpolation (cf.
+        :func:`.parallel_map`). The translations do not depend on it.
 
     """
     import abaqus
@@ -174,7 +186,9 @@ def calc_translations_ABAQUS(imperfection_file_name,
                           num_sub = num_sec_z,
                           col = 2,
                           ncp = num_closest_points,
-                          power_parameter = power_parameter)
+                          power_parameter = power_parameter,
+                          cache_dir = cache_dir,
+                          workers = workers)
 
         thetas = arctan2(coords[:, 1], coords[:, 0])
 
@@ -207,7 +221,8 @@ def calc_translations_ABAQUS(imperfection_file_name,
                                 num_closest_points = num_closest_points,
                                 power_parameter = power_parameter,
                                 num_sec_z = num_sec_z,
-                                sample_size = sample_size)
+                                sample_size = sample_size,
+                                workers = workers)
         trans = trans[:, :3]
 
     return trans
@@ -234,7 +249,9 @@ def translate_nodes_ABAQUS(imperfection_file_name,
                            ignore_bot_h=None,
                            ignore_top_h=None,
                            sample_size=None,
-                           T=None):
+                           T=None,
+                           cache_dir=None,
+                           workers=None):
     r"""Translates the nodes in Abaqus based on imperfection data
 
     The imperfection amplitude for each node is calculated using an inversed
@@ -315,6 +332,16 @@ def translate_nodes_ABAQUS(imperfection_file_name,
     T : None or np.ndarray, optional
         A transformation matrix (cf. :func:`.transf_matrix`) required when the
         mesh is not in the :ref:`default coordinate system <figure_conecyl>`.
+    cache_dir : None or str, optional
+        Directory where the interpolation operators are stored and reused
+        when the same mesh and imperfection data are found again (cf.
+        :func:`.get_inv_weighted_operator`). Only used when
+        ``use_theta_z_format=True``. Note that a ``sample_size`` smaller
+        than the number of measured points selects a random sample and
+        therefore prevents the reuse of the stored operators.
+    workers : None or int, optional
+        Number of threads used in the interpolation (cf.
+        :func:`.parallel_map`). The translations do not depend on it.
 
     Returns
     -------
@@ -383,7 +410,9 @@ def translate_nodes_ABAQUS(imperfection_file_name,
                         ignore_bot_h = ignore_bot_h,
                         ignore_top_h = ignore_top_h,
                         sample_size = sample_size,
-                        T = T)
+                        T = T,
+                        cache_dir = cache_dir,
+                        workers = workers)
 
         else:
             trans = nodal_translations
@@ -446,7 +475,9 @@ def translate_nodes_ABAQUS(imperfection_file_name,
                          ignore_bot_h = ignore_bot_h,
                          ignore_top_h = ignore_top_h,
                          sample_size = sample_size,
-                         T = T)
+                         T = T,
+                         cache_dir = cache_dir,
+                         workers = workers)
 
         # applying translations
         viewport = session.viewports[session.currentViewportName]
@@ -654,7 +685,9 @@ def change_thickness_ABAQUS(imperfection_file_name,
                             num_sec_z = 100,
                             elems_t = None,
                             t_set = None,
-                            use_theta_z_format = False):
+                            use_theta_z_format = False,
+                            cache_dir = None,
+                            workers = None):
     r"""Applies a given thickness imperfection to the finite element model
 
     Assumes that a percentage variation of the laminate thickness can be
@@ -724,6 +757,14 @@ def change_thickness_ABAQUS(imperfection_file_name,
     use_theta_z_format : bool, optional
         If the new format `\theta, Z, imp` should be used instead of the old
         `X, Y, Z`.
+    cache_dir : None or str, optional
+        Directory where the interpolation operators are stored and reused
+        when the same mesh and imperfection data are found again (cf.
+        :func:`.get_inv_weighted_operator`). Only used when
+        ``use_theta_z_format=True``.
+    workers : None or int, optional
+        Number of threads used in the interpolation (cf.
+        :func:`.parallel_map`). The thicknesses do not depend on it.
 
     """
     from abaqus import mdb
@@ -763,7 +804,9 @@ def change_thickness_ABAQUS(imperfection_file_name,
                                num_sub = num_sec_z,
                                col = 2,
                                ncp = num_closest_points,
-                               power_parameter = power_parameter)
+                               power_parameter = power_parameter,
+                               cache_dir = cache_dir,
+                               workers = workers)
 
             t_set = set(ans)
             t_set.discard(0.) #TODO why inv_weighted returns an array with 0.
@@ -795,7 +838,8 @@ def change_thickness_ABAQUS(imperfection_file_name,
                                 z_offset_bot = z_offset_bot,
                                 num_closest_points = num_closest_points,
                                 power_parameter = power_parameter,
-                                num_sec_z = num_sec_z)
+                                num_sec_z = num_sec_z,
+                                workers = workers)
         else:
             log('Thickness differences already calculated!')
     # creating sets
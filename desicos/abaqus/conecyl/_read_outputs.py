@@ -1,15 +1,29 @@
+import os
+
 import numpy as np
 
 import _read_outputs
+from desicos.abaqus.results_store import field_name
+from desicos.abaqus.utils.odb_history import (extract_history, load_history,
+                                              save_history)
+
+FIELD_KEYS = ('dx', 'dy', 'dz', 'dr', 'fz')
 
 
 def read_outputs(self, last_frame=False, last_cross_section=True,
-        read_fieldOutputs=False):
+        read_fieldOutputs=False, use_cache=True):
 
     if not self.check_completed():
         print 'ERROR! Output not found for model %s !' % self.model_name
         return False
 
+    odb_path = os.path.join(self.output_dir, self.model_name + '.odb')
+    if use_cache:
+        hist = load_history(odb_path)
+        if hist is not None:
+            _apply_history(self, hist)
+            return True
+
     # this is required to avoid an error for corrupted odbs
     try:
         odb = self.attach_results()
@@ -17,23 +31,32 @@ def read_outputs(self, last_frame=False, last_cross_section=True,
         print 'ERROR - Probably %s.odb is corrupted' % self.model_name
         return False
 
+    hist = extract_history(odb, self.step1Name, self.step2Name,
+                           self.linear_buckling)
     if self.linear_buckling:
-        pcrs = []
-        for frame in odb.steps[self.step1Name].frames:
-            description = frame.description
-            if description.find('EigenValue') > -1:
-                pcr = float(description.split('EigenValue =')[1].strip())
-                pcrs.append(pcr)
-        self.zdisp = np.linspace(       0., self.axial_displ or 1., 10)
-        self.zload = np.linspace(min(pcrs),              min(pcrs), 10)
         self.detach_results(odb)
-        return True
-
-    _read_outputs._read_axial_load_displ_history(self, odb)
+    if use_cache:
+        save_history(odb_path, hist)
+    _apply_history(self, hist)
 
     return True
 
 
+def _apply_history(cc, hist):
+    """Sets ``zdisp`` and ``zload`` from a history read by
+    :func:`.extract_history`"""
+    if cc.linear_buckling:
+        pcr = hist['eigenvalues'].min()
+        cc.zdisp = np.linspace(0., cc.axial_displ or 1., 10)
+        cc.zload = np.linspace(pcr, pcr, 10)
+        return
+    cc.zdisp = hist['U3'][:, 1].tolist()
+    if cc.displ_controlled:
+        cc.zload = (-hist['RF3'][:, 1]).tolist()
+    else:
+        cc.zload = (cc.axial_load*hist['RF3'][:, 0]).tolist()
+
+
 def _read_outputs_cross_section(cc, odb, cross_section_index=-1,
         last_frame=False):
     cross_section = cc.cross_sections[cross_section_index]
@@ -45,7 +68,62 @@ def _read_outputs_meridian(cc, odb, meridian_index=0, last_frame=False):
     _read_outputs._read_outputs_entity(cc, odb, meridian, last_frame)
 
 
+def _bulk_arrays(field_output):
+    """Node labels and data of a field output as NumPy arrays
+
+    The ``bulkDataBlocks`` of the field output are concatenated, which
+    avoids a Python loop over its ``values``.
+
+    Parameters
+    ----------
+    field_output : FieldOutput
+        An Abaqus field output, or any object with ``bulkDataBlocks``
+        having ``nodeLabels`` and ``data`` attributes.
+
+    Returns
+    -------
+    labels, data : np.ndarray
+        The node labels and the data, with one row per value.
+
+    """
+    blocks = field_output.bulkDataBlocks
+    if len(blocks) == 0:
+        return np.zeros(0, dtype=int), np.zeros((0, 1))
+    labels = np.concatenate([np.asarray(b.nodeLabels, dtype=int).ravel()
+                             for b in blocks])
+    data = np.concatenate([np.asarray(b.data, dtype=float).reshape(
+                           len(b.nodeLabels), -1) for b in blocks])
+    return labels, data
+
+
 def _read_outputs_entity(cc, odb, entity, last_frame=False):
+    """Reads the displacements and forces of the nodes of an entity
+
+    For each step the results are dense ``(frames x nodes)`` arrays in
+    ``cc.field_outputs[setname][step_name]``, a ``dict`` with the keys
+    ``'node_ids'``, ``'dx'``, ``'dy'``, ``'dz'``, ``'dr'`` and ``'fz'``,
+    where ``setname`` is the name of the entity node set. The columns of
+    these arrays are also assigned to the ``dx``, ``dy``, ``dz``, ``dr``
+    and ``fz`` attributes of the nodes. Frames that are not read contain
+    ``NaN``.
+
+    When ``cc`` belongs to a study, each frame is appended to the
+    :class:`.ResultsStore` of the study as soon as it is read and the
+    arrays are the memory-mapped files of the store, so that the results
+    of a step are never held in memory at once.
+
+    Parameters
+    ----------
+    cc : ConeCyl
+        The :class:`.ConeCyl` object.
+    odb : Odb
+        The opened ODB.
+    entity : object
+        The entity with ``prefix``, ``index`` and ``nodes`` attributes.
+    last_frame : bool, optional
+        Reads only the last frame of each step.
+
+    """
     setname = '%s_%03d' % (entity.prefix, entity.index)
     #TODO this if below is temporary... the meridians should not be even created
     #     if they have not nodes associated
@@ -54,90 +132,99 @@ def _read_outputs_entity(cc, odb, entity, last_frame=False):
     odb_mesh_node_array = odb.rootAssembly.instances['INSTANCECYLINDER'].\
                               nodeSets[setname]
     step_names = odb.steps.keys()
-    nodes = entity.nodes
-    # reseting values
-    nodes_dict = {}
-    for node in nodes:
-        if node is None:
-            continue
-        nodes_dict[node.id] = node
-        for step_name in step_names:
-            frmlen = len(odb.steps[step_name].frames)
-            node.dx[step_name] = [None for i in range(frmlen)]
-            node.dy[step_name] = [None for i in range(frmlen)]
-            node.dz[step_name] = [None for i in range(frmlen)]
-            node.dr[step_name] = [None for i in range(frmlen)]
-            # for NFORC outputs a starting float value is required
-            # because there are more then one nodeLabel value
-            #node.fx[step_name] = [0. for i in range(frmlen)]
-            #node.fy[step_name] = [0. for i in range(frmlen)]
-            node.fz[step_name] = [0.   for i in range(frmlen)]
-    # reading new values
+    nodes = [node for node in entity.nodes if node is not None]
+    node_ids = np.array([node.id for node in nodes], dtype=int)
+    order = np.argsort(node_ids)
+    sorted_ids = node_ids[order]
+    store = cc.results_store if cc.study is not None else None
+
+    def columns(labels):
+        # position of each label in node_ids, -1 when not found
+        pos = np.searchsorted(sorted_ids, labels)
+        pos = np.clip(pos, 0, len(sorted_ids) - 1)
+        found = sorted_ids[pos] == labels
+        return np.where(found, order[pos], -1)
+
+    def read_frame(frame):
+        rows = dict((key, np.zeros(len(nodes)) + np.nan)
+                    for key in FIELD_KEYS)
+        if 'UT' in frame.fieldOutputs.keys():
+            fOut = frame.fieldOutputs['UT']
+        else:
+            fOut = frame.fieldOutputs['U']
+        subfOut = fOut.getSubset(region=odb_mesh_node_array)
+        labels, data = _bulk_arrays(subfOut)
+        cols = columns(labels)
+        keep = cols >= 0
+        cols = cols[keep]
+        data = data[keep]
+        dx = data[:, 0]
+        dy = data[:, 1]
+        rows['dx'][cols] = dx
+        rows['dy'][cols] = dy
+        rows['dz'][cols] = data[:, 2]
+        rows['dr'][cols] = dx / np.cos(np.arctan2(dy, dx))
+
+        subfOut = frame.fieldOutputs['NFORC3'].getSubset(
+                      region=odb_mesh_node_array)
+        labels, data = _bulk_arrays(subfOut)
+        cols = columns(labels)
+        keep = cols >= 0
+        # NFORC3 has one value per element attached to a node
+        rows['fz'][:] = 0.
+        np.add.at(rows['fz'], cols[keep], data[keep, 0])
+        return rows
+
+    empty = dict((key, np.zeros(len(nodes)) + np.nan) for key in FIELD_KEYS)
+    empty['fz'][:] = 0.
+    results = {}
     for step_name in step_names:
         frames = odb.steps[step_name].frames
-        #
+        frmlen = len(frames)
         if last_frame:
-            frm_list = [-1]
+            frm_list = [frmlen - 1] if frmlen > 0 else []
+        else:
+            frm_list = range(frmlen)
+        frm_set = set(frm_list)
+        if store is None:
+            res = dict((key, np.repeat(empty[key][None, :], frmlen, axis=0))
+                       for key in FIELD_KEYS)
+            for i in frm_list:
+                rows = read_frame(frames[i])
+                for key in FIELD_KEYS:
+                    res[key][i] = rows[key]
+            res['node_ids'] = node_ids
         else:
-            frm_list = range(len(frames))
-        for i in frm_list:
-            frame = frames[i]
-            #
-            if 'UT' in frame.fieldOutputs.keys():
-                fOut = frame.fieldOutputs['UT']
-            else:
-                fOut = frame.fieldOutputs['U']
-            subfOut = fOut.getSubset(region=odb_mesh_node_array)
-            subfOutValues = subfOut.values
-            for value in subfOutValues:
-                node_id = value.nodeLabel
-                #if not node_id in nodes_dict.keys():
-                #    continue
-                node = nodes_dict[node_id]
-            #for value in frame.fieldOutputs['NFORC1'].values:
-            #    node_id = value.nodeLabel
-            #    tmp['NFORC1'][step_name][node_id] = value.data
-            #for value in frame.fieldOutputs['NFORC2'].values:
-            #    node_id = value.nodeLabel
-            #    tmp['NFORC2'][step_name][node_id] = value.data
-                data = value.data
-                dx = data[0]
-                dy = data[1]
-                dz = data[2]
-                # this set of operations below could be done in a array
-                thetarad = np.arctan2(dy, dx)
-                dr  = dx / np.cos(thetarad)
-                node.dx[step_name][i] = dx
-                node.dy[step_name][i] = dy
-                node.dz[step_name][i] = dz
-                node.dr[step_name][i] = dr
-                #
-                #fx = tmp['NFORC1'][step_name][node_id]
-                #
-                #fy = tmp['NFORC2'][step_name][node_id]
-                #
-            fOut = frame.fieldOutputs['NFORC3']
-            subfOut = fOut.getSubset(region=odb_mesh_node_array)
-            subfOutValues = subfOut.values
-            for value in subfOutValues:
-                node_id = value.nodeLabel
-                #if not node_id in nodes_dict.keys():
-                #    continue
-                node = nodes_dict[node_id]
-                node.fz[step_name][i] += value.data
-                #
-                #node.fx[step_name] += fx
-                #node.fy[step_name] += fy
+            names = dict((key, field_name('field_outputs', setname,
+                                          step_name, key))
+                         for key in FIELD_KEYS + ('node_ids',))
+            meta = dict(kind='field', set=setname, step=step_name)
+            with store.batch():
+                store.put(cc.model_name, names['node_ids'], node_ids,
+                          key='node_ids', **meta)
+                for key in FIELD_KEYS:
+                    store.put(cc.model_name, names[key],
+                              np.zeros((0, len(nodes))), key=key, **meta)
+                for i in range(frmlen):
+                    if i in frm_set:
+                        rows = read_frame(frames[i])
+                    else:
+                        rows = empty
+                    for key in FIELD_KEYS:
+                        store.append(cc.model_name, names[key],
+                                     rows[key][None, :])
+            res = dict((key, store.get(cc.model_name, name))
+                       for key, name in names.items())
+        results[step_name] = res
+        for j, node in enumerate(nodes):
+            for key in FIELD_KEYS:
+                getattr(node, key)[step_name] = res[key][:, j]
+    # a new dict, so that the change is seen by ConeCyl.save_results()
+    field_outputs = dict(cc.field_outputs)
+    field_outputs[setname] = results
+    cc.field_outputs = field_outputs
 
 
 def _read_axial_load_displ_history(cc, odb):
-    step_name = cc.step2Name
-    step = odb.steps[step_name]
-    historyRegion = step.historyRegions['Node ASSEMBLY.2']
-    zdisp_data = historyRegion.historyOutputs['U3'].data
-    zload_data = historyRegion.historyOutputs['RF3'].data
-    cc.zdisp = [value[1] for value in zdisp_data]
-    if cc.displ_controlled:
-        cc.zload = [-value[1] for value in zload_data]
-    else:
-        cc.zload = [cc.axial_load*value[0] for value in zload_data]
+    hist = extract_history(odb, cc.step1Name, cc.step2Name, False)
+    _apply_history(cc, hist)
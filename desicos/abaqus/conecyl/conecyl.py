@@ -10,6 +10,14 @@ from desicos.abaqus.constants import *
 from desicos.composite.laminate import read_stack
 from desicos.conecylDB import fetch
 from desicos.abaqus.utils import make_uniform_cells
+from desicos.abaqus.results_store import (ResultsStore, store_attr,
+                                           load_attr, remove_attr)
+
+#: results kept in the study :class:`.ResultsStore` instead of the pickle
+RESULT_ATTRS = ('zdisp', 'zload', 'field_outputs',
+                'stress_min_num', 'stress_min_ms', 'stress_min_pos_num',
+                'stress_max_num', 'stress_max_ms', 'stress_max_pos_num',
+                'hashin_max_num', 'hashin_max_ms', 'hashin_max_pos_num')
 
 
 class ConeCyl(object):
@@ -389,6 +397,7 @@ class ConeCyl(object):
         self.ener_total = 0.
         self.zdisp = []
         self.zload = []
+        self.field_outputs = {}
         self.stress_min_num     = {}
         self.stress_min_ms      = {}
         self.stress_min_pos_num = {}
@@ -401,6 +410,30 @@ class ConeCyl(object):
         self.output_requests = ['UT', 'NFORC']
         self.stress_output = False
         self.force_output = False
+        # results in the ResultsStore, {attr: model name}
+        self._stored_results = {}
+        # results written by save_results() and not assigned since
+        self._synced_results = set()
+
+
+    def __setattr__(self, attr, value):
+        if attr in RESULT_ATTRS:
+            self.__dict__.get('_synced_results', set()).discard(attr)
+        object.__setattr__(self, attr, value)
+
+
+    def __getstate__(self):
+        # Called during pickling (i.e. saving), the results just written by
+        # save_results() are left out. Only the first pickling after
+        # save_results() leaves them out, since they may be changed in
+        # place afterwards
+        attrs = self.__dict__.copy()
+        for attr in self._synced_results:
+            if attr in self._stored_results:
+                attrs.pop(attr, None)
+        attrs['_synced_results'] = set()
+        self.__dict__['_synced_results'] = set()
+        return attrs
 
 
     def __setstate__(self, attrs):
@@ -409,6 +442,55 @@ class ConeCyl(object):
         # when loading from older versions
         self.__init__()
         self.__dict__.update(attrs)
+        # results left out of the pickle are read when first accessed
+        for attr in self._stored_results:
+            if attr not in attrs:
+                self.__dict__.pop(attr, None)
+
+
+    def __getattr__(self, attr):
+        # Called only for missing attributes
+        stored = self.__dict__.get('_stored_results', {})
+        if attr not in stored:
+            raise AttributeError(attr)
+        value = load_attr(self.results_store, stored[attr], attr)
+        self.__dict__[attr] = value
+        return value
+
+
+    @property
+    def results_store(self):
+        """The :class:`.ResultsStore` in the ``results`` folder of
+        ``study_dir``"""
+        return ResultsStore(os.path.join(self.study_dir, 'results'))
+
+
+    def save_results(self):
+        """Writes the results into :attr:`results_store`
+
+        The attributes in ``RESULT_ATTRS`` that are in memory, i.e. that
+        were assigned or read since the study was loaded, are written,
+        since they may have been changed in place. The arrays of
+        ``field_outputs`` already mapped to the files of the store are not
+        written again. Empty results are removed from the store.
+
+        """
+        store = self.results_store
+        for attr in RESULT_ATTRS:
+            if (attr not in self.__dict__
+                and self._stored_results.get(attr) == self.model_name):
+                # never read since it was stored
+                self._synced_results.add(attr)
+                continue
+            value = getattr(self, attr)
+            if len(value) == 0:
+                if self._stored_results.pop(attr, None) == self.model_name:
+                    remove_attr(store, self.model_name, attr)
+                self._synced_results.discard(attr)
+                continue
+            store_attr(store, self.model_name, attr, value)
+            self._stored_results[attr] = self.model_name
+            self._synced_results.add(attr)
 
 
     def from_DB(self, name_DB=''):
@@ -606,10 +688,14 @@ class ConeCyl(object):
     def prepare_to_save(self):
         """Prepare the :class:`ConeCyl` to be saved
 
-        Any reference to Abaqus objects are removed in this method.
+        Any reference to Abaqus objects are removed in this method and the
+        results are written with :meth:`save_results`, so that they are not
+        pickled.
 
         """
         self.rebuilt = False
+        if self.study is not None:
+            self.save_results()
         return
 
 
@@ -776,10 +862,37 @@ class ConeCyl(object):
 
 
     def read_outputs(self, **kwargs):
+        """Reads the load-displacement history (or the eigenvalues)
+
+        The history is cached beside the ODB and read from the cache while
+        the ODB path, size and modification time are unchanged, without
+        opening the ODB (cf. :mod:`.odb_history`). Pass ``use_cache=False``
+        to always read the ODB.
+
+        Returns
+        -------
+        ok : bool
+            If the outputs could be read.
+
+        """
         import _read_outputs
         return _read_outputs.read_outputs(self, **kwargs)
 
 
+    def invalidate_outputs_cache(self):
+        """Removes the cached history of the ODB
+
+        Returns
+        -------
+        removed : bool
+            If a cache file was found.
+
+        """
+        from desicos.abaqus.utils.odb_history import invalidate
+        odb_path = os.path.join(self.output_dir, self.model_name + '.odb')
+        return invalidate(odb_path)
+
+
     def plot_displacements(self, **kwargs):
         import _plot
         return _plot.plot_displacements(self, **kwargs)
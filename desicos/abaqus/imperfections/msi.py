@@ -54,18 +54,26 @@ class MSI(object):
     The following attributes of the :class:`.MSI` object control the
     inverse-weighted algorithm:
 
-    ===================  =====================================================
-    Attribute            Description
-    ===================  =====================================================
-    ``ncp``              ``int``, number of closest points
-    ``power_parameter``  ``float``, power parameter
-    ``num_sec_z``        ``int``, number of sections used to spatially
-                         classify the measured points in order to
-                         accelerate the searching routines
-    ``r_TOL``            ``float``, percentage tolerance to ignore noisy
-                         data, for example, when ``r_TOL=1.`` the points
-                         with a radius `r > 1.1 R_{bot}`
-    ===================  =====================================================
+    ====================  ====================================================
+    Attribute             Description
+    ====================  ====================================================
+    ``ncp``               ``int``, number of closest points
+    ``power_parameter``   ``float``, power parameter
+    ``num_sec_z``         ``int``, number of sections used to spatially
+                          classify the measured points in order to
+                          accelerate the searching routines
+    ``r_TOL``             ``float``, percentage tolerance to ignore noisy
+                          data, for example, when ``r_TOL=1.`` the points
+                          with a radius `r > 1.1 R_{bot}`
+    ``interp_cache_dir``  ``str``, directory where the interpolation
+                          operators are stored and reused for repeated
+                          analyses with the same mesh and imperfection
+                          (cf. :func:`.get_inv_weighted_operator`), only
+                          used when ``use_theta_z_format=True``
+    ``interp_workers``    ``int``, number of threads used in the
+                          interpolation (cf. :func:`.parallel_map`), the
+                          imperfection does not depend on it
+    ====================  ====================================================
 
     Additional attributes are used to apply the imperfection into the
     finite element model when the inverse-weighted algorithm is selected.
@@ -160,6 +168,8 @@ class MSI(object):
         self.ignore_bot_h = True
         self.ignore_top_h = True
         self.sample_size = 2000000
+        self.interp_cache_dir = None
+        self.interp_workers = None
         #TODO: include z_offset_bottom to calculate ignore_bot_h and
         #      ignore_top_h
         # plotting options
@@ -259,7 +269,9 @@ class MSI(object):
                               use_theta_z_format = self.use_theta_z_format,
                               ignore_bot_h = self.ignore_bot_h,
                               ignore_top_h = self.ignore_top_h,
-                              sample_size = self.sample_size)
+                              sample_size = self.sample_size,
+                              cache_dir = self.interp_cache_dir,
+                              workers = self.interp_workers)
         else:
             if self.rotatedeg:
                 warn('"rotatedeg != 0", be sure you included this effect ' +
@@ -11,6 +11,12 @@ class TI(object):
     ply thickness is varied in order to reflect a given measured thickness
     imperfection field.
 
+    When ``use_theta_z_format=True`` the attribute ``interp_cache_dir`` can
+    be used to store and reuse the interpolation operators (cf.
+    :func:`.get_inv_weighted_operator`). The attribute ``interp_workers``
+    sets the number of threads used in the interpolation (cf.
+    :func:`.parallel_map`).
+
     """
     def __init__(self):
         super(TI, self).__init__()
@@ -27,6 +33,8 @@ class TI(object):
         self.pts = []
         self.index  = None
         self.use_theta_z_format = False
+        self.interp_cache_dir = None
+        self.interp_workers = None
         # plotting options
         self.xaxis = 'scaling_factor'
         self.xaxis_label = 'Scaling factor'
@@ -124,7 +132,9 @@ class TI(object):
                       num_sec_z = self.num_sec_z,
                       elems_t = self.elems_t,
                       t_set = self.t_set,
-                      use_theta_z_format = self.use_theta_z_format)
+                      use_theta_z_format = self.use_theta_z_format,
+                      cache_dir = self.interp_cache_dir,
+                      workers = self.interp_workers)
 
         from desicos.abaqus.abaqus_functions import set_colors_ti
         set_colors_ti(cc)
@@ -0,0 +1,362 @@
+r"""
+=====================================================
+Results Store (:mod:`desicos.abaqus.results_store`)
+=====================================================
+
+.. currentmodule:: desicos.abaqus.results_store
+
+Columnar store of the results of a study. Each quantity of each model is
+kept in its own binary file, read as a memory-mapped array, and a small
+JSON index gives the file, shape, data type and metadata of each one.
+Quantities can be appended along their first axis without rewriting the
+existing data, which is how the field outputs are written while the
+frames of an ODB are read. A quantity that is written again goes to a
+new file, since the previous one may still be mapped, which prevents its
+removal on Windows.
+
+The results of the :class:`.ConeCyl` objects (load-displacement curves,
+field outputs and stress envelopes) are written here by
+:meth:`.ConeCyl.prepare_to_save`. Therefore the pickled study stays small
+and the results are read back only when accessed.
+
+"""
+import os
+import re
+import json
+from contextlib import contextmanager
+
+import numpy as np
+
+INDEX_NAME = 'index.json'
+
+
+def _file_name(name, generation=None):
+    name = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+    if generation is None:
+        return name + '.bin'
+    return '{0}.{1:d}.bin'.format(name, generation)
+
+
+def _discard(path):
+    # the file may still be memory-mapped, which prevents its removal on
+    # Windows, in which case it is left behind
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ResultsStore(object):
+    """One memory-mapped array file per model quantity plus a JSON index
+
+    Parameters
+    ----------
+    path : str
+        The store folder, created when the first quantity is written.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.index_path = os.path.join(path, INDEX_NAME)
+        self._index = None
+        self._mtime = None
+        self._batch_level = 0
+        self._index_changed = False
+
+    @property
+    def index(self):
+        if os.path.isfile(self.index_path):
+            mtime = os.path.getmtime(self.index_path)
+            if self._index is None or mtime != self._mtime:
+                with open(self.index_path) as f:
+                    self._index = json.load(f)
+                self._mtime = mtime
+        elif self._index is None:
+            self._index = {}
+        return self._index
+
+    def _write_index(self):
+        if self._batch_level > 0:
+            self._index_changed = True
+            return
+        self._index_changed = False
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        tmp = self.index_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self._index, f, indent=1, sort_keys=True)
+        if os.path.isfile(self.index_path):
+            os.remove(self.index_path)
+        os.rename(tmp, self.index_path)
+        self._mtime = os.path.getmtime(self.index_path)
+
+    @contextmanager
+    def batch(self):
+        """Writes the index once, at the end of a ``with`` block
+
+        Useful when many quantities are written or appended, for example::
+
+            with store.batch():
+                for frame in frames:
+                    store.append(model, name, values(frame))
+
+        """
+        self._batch_level += 1
+        try:
+            yield self
+        finally:
+            self._batch_level -= 1
+            if self._batch_level == 0 and self._index_changed:
+                self._write_index()
+
+    def _entry(self, model, name):
+        return self.index.get(model, {}).get(name)
+
+    def _file_path(self, model, entry):
+        return os.path.join(self.path, _file_name(model), entry['file'])
+
+    def models(self):
+        """Names of the models with stored quantities"""
+        return sorted(self.index.keys())
+
+    def quantities(self, model):
+        """Names of the quantities stored for ``model``"""
+        return sorted(self.index.get(model, {}).keys())
+
+    def has(self, model, name):
+        return self._entry(model, name) is not None
+
+    def path_of(self, model, name):
+        """Path of the file of a quantity, ``None`` if it is not stored"""
+        entry = self._entry(model, name)
+        if entry is None:
+            return None
+        return self._file_path(model, entry)
+
+    def is_mapped(self, model, name, array):
+        """If ``array`` is the memory-mapped file of a stored quantity
+
+        Such an array is read-only, so that it is equal to the stored
+        values and does not need to be written again.
+
+        """
+        path = self.path_of(model, name)
+        filename = getattr(array, 'filename', None)
+        if path is None or filename is None or not os.path.isfile(path):
+            return False
+        entry = self._entry(model, name)
+        return (os.path.abspath(filename) == os.path.abspath(path)
+                and list(array.shape) == entry['shape']
+                and array.dtype.str == entry['dtype'])
+
+    def meta(self, model, name):
+        """Metadata given when the quantity was written"""
+        entry = self._entry(model, name)
+        if entry is None:
+            raise KeyError('{0}/{1} not stored'.format(model, name))
+        return entry['meta']
+
+    def put(self, model, name, array, **meta):
+        """Writes a quantity, replacing a previous one
+
+        Parameters
+        ----------
+        model : str
+            The model name.
+        name : str
+            The quantity name.
+        array : array_like
+            The values.
+        meta : dict, optional
+            JSON-serializable metadata of the quantity.
+
+        """
+        array = np.ascontiguousarray(array)
+        index = self.index
+        folder = os.path.join(self.path, _file_name(model))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        old = self._entry(model, name)
+        # each version is written to a new file, so that the arrays still
+        # mapped to the previous one stay valid and the previous file does
+        # not need to be removed while it is mapped
+        generation = old.get('generation', 0) + 1 if old else 0
+        while os.path.exists(os.path.join(folder,
+                                          _file_name(name, generation))):
+            generation += 1
+        entry = dict(file=_file_name(name, generation), generation=generation,
+                     dtype=array.dtype.str, shape=list(array.shape),
+                     meta=meta)
+        with open(self._file_path(model, entry), 'wb') as f:
+            array.tofile(f)
+        if old is not None:
+            # the previous versions, including those that could not be
+            # removed before because they were mapped
+            _discard(self._file_path(model, old))
+            pattern = re.compile(re.escape(_file_name(name)[:-4])
+                                 + r'\.(\d+)\.bin$')
+            for filename in os.listdir(folder):
+                m = pattern.match(filename)
+                if m and int(m.group(1)) < generation:
+                    _discard(os.path.join(folder, filename))
+        index.setdefault(model, {})[name] = entry
+        self._write_index()
+
+    def append(self, model, name, rows, **meta):
+        """Appends rows to a quantity along its first axis
+
+        The quantity is created if it does not exist. ``meta`` updates the
+        stored metadata.
+
+        """
+        entry = self._entry(model, name)
+        if entry is None:
+            return self.put(model, name, rows, **meta)
+        rows = np.ascontiguousarray(rows, dtype=np.dtype(entry['dtype']))
+        shape = entry['shape']
+        if list(rows.shape[1:]) != shape[1:]:
+            rows = rows.reshape([-1] + shape[1:])
+        with open(self._file_path(model, entry), 'ab') as f:
+            rows.tofile(f)
+        shape[0] += rows.shape[0]
+        entry['meta'].update(meta)
+        self._write_index()
+
+    def get(self, model, name, mmap=True):
+        """Reads a quantity
+
+        Parameters
+        ----------
+        model : str
+            The model name.
+        name : str
+            The quantity name.
+        mmap : bool, optional
+            Returns a read-only memory-mapped array instead of loading the
+            values.
+
+        Returns
+        -------
+        array : np.ndarray or None
+            The values, ``None`` if the quantity is not stored.
+
+        """
+        entry = self._entry(model, name)
+        if entry is None:
+            return None
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        path = self._file_path(model, entry)
+        if not mmap or np.prod(shape) == 0:
+            return np.fromfile(path, dtype=dtype).reshape(shape)
+        return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+    def remove(self, model, name=None):
+        """Removes a quantity or, if ``name`` is ``None``, all of a model"""
+        index = self.index
+        if model not in index:
+            return
+        names = [name] if name is not None else list(index[model])
+        for n in names:
+            entry = index[model].pop(n, None)
+            if entry is None:
+                continue
+            _discard(self._file_path(model, entry))
+        if not index[model]:
+            del index[model]
+        self._write_index()
+
+
+def store_attr(store, model, attr, value):
+    """Writes a :class:`.ConeCyl` result attribute in the columnar layout
+
+    Three kinds of values are handled:
+
+    - sequences of numbers, such as ``zdisp`` and ``zload``;
+    - ``dict`` objects with one ``dict`` of numbers per frame, such as
+      ``stress_min_num``, stored as a ``(frames x keys)`` array;
+    - the nested ``field_outputs`` ``dict``, whose arrays are stored
+      separately. The arrays that are already the memory-mapped files of
+      the store (cf. :meth:`.ResultsStore.is_mapped`) are not written
+      again.
+
+    """
+    if isinstance(value, dict) and attr == 'field_outputs':
+        with store.batch():
+            names = set()
+            for setname, steps in value.items():
+                for step_name, arrays in steps.items():
+                    for key, array in arrays.items():
+                        name = field_name(attr, setname, step_name, key)
+                        names.add(name)
+                        if store.is_mapped(model, name, array):
+                            continue
+                        store.put(model, name, array, kind='field',
+                                  set=setname, step=step_name, key=key)
+            for name in store.quantities(model):
+                if name.startswith(attr + '/') and name not in names:
+                    store.remove(model, name)
+            store.put(model, attr, np.zeros(0), kind='nested')
+        return
+    remove_attr(store, model, attr)
+    if isinstance(value, dict):
+        frames = sorted(value.keys())
+        keys = sorted(set(k for d in value.values() for k in d.keys()))
+        table = np.zeros((len(frames), len(keys))) + np.nan
+        for i, frame in enumerate(frames):
+            for j, key in enumerate(keys):
+                v = value[frame].get(key)
+                if v is not None:
+                    table[i, j] = v
+        store.put(model, attr, table, kind='frames', frames=frames,
+                  keys=keys)
+    else:
+        store.put(model, attr, np.asarray(value, dtype=float),
+                  kind='array')
+
+
+def field_name(attr, setname, step_name, key):
+    """Name of a ``field_outputs`` array in the store"""
+    return '/'.join((attr, setname, step_name, key))
+
+
+def remove_attr(store, model, attr):
+    """Removes an attribute written by :func:`.store_attr`"""
+    with store.batch():
+        for name in store.quantities(model):
+            if name == attr or name.startswith(attr + '/'):
+                store.remove(model, name)
+
+
+def load_attr(store, model, attr):
+    """Reads an attribute written by :func:`.store_attr`
+
+    The sequences are returned as lists, the field output arrays as
+    memory-mapped arrays and the per-frame values as ``dict`` objects.
+
+    """
+    if not store.has(model, attr):
+        return None
+    meta = store.meta(model, attr)
+    kind = meta['kind']
+    if kind == 'array':
+        return store.get(model, attr, mmap=False).tolist()
+    elif kind == 'frames':
+        table = store.get(model, attr, mmap=False)
+        value = {}
+        for i, frame in enumerate(meta['frames']):
+            value[frame] = dict((str(key), table[i, j])
+                                for j, key in enumerate(meta['keys'])
+                                if not np.isnan(table[i, j]))
+        return value
+    elif kind == 'nested':
+        value = {}
+        for name in store.quantities(model):
+            if not name.startswith(attr + '/'):
+                continue
+            m = store.meta(model, name)
+            steps = value.setdefault(str(m['set']), {})
+            steps.setdefault(str(m['step']), {})[str(m['key'])] = store.get(
+                model, name)
+        return value
+    raise ValueError('Invalid kind of stored attribute: {0}'.format(kind))
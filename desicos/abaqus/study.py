@@ -68,6 +68,10 @@ class Study(object):
     def save(self, path=''):
         """Save the current study
 
+        The results of the :class:`.ConeCyl` objects are written to the
+        :class:`.ResultsStore` of the study folder and read back only when
+        accessed, after loading (cf. :meth:`.ConeCyl.save_results`).
+
         Parameters
         ----------
         path : str, optional
@@ -166,44 +170,158 @@ class Study(object):
                 ti.t_set = t_set
                 elems_t_dict, t_set = ti.create()
 
-    def create_run_file(self):
+    def create_run_file(self, **kwargs):
         """Creates the run file which can be called from any Python
 
-        The file is stored in the ``self.study_dir`` folder.
+        The file is stored in the ``self.study_dir`` folder, together with
+        the ``scheduler.py`` and ``job_stopper.py`` modules it uses.
+
+        Parameters
+        ----------
+        kwargs : dict, optional
+            Default options of the :class:`.Scheduler` running the jobs,
+            e.g. ``max_jobs``, ``max_tokens`` or ``timeout``. By default the
+            models with linear buckling mode-based imperfections wait for
+            the ``_lb`` model (cf. ``lb_dependents``).
 
         """
         import desicos.abaqus.utils.jobs as jobs
 
         self.runnames = []
+        lb_dependents = []
         for cc in self.ccs:
             self.runnames.append(cc.model_name)
+            if len(cc.impconf.lbmis) > 0:
+                lb_dependents.append(cc.model_name)
+        kwargs.setdefault('lb_dependents', lb_dependents)
         prefix = os.path.join(self.study_dir, 'run_' + self.name)
         self.run_file_name = prefix + '.py'
         tmpf = open(self.run_file_name, 'w')
-        jobs.print_run_file(self.study_dir, self.runnames, tmpf)
-        shutil.copy2(os.path.join(DAHOME, 'utils', 'job_stopper.py'),
-                                  self.study_dir)
+        jobs.print_run_file(self.study_dir, self.runnames, tmpf, **kwargs)
+        for module in ('job_stopper.py', 'scheduler.py'):
+            shutil.copy2(os.path.join(DAHOME, 'utils', module),
+                         self.study_dir)
         tmpf.close()
 
     def open_excel(self):
         os.system(self.excel_name)
 
-    def plot_forces(self, gui=False, put_in_Excel=True, open_Excel=False):
+    def read_outputs(self, workers=None, abaqus_cmd='abaqus'):
+        """Reads the load-displacement histories of all the models
+
+        The history of each ODB is extracted once and cached beside it
+        (cf. :mod:`.odb_history`), the cache being reused while the ODB is
+        not modified. The attribute ``outputs_ok`` of each
+        :class:`.ConeCyl` tells if its history could be read.
+
+        Parameters
+        ----------
+        workers : int or None, optional
+            Number of ``abaqus python`` worker processes extracting the
+            histories not cached yet, ``-1`` uses one worker per CPU. If
+            ``None``, ``0`` or ``1`` the ODBs are opened in the current
+            Abaqus session, one at a time.
+        abaqus_cmd : str, optional
+            The Abaqus executable used to start the workers.
+
+        """
+        import subprocess
+        import desicos.abaqus.utils.odb_history as odb_history
+        import desicos.abaqus.conecyl._read_outputs as _read_outputs
+        from desicos.conecylDB.interpolate import parallel_map
+
+        if workers is not None and int(workers) < 0:
+            from multiprocessing import cpu_count
+            workers = cpu_count()
+        # the same rule of parallel_map() to run serially
+        in_session = workers is None or int(workers) <= 1
+
+        hists = []
+        todo = []
+        for cc in self.ccs:
+            cc.outputs_ok = False
+            if not cc.check_completed():
+                continue
+            odb_path = os.path.join(cc.output_dir, cc.model_name + '.odb')
+            hist = odb_history.load_history(odb_path)
+            if hist is None:
+                todo.append((len(hists), cc, odb_path))
+            hists.append((cc, hist))
+
+        def extract(item):
+            i, cc, odb_path = item
+            if in_session:
+                try:
+                    odb = cc.attach_results()
+                    hist = odb_history.extract_history(odb, cc.step1Name,
+                               cc.step2Name, cc.linear_buckling)
+                except:
+                    warn('Probably {0}.odb is corrupted'.format(
+                         cc.model_name))
+                    return None
+                if cc.linear_buckling:
+                    cc.detach_results(odb)
+                odb_history.save_history(odb_path, hist)
+                return hist
+            else:
+                script = os.path.join(DAHOME, 'utils', 'odb_history.py')
+                args = [abaqus_cmd, 'python', script, odb_path, cc.step1Name,
+                        cc.step2Name, str(int(bool(cc.linear_buckling)))]
+                subprocess.call(args, cwd=cc.output_dir,
+                                shell=(os.name == 'nt'))
+                # written by the worker
+                return odb_history.load_history(odb_path, count=False)
+
+        if todo:
+            log('extracting {0:d} ODB histories...'.format(len(todo)))
+        for (i, cc, odb_path), hist in zip(todo,
+                                           parallel_map(extract, todo,
+                                                        workers)):
+            hists[i] = (cc, hist)
+        for cc, hist in hists:
+            if hist is None:
+                warn('history not found for model {0}'.format(cc.model_name))
+                continue
+            _read_outputs._apply_history(cc, hist)
+            cc.outputs_ok = True
+
+    def invalidate_outputs_cache(self):
+        """Removes the cached histories of all the models
+
+        Returns
+        -------
+        num : int
+            Number of removed cache files.
+
+        """
+        return sum(bool(cc.invalidate_outputs_cache()) for cc in self.ccs)
+
+    def outputs_cache_stats(self, reset=False):
+        """Hits and misses of the history cache, cf. :func:`.cache_stats`"""
+        from desicos.abaqus.utils.odb_history import cache_stats
+        return cache_stats(reset=reset)
+
+    def plot_forces(self, gui=False, put_in_Excel=True, open_Excel=False,
+                    workers=None):
         import desicos.abaqus.utils as utils
 
         sheet_names = ['load_short_curves','load_short_curves_norm']
         x_labels = ['End-Shortening, mm', 'Normalized End-Shortening']
         y_labels = ['Reaction Load, kN' , 'Normalized Reaction Load']
+        self.read_outputs(workers=workers)
+        all_curves = []
+        for cc in self.ccs:
+            if not cc.outputs_ok:
+                continue
+            all_curves.append((cc.model_name, cc.plot_forces(gui=gui)))
         for curve_num in range(2):
             curves = []
             names = []
-            for cc in self.ccs:
-                ok = cc.read_outputs()
-                if not ok:
+            for name, cc_curves in all_curves:
+                if cc_curves is None or cc_curves[curve_num] is None:
                     continue
-                curve = cc.plot_forces(gui=gui)[curve_num]
-                curves.append(curve)
-                names.append(cc.model_name)
+                curves.append(cc_curves[curve_num])
+                names.append(name)
             if put_in_Excel:
                 sheet_name = sheet_names[curve_num]
                 book, sheet = utils.get_book_sheet(self.excel_name, sheet_name)
@@ -224,12 +342,12 @@ class Study(object):
               gui = False,
               put_in_Excel = True,
               open_Excel = False,
-              global_second = False):
+              global_second = False,
+              workers = None):
         import desicos.abaqus.utils as utils
         import abaqus_functions
 
-        for cc in self.ccs:
-            cc.outputs_ok = cc.read_outputs()
+        self.read_outputs(workers=workers)
         laminate_t = sum(t for t in self.ccs[0].plyts)
         session = __main__.session
         numcharts = 4
@@ -0,0 +1,69 @@
+"""Minimal stand-ins of the Abaqus ODB objects read by desicos"""
+import numpy as np
+
+
+class Obj(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FieldOutput(object):
+    """Field output whose values are split in two bulk data blocks"""
+    def __init__(self, labels, data):
+        self.labels = np.asarray(labels)
+        self.data = np.asarray(data)
+
+    def getSubset(self, region):
+        return self
+
+    @property
+    def values(self):
+        return [Obj(nodeLabel=l, data=d if d.size > 1 else d[0])
+                for l, d in zip(self.labels, self.data)]
+
+    @property
+    def bulkDataBlocks(self):
+        h = len(self.labels)//2
+        return [Obj(nodeLabels=self.labels[:h], data=self.data[:h]),
+                Obj(nodeLabels=self.labels[h:], data=self.data[h:])]
+
+
+def fake_frame(ids, u, nforc_labels, nforc):
+    """Frame with the ``U`` and ``NFORC3`` field outputs"""
+    return Obj(fieldOutputs={'U': FieldOutput(ids, u),
+                             'NFORC3': FieldOutput(nforc_labels, nforc)})
+
+
+def fake_odb(setnames, steps):
+    """ODB with the node sets ``setnames`` and ``{step_name: frames}``"""
+    node_sets = dict((name, None) for name in setnames)
+    instance = Obj(nodeSets=node_sets)
+    return Obj(steps=dict((name, Obj(frames=frames))
+                          for name, frames in steps.items()),
+               rootAssembly=Obj(instances={'INSTANCECYLINDER': instance}))
+
+
+def random_odb(ids, num_frames, setnames=('CS_001',), seed=0):
+    """ODB with random displacements and nodal forces of the nodes ``ids``
+
+    The values are given in a shuffled order and ``NFORC3`` has two
+    values for half of the nodes.
+
+    """
+    rnd = np.random.RandomState(seed)
+    ids = np.asarray(ids)
+    n = len(ids)
+    frames = []
+    for i in range(num_frames):
+        perm = rnd.permutation(n)
+        u = rnd.randn(n, 3)
+        nforc_labels = np.concatenate([ids, ids[:n//2]])
+        nforc = rnd.randn(len(nforc_labels), 1).astype(np.float32)
+        frames.append(fake_frame(ids[perm], u[perm], nforc_labels, nforc))
+    return fake_odb(setnames, {'Step-1': frames[:1], 'Step-2': frames[1:]})
+
+
+def fake_entity(prefix, index, ids):
+    """Cross-section or meridian with a node per id and a missing node"""
+    nodes = [Obj(id=i, dx={}, dy={}, dz={}, dr={}, fz={}) for i in ids]
+    return Obj(prefix=prefix, index=index, nodes=nodes + [None])
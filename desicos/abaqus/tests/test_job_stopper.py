@@ -0,0 +1,155 @@
+import os
+import json
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from desicos.abaqus.utils import job_stopper as js
+
+
+def dat_block(rf3, u3):
+    return ('\n NODE FOOT-  NOTE\n\n  NODE   FOOT-\n'
+            '     1000  0.0  {0:g}  {1:g}\n'.format(rf3, u3))
+
+
+def run_policy(policy, rf3s, u3s=None):
+    """Index of the increment stopping the job and the reason"""
+    if u3s is None:
+        u3s = [None]*len(rf3s)
+    for i, (rf3, u3) in enumerate(zip(rf3s, u3s)):
+        reason = policy.update(rf3, u3)
+        if reason is not None:
+            return i, reason
+    return None, None
+
+
+class TestPolicies(TestCase):
+
+    def test_buckling_drop_matches_check_stop(self):
+        rnd = np.random.RandomState(1)
+        for _ in range(200):
+            rf3s = list(np.cumsum(rnd.uniform(-0.3, 1., 30)) + 10.)
+            policy = js.BucklingDropPolicy()
+            i, reason = run_policy(policy, rf3s)
+            for n in range(1, len(rf3s) + 1):
+                if js.check_stop(rf3s[:n]):
+                    break
+            else:
+                n = None
+            self.assertEqual(None if i is None else i + 1, n)
+
+    def test_buckling_drop_global(self):
+        i, reason = run_policy(js.BucklingDropPolicy(),
+                               [-1, -2, -3, -4, -1, -1])
+        self.assertEqual(i, 5)
+        self.assertTrue('global' in reason)
+
+    def test_load_drop(self):
+        policy = js.LoadDropPolicy(drop=0.2)
+        i, reason = run_policy(policy, [1, 2, 3, 2.5, 2.3, 2.3])
+        self.assertEqual(i, 4)
+        self.assertEqual(policy.max_load, 3)
+        i, reason = run_policy(js.LoadDropPolicy(drop=0.5), [1, 2, 3, 2])
+        self.assertEqual(i, None)
+
+    def test_drop_count(self):
+        rf3s = [1, 2, 1.5, 2.5, 2., 3., 2.]
+        i, reason = run_policy(js.DropCountPolicy(num_drops=2), rf3s)
+        self.assertEqual(i, 4)
+        i, reason = run_policy(js.DropCountPolicy(num_drops=3), rf3s)
+        self.assertEqual(i, 6)
+        i, reason = run_policy(js.DropCountPolicy(num_drops=2,
+                                                  criterion=0.3), rf3s)
+        self.assertEqual(i, None)
+
+    def test_end_shortening(self):
+        policy = js.EndShorteningPolicy(limit=1.)
+        i, reason = run_policy(policy, [1, 2, 3, 4], [-0.4, -0.8, -1.2, -2])
+        self.assertEqual(i, 2)
+        i, reason = run_policy(js.EndShorteningPolicy(limit=1.), [1, 2],
+                               [None, None])
+        self.assertEqual(i, None)
+
+    def test_stiffness_ratio(self):
+        u3s = [0., 0.1, 0.2, 0.3, 0.4, 0.5]
+        rf3s = [0., 10., 20., 25., 26., 20.]
+        policy = js.StiffnessRatioPolicy(ratio=0.5)
+        i, reason = run_policy(policy, rf3s, u3s)
+        self.assertEqual(i, 5)
+        self.assertAlmostEqual(policy.k0, 100.)
+
+    def test_create_policies(self):
+        policies = js.create_policies()
+        self.assertEqual([p.name for p in policies], ['buckling_drop'])
+        config = [dict(type='load_drop', drop=0.2),
+                  dict(type='end_shortening', limit=1.5)]
+        policies = js.create_policies(config)
+        self.assertEqual([p.config() for p in policies], config)
+        self.assertRaises(ValueError, js.create_policies,
+                          [dict(type='invalid')])
+
+
+class TestDatReader(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'job.dat')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, data, mode='a'):
+        with open(self.path, mode) as f:
+            f.write(data)
+
+    def test_offset(self):
+        reader = js.DatReader(self.path)
+        self.assertEqual(reader.read(), [])
+        self.write('HEADER\n' + dat_block(1., -0.1) + dat_block(2., -0.2))
+        self.assertEqual(reader.read(), [(1., -0.1), (2., -0.2)])
+        self.assertEqual(reader.offset, os.path.getsize(self.path))
+        self.assertEqual(reader.read(), [])
+        self.write(dat_block(3., -0.3))
+        self.assertEqual(reader.read(), [(3., -0.3)])
+        self.assertFalse(reader.restarted)
+
+    def test_incomplete_line(self):
+        reader = js.DatReader(self.path)
+        block = dat_block(1., -0.1)
+        self.write(block[:-10])
+        self.assertEqual(reader.read(), [])
+        self.write(block[-10:])
+        self.assertEqual(reader.read(), [(1., -0.1)])
+
+    def test_restart(self):
+        reader = js.DatReader(self.path)
+        self.write(dat_block(1., -0.1) + dat_block(2., -0.2))
+        self.assertEqual(len(reader.read()), 2)
+        self.write(dat_block(5., -0.5), mode='w')
+        self.assertEqual(reader.read(), [(5., -0.5)])
+        self.assertTrue(reader.restarted)
+
+    def test_monitor_restart_resets_policies(self):
+        self.write(dat_block(10., -1.) + dat_block(5., -2.)
+                   + dat_block(5., -2.))
+        monitor = js.JobMonitor(self.tmpdir, 'job',
+                                [dict(type='load_drop', drop=0.3)])
+        self.assertTrue(monitor.update() is not None)
+        self.write(dat_block(1., -0.1), mode='w')
+        self.assertEqual(monitor.update(), None)
+        self.assertEqual(monitor.rf3s, [1.])
+
+    def test_status_file(self):
+        self.write(dat_block(10., -1.) + dat_block(5., -2.)
+                   + dat_block(5., -2.))
+        monitor = js.JobMonitor(self.tmpdir, 'job',
+                                [dict(type='load_drop', drop=0.3)])
+        monitor.update()
+        js.write_status(self.tmpdir, 'job', monitor.status())
+        with open(js.status_path(self.tmpdir, 'job')) as f:
+            status = json.load(f)
+        self.assertTrue(status['stopped'])
+        self.assertEqual(status['policy'], dict(type='load_drop', drop=0.3))
+        self.assertEqual(status['max_rf3'], 10.)
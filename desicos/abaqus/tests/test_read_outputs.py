@@ -0,0 +1,151 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from desicos.abaqus.study import Study
+from desicos.abaqus.conecyl import _read_outputs
+from desicos.abaqus.utils import odb_history
+from desicos.abaqus.tests.fake_odb import Obj, random_odb, fake_entity
+
+
+def reference(odb, ids):
+    """Loop over the ``values`` of the field outputs, one node at a time"""
+    res = {}
+    for step_name, step in odb.steps.items():
+        frames = step.frames
+        out = dict((k, np.zeros((len(frames), len(ids))) + np.nan)
+                   for k in ('dx', 'dy', 'dz', 'dr'))
+        out['fz'] = np.zeros((len(frames), len(ids)))
+        col = dict((node_id, j) for j, node_id in enumerate(ids))
+        for i, frame in enumerate(frames):
+            for v in frame.fieldOutputs['U'].values:
+                j = col[v.nodeLabel]
+                dx, dy, dz = v.data
+                out['dx'][i, j] = dx
+                out['dy'][i, j] = dy
+                out['dz'][i, j] = dz
+                out['dr'][i, j] = dx/np.cos(np.arctan2(dy, dx))
+            for v in frame.fieldOutputs['NFORC3'].values:
+                out['fz'][i, col[v.nodeLabel]] += v.data
+        res[step_name] = out
+    return res
+
+
+class TestReadOutputsEntity(TestCase):
+
+    def setUp(self):
+        self.ids = np.random.RandomState(1).permutation(np.arange(1, 41)*3)
+        self.odb = random_odb(self.ids, 6)
+        self.cc = Obj(field_outputs={}, study=None)
+
+    def test_all_frames(self):
+        entity = fake_entity('CS', 1, self.ids)
+        _read_outputs._read_outputs_entity(self.cc, self.odb, entity)
+        ref = reference(self.odb, self.ids)
+        res = self.cc.field_outputs['CS_001']
+        self.assertEqual(sorted(res), ['Step-1', 'Step-2'])
+        for step_name, out in ref.items():
+            self.assertEqual(res[step_name]['node_ids'].tolist(),
+                             self.ids.tolist())
+            for key, values in out.items():
+                np.testing.assert_allclose(res[step_name][key], values,
+                                           rtol=1e-6)
+                for j, node in enumerate(entity.nodes[:-1]):
+                    np.testing.assert_allclose(getattr(node, key)[step_name],
+                                               values[:, j], rtol=1e-6)
+
+    def test_last_frame(self):
+        entity = fake_entity('CS', 1, self.ids)
+        _read_outputs._read_outputs_entity(self.cc, self.odb, entity,
+                                           last_frame=True)
+        ref = reference(self.odb, self.ids)
+        dx = self.cc.field_outputs['CS_001']['Step-2']['dx']
+        self.assertTrue(np.isnan(dx[:-1]).all())
+        np.testing.assert_allclose(dx[-1], ref['Step-2']['dx'][-1])
+        fz = self.cc.field_outputs['CS_001']['Step-2']['fz']
+        self.assertTrue((fz[:-1] == 0).all())
+
+    def test_unknown_labels_ignored(self):
+        entity = fake_entity('CS', 1, self.ids[:10])
+        _read_outputs._read_outputs_entity(self.cc, self.odb, entity)
+        ref = reference(self.odb, self.ids)
+        dz = self.cc.field_outputs['CS_001']['Step-2']['dz']
+        self.assertEqual(dz.shape, (5, 10))
+        np.testing.assert_allclose(dz, ref['Step-2']['dz'][:, :10])
+
+    def test_empty_entity(self):
+        _read_outputs._read_outputs_entity(self.cc, self.odb,
+                                           Obj(prefix='CS', index=1,
+                                               nodes=[]))
+        self.assertEqual(self.cc.field_outputs, {})
+
+
+class TestStudyReadOutputs(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.events = []
+        self.std = Study()
+        for name, lb in (('s_lb', True), ('s_1', False)):
+            with open(os.path.join(self.tmpdir, name + '.odb'), 'w') as f:
+                f.write(name)
+            cc = Obj(model_name=name, output_dir=self.tmpdir,
+                     linear_buckling=lb, displ_controlled=True,
+                     axial_displ=1., step1Name='Step-1',
+                     step2Name='Step-2')
+            cc.check_completed = lambda: True
+            cc.attach_results = self.attach(cc)
+            cc.detach_results = self.detach(cc)
+            self.std.ccs.append(cc)
+        self.extract_history = odb_history.extract_history
+        self.call = subprocess.call
+        odb_history.extract_history = self.fake_extract
+        subprocess.call = self.fake_call
+
+    def tearDown(self):
+        odb_history.extract_history = self.extract_history
+        subprocess.call = self.call
+        shutil.rmtree(self.tmpdir)
+
+    def attach(self, cc):
+        def attach_results():
+            self.events.append(('attach', cc.model_name))
+            return cc.model_name
+        return attach_results
+
+    def detach(self, cc):
+        def detach_results(odb):
+            self.events.append(('detach', odb))
+        return detach_results
+
+    def fake_extract(self, odb, step1_name, step2_name, linear_buckling):
+        if linear_buckling:
+            return dict(eigenvalues=np.array([3., 2.]))
+        return dict(U3=np.array([[0., 0.], [1., 2.]]),
+                    RF3=np.array([[0., 0.], [1., -5.]]))
+
+    def fake_call(self, args, **kwargs):
+        self.events.append(('worker', args[3]))
+        return 0
+
+    def test_serial_in_session(self):
+        for workers in (None, 0, 1):
+            for cc in self.std.ccs:
+                odb_history.invalidate(os.path.join(self.tmpdir,
+                                                    cc.model_name + '.odb'))
+            del self.events[:]
+            self.std.read_outputs(workers=workers)
+            self.assertEqual(self.events, [('attach', 's_lb'),
+                                           ('detach', 's_lb'),
+                                           ('attach', 's_1')])
+            self.assertTrue(all(cc.outputs_ok for cc in self.std.ccs))
+            self.assertEqual(self.std.ccs[1].zload, [0., 5.])
+
+    def test_workers(self):
+        self.std.read_outputs(workers=2)
+        self.assertEqual(sorted(e[0] for e in self.events),
+                         ['worker', 'worker'])
@@ -0,0 +1,167 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from desicos.abaqus.study import Study
+from desicos.abaqus.conecyl import ConeCyl
+from desicos.abaqus.conecyl import _read_outputs
+from desicos.abaqus.results_store import ResultsStore
+from desicos.abaqus.tests.fake_odb import random_odb, fake_entity
+
+
+class TestResultsStore(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = ResultsStore(os.path.join(self.tmpdir, 'results'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_put_append_get(self):
+        self.store.put('m', 'a', np.arange(6.).reshape(2, 3), kind='x')
+        self.store.append('m', 'a', np.arange(3.) + 10)
+        a = self.store.get('m', 'a')
+        self.assertTrue(isinstance(a, np.memmap))
+        self.assertEqual(a.shape, (3, 3))
+        self.assertEqual(a[2].tolist(), [10., 11., 12.])
+        self.assertTrue(self.store.is_mapped('m', 'a', a))
+        self.assertFalse(self.store.is_mapped('m', 'a', np.array(a)))
+        self.assertEqual(ResultsStore(self.store.path).meta('m', 'a'),
+                         dict(kind='x'))
+
+    def test_batch(self):
+        with self.store.batch():
+            for i in range(5):
+                self.store.append('m', 'a', [float(i)])
+            self.assertFalse(os.path.isfile(self.store.index_path))
+        self.assertEqual(ResultsStore(self.store.path).get('m', 'a').tolist(),
+                         [0., 1., 2., 3., 4.])
+
+    def test_put_keeps_mapped_arrays(self):
+        self.store.put('m', 'a', np.ones(4))
+        a = self.store.get('m', 'a')
+        self.store.put('m', 'a', np.zeros(2))
+        self.assertEqual(a.tolist(), [1.]*4)
+        self.assertEqual(self.store.get('m', 'a').tolist(), [0.]*2)
+        self.assertNotEqual(a.filename, self.store.path_of('m', 'a'))
+        self.assertFalse(os.path.isfile(a.filename))
+
+    def test_put_with_undeletable_files(self):
+        # on Windows a memory-mapped file cannot be removed
+        remove = os.remove
+        def locked(path):
+            if not path.endswith('.bin'):
+                return remove(path)
+            raise OSError('file in use: {0}'.format(path))
+        self.store.put('m', 'a', np.ones(4))
+        a = self.store.get('m', 'a')
+        os.remove = locked
+        try:
+            self.store.put('m', 'a', np.zeros(2))
+            self.store.remove('m', 'a')
+            self.store.put('m', 'a', np.zeros(3))
+        finally:
+            os.remove = remove
+        self.assertEqual(a.tolist(), [1.]*4)
+        self.assertEqual(self.store.get('m', 'a').tolist(), [0.]*3)
+        folder = os.path.dirname(self.store.path_of('m', 'a'))
+        self.assertEqual(len(os.listdir(folder)), 3)
+        self.store.put('m', 'a', np.zeros(1))
+        self.assertEqual(os.listdir(folder),
+                         [os.path.basename(self.store.path_of('m', 'a'))])
+
+
+class TestConeCylResults(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 's.study')
+        std = Study()
+        std.name = 's'
+        std.tmp_dir = self.tmpdir
+        std.study_dir = os.path.join(self.tmpdir, 's')
+        cc = ConeCyl()
+        cc.model_name = 'm1'
+        cc.study = std
+        cc.study_dir = std.study_dir
+        std.ccs.append(cc)
+        self.ids = np.arange(1, 30)*2
+        self.odb = random_odb(self.ids, 4, setnames=('CS_001', 'CS_002'))
+        cc.zdisp = [1., 2., 3.]
+        _read_outputs._read_outputs_entity(cc, self.odb,
+                                           fake_entity('CS', 1, self.ids))
+        std.save(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def reload(self, std):
+        std.save(self.path)
+        return Study().load(self.path)
+
+    def test_lazy_loading(self):
+        cc = Study().load(self.path).ccs[0]
+        self.assertFalse('zdisp' in cc.__dict__)
+        self.assertEqual(cc.zdisp, [1., 2., 3.])
+        dx = cc.field_outputs['CS_001']['Step-2']['dx']
+        self.assertTrue(isinstance(dx, np.memmap))
+        self.assertEqual(dx.shape, (3, len(self.ids)))
+
+    def test_reassigned_results(self):
+        std = Study().load(self.path)
+        cc = std.ccs[0]
+        cc.zdisp
+        for i in range(3):
+            cc.zdisp = [float(i)]*4
+        self.assertEqual(self.reload(std).ccs[0].zdisp, [2.]*4)
+
+    def test_results_changed_in_place(self):
+        std = Study().load(self.path)
+        cc = std.ccs[0]
+        cc.zdisp.append(4.)
+        cc.stress_min_num[1] = {'S11': 2.}
+        cc = self.reload(std).ccs[0]
+        self.assertEqual(cc.zdisp, [1., 2., 3., 4.])
+        self.assertEqual(cc.stress_min_num, {1: {'S11': 2.}})
+
+    def test_read_entity_after_loading(self):
+        std = Study().load(self.path)
+        _read_outputs._read_outputs_entity(std.ccs[0], self.odb,
+                                           fake_entity('CS', 2, self.ids))
+        cc = self.reload(std).ccs[0]
+        self.assertEqual(sorted(cc.field_outputs), ['CS_001', 'CS_002'])
+        self.assertEqual(cc.field_outputs['CS_002']['Step-2']['dz'].shape,
+                         (3, len(self.ids)))
+
+    def test_read_entity_again(self):
+        std = Study().load(self.path)
+        cc = std.ccs[0]
+        dz = cc.field_outputs['CS_001']['Step-2']['dz']
+        remove = os.remove
+        def locked(path):
+            if not path.endswith('.bin'):
+                return remove(path)
+            raise OSError('file in use: {0}'.format(path))
+        os.remove = locked
+        try:
+            _read_outputs._read_outputs_entity(cc, self.odb,
+                                               fake_entity('CS', 1, self.ids))
+        finally:
+            os.remove = remove
+        new = self.reload(std).ccs[0].field_outputs['CS_001']['Step-2']['dz']
+        self.assertEqual(new.tolist(), dz.tolist())
+
+    def test_small_pickle(self):
+        big = np.random.rand(100, 1000)
+        std = Study().load(self.path)
+        cc = std.ccs[0]
+        cc.field_outputs = {'CS_003': {'Step-2': {'dx': big}}}
+        std.save(self.path)
+        self.assertTrue(os.path.getsize(self.path) < big.nbytes/10)
+        cc = Study().load(self.path).ccs[0]
+        self.assertEqual(cc.field_outputs['CS_003']['Step-2']['dx'].tolist(),
+                         big.tolist())
@@ -0,0 +1,133 @@
+import os
+import sys
+import shutil
+import tempfile
+from unittest import TestCase
+
+from desicos.abaqus.utils import scheduler
+
+# fake abaqus: writes the .log of a job after a short run, the run fails if
+# the .inp contains FAIL and never ends if it contains HANG
+STUB = r'''
+import os
+import sys
+import time
+args = dict(a.split('=', 1) for a in sys.argv[1:] if '=' in a)
+job = args['job']
+if 'terminate' in sys.argv:
+    open(job + '.terminate', 'w').close()
+    sys.exit(0)
+with open('events.txt', 'a') as f:
+    f.write('start %s %r\n' % (job, time.time()))
+inp = open(args['input']).read()
+if 'HANG' in inp:
+    while True:
+        time.sleep(0.05)
+time.sleep(0.3)
+with open('events.txt', 'a') as f:
+    f.write('end %s %r\n' % (job, time.time()))
+with open(job + '.log', 'w') as f:
+    if 'FAIL' in inp:
+        f.write('Abaqus/Analysis exited with errors\n')
+    else:
+        f.write('End Abaqus/Standard Analysis\n')
+        f.write('Abaqus JOB %s COMPLETED\n' % job)
+'''
+
+
+class TestScheduler(TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        stub = os.path.join(self.tmpdir, 'abaqus_stub.py')
+        with open(stub, 'w') as f:
+            f.write(STUB)
+        self.abaqus_cmd = [sys.executable, stub]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_inputs(self, names, content=''):
+        for name in names:
+            with open(os.path.join(self.tmpdir, name + '.inp'), 'w') as f:
+                f.write(content)
+
+    def events(self):
+        path = os.path.join(self.tmpdir, 'events.txt')
+        if not os.path.isfile(path):
+            return []
+        events = []
+        with open(path) as f:
+            for line in f:
+                kind, name, t = line.split()
+                events.append((kind, name, float(t)))
+        return events
+
+    def run_scheduler(self, names, **kwargs):
+        kwargs.setdefault('poll_interval', 0.05)
+        return scheduler.Scheduler(self.tmpdir, names,
+                                   abaqus_cmd=self.abaqus_cmd,
+                                   **kwargs).run()
+
+    def test_lb_runs_alone_first(self):
+        names = ['S_1', 'S_2', 'S_lb']
+        self.write_inputs(names)
+        states = self.run_scheduler(names, max_jobs=3,
+                                    lb_dependents=['S_1', 'S_2'])
+        self.assertEqual(states, dict((n, scheduler.COMPLETED)
+                                      for n in names))
+        events = self.events()
+        lb_end = [t for k, n, t in events if k == 'end' and n == 'S_lb'][0]
+        starts = [(n, t) for k, n, t in events if k == 'start']
+        self.assertEqual(starts[0][0], 'S_lb')
+        for name, t in starts[1:]:
+            self.assertTrue(t >= lb_end)
+
+    def test_lb_errors_skip_dependents(self):
+        self.write_inputs(['S_1', 'S_2'])
+        self.write_inputs(['S_lb'], 'FAIL')
+        states = self.run_scheduler(['S_lb', 'S_1', 'S_2'], max_jobs=1,
+                                    lb_dependents=['S_1'])
+        self.assertEqual(states['S_lb'], scheduler.ERRORS)
+        self.assertEqual(states['S_1'], scheduler.SKIPPED)
+        self.assertEqual(states['S_2'], scheduler.COMPLETED)
+        self.assertEqual([n for k, n, t in self.events()],
+                         ['S_lb', 'S_lb', 'S_2', 'S_2'])
+
+    def test_no_lb_dependency(self):
+        names = ['S_lb', 'S_1', 'S_2']
+        self.write_inputs(names)
+        self.run_scheduler(names, max_jobs=3)
+        starts = [t for k, n, t in self.events() if k == 'start']
+        ends = [t for k, n, t in self.events() if k == 'end']
+        self.assertTrue(max(starts) < min(ends))
+
+    def test_max_jobs_and_tokens(self):
+        names = ['S_1', 'S_2', 'S_3', 'S_4']
+        self.write_inputs(names)
+        self.run_scheduler(names, max_jobs=4, max_tokens=10,
+                           tokens_per_job=5)
+        running = 0
+        max_running = 0
+        for kind, name, t in sorted(self.events(), key=lambda e: e[2]):
+            running += 1 if kind == 'start' else -1
+            max_running = max(max_running, running)
+        self.assertEqual(max_running, 2)
+
+    def test_completed_jobs_skipped(self):
+        names = ['S_lb', 'S_1']
+        self.write_inputs(names)
+        with open(os.path.join(self.tmpdir, 'S_lb.log'), 'w') as f:
+            f.write('End Abaqus/Standard Analysis\nCOMPLETED\n')
+        states = self.run_scheduler(names)
+        self.assertEqual(states['S_lb'], scheduler.COMPLETED)
+        self.assertEqual(states['S_1'], scheduler.COMPLETED)
+        self.assertEqual([n for k, n, t in self.events()], ['S_1', 'S_1'])
+
+    def test_timeout_kills_after_grace(self):
+        self.write_inputs(['S_1'], 'HANG')
+        states = self.run_scheduler(['S_1'], timeout=0.2,
+                                    terminate_timeout=0.3)
+        self.assertEqual(states['S_1'], scheduler.TIMEOUT)
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpdir,
+                                                    'S_1.terminate')))
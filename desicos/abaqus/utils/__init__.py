@@ -13,5 +13,8 @@ Includes all utilities functions that can be executed without Abaqus.
 .. automodule:: desicos.abaqus.utils.geom
     :members:
 
+.. automodule:: desicos.abaqus.utils.scheduler
+    :members:
+
 """
 from utils import *
@@ -1,6 +1,9 @@
 import sys
 import os
 import time
+import json
+import subprocess
+import tempfile
 def check_stop(rf3s):
     criterion1 = 0.01 # % to consider a local  buckling drop
     criterion2 = 0.30 # % to consider a global buckling drop
@@ -32,40 +35,421 @@ def check_stop(rf3s):
     else:
         return False
 
+class DropDetector(object):
+    """Incremental version of check_stop()
+
+    The values are given one at a time with add(), after each call
+    ``stop`` is equal to check_stop() of all the values added so far. As
+    in check_stop() the last value only counts once the next one arrives.
+    """
+    def __init__(self, criterion1=0.01, criterion2=0.30):
+        self.criterion1 = criterion1
+        self.criterion2 = criterion2
+        self.num = 0
+        self.stop = False
+        self.drops = 0
+        self.grow = True
+        self.peak = None
+        self.nadir = None
+        self.last = None
+
+    def add(self, rf3):
+        rf3 = abs(rf3)
+        self.num += 1
+        if self.last is None:
+            self.peak = rf3
+            self.nadir = rf3
+        else:
+            self._process(self.last)
+        self.last = rf3
+        return self.stop
+
+    def _process(self, rf3):
+        # the same steps of the loop in check_stop(), which are
+        # independent of the normalization by the maximum value
+        c1 = self.criterion1
+        c2 = self.criterion2
+        if self.stop:
+            return
+        if self.grow and rf3 < (1-c1)*self.peak:
+            self.grow = False
+            self.nadir = self.peak
+            self.drops += 1
+        if not self.grow and rf3 < (1-c2)*self.peak:
+            self.stop = True # global buckling
+            return
+        if self.grow and rf3 > self.peak:
+            self.peak = rf3
+        if not self.grow and rf3 < self.nadir:
+            self.nadir = rf3
+        if not self.grow and rf3 > (1+c1)*self.nadir:
+            self.peak = self.nadir
+            self.grow = True
+        if self.drops > 1:
+            self.stop = True
+
+class DatReader(object):
+    """Reads the (RF3, U3) values appended to a .dat file since the last call
+
+    The file offset is kept between the calls, so that only the new
+    output is parsed. If the file is truncated or replaced (a new run of
+    the job) it is read again from the start and ``restarted`` is set.
+    """
+    rf3_column = 2
+    u3_column = 3
+    def __init__(self, dat_path):
+        self.dat_path = dat_path
+        self.offset = 0
+        self.size = 0
+        self.lines_to_value = 0
+        self.restarted = False
+
+    def read(self):
+        self.restarted = False
+        if not os.path.isfile(self.dat_path):
+            return []
+        size = os.path.getsize(self.dat_path)
+        if size < self.size:
+            self.offset = 0
+            self.lines_to_value = 0
+            self.restarted = True
+        self.size = size
+        if size == self.offset:
+            return []
+        dat_file = open(self.dat_path, 'rb')
+        dat_file.seek(self.offset)
+        data = dat_file.read(size - self.offset)
+        dat_file.close()
+        # only the complete lines are consumed
+        end = data.rfind(b'\n') + 1
+        self.offset += end
+        values = []
+        for line in data[:end].decode('latin-1').splitlines():
+            if self.lines_to_value > 0:
+                self.lines_to_value -= 1
+                if self.lines_to_value == 0:
+                    values.append(self.parse(line))
+            elif line.find('NODE FOOT-') > -1:
+                self.lines_to_value = 3
+        return values
+
+    def parse(self, line):
+        fields = line.split()
+        u3 = None
+        if len(fields) > self.u3_column:
+            u3 = float(fields[self.u3_column])
+        return float(fields[self.rf3_column]), u3
+
 def read_rf3( output_dir, jobname ):
     dat_path = os.path.join( output_dir, jobname + '.dat')
-    if not os.path.isfile( dat_path ):
-        return []
-    dat_file = open( dat_path, 'r' )
-    lines = iter(dat_file.readlines())
-    rf3s = []
-    while True:
-        try:
-            line = lines.next()
-        except StopIteration:
-            break
-        if line.find('NODE FOOT-') > -1:
-            lines.next()
-            lines.next()
-            line = lines.next()
-            rf3s.append( float(line.split()[2]) )
-    return rf3s
-
-def stopper( output_dir, jobname ):
+    return [rf3 for rf3, u3 in DatReader(dat_path).read()]
+
+class Policy(object):
+    """Base class of the stopping policies
+
+    A policy receives the history one (RF3, U3) pair at a time with
+    update(), which returns a string with the reason to stop the job or
+    None. The values are used in absolute value, U3 may be None.
+    """
+    name = 'policy'
+    def update(self, rf3, u3):
+        raise NotImplementedError
+
+    def config(self):
+        return dict(type=self.name)
+
+class BucklingDropPolicy(Policy):
+    """The criteria of check_stop(): a global drop larger than criterion2
+    or more than one local drop larger than criterion1"""
+    name = 'buckling_drop'
+    def __init__(self, criterion1=0.01, criterion2=0.30):
+        self.detector = DropDetector(criterion1, criterion2)
+
+    def update(self, rf3, u3):
+        d = self.detector
+        if d.stop:
+            return None
+        drops = d.drops
+        if d.add(rf3):
+            if d.drops > 1 and drops <= 1:
+                return 'more than one local buckling drop'
+            return 'global buckling drop larger than %g%%' % (
+                   100*d.criterion2)
+
+    def config(self):
+        return dict(type=self.name, criterion1=self.detector.criterion1,
+                    criterion2=self.detector.criterion2)
+
+class LoadDropPolicy(Policy):
+    """Load drop larger than ``drop`` times the maximum load, once the
+    load decreased after its first peak"""
+    name = 'load_drop'
+    def __init__(self, drop=0.30):
+        self.drop = drop
+        self.max_load = 0.
+        self.peaked = False
+
+    def update(self, rf3, u3):
+        rf3 = abs(rf3)
+        if rf3 < self.max_load:
+            self.peaked = True
+        self.max_load = max(self.max_load, rf3)
+        if self.peaked and rf3 < (1-self.drop)*self.max_load:
+            return 'load drop of %g%% after the peak load %g' % (
+                   100*(1 - rf3/self.max_load), self.max_load)
+
+    def config(self):
+        return dict(type=self.name, drop=self.drop)
+
+class DropCountPolicy(Policy):
+    """Number of load drops larger than ``criterion`` (relative to the
+    previous peak) reaching ``num_drops``"""
+    name = 'drop_count'
+    def __init__(self, num_drops=2, criterion=0.01):
+        self.num_drops = num_drops
+        self.criterion = criterion
+        self.drops = 0
+        self.grow = True
+        self.peak = None
+        self.nadir = None
+
+    def update(self, rf3, u3):
+        c = self.criterion
+        rf3 = abs(rf3)
+        if self.peak is None:
+            self.peak = self.nadir = rf3
+            return None
+        if self.grow:
+            if rf3 < (1-c)*self.peak:
+                self.grow = False
+                self.nadir = rf3
+                self.drops += 1
+                if self.drops >= self.num_drops:
+                    return '%d load drops larger than %g%%' % (self.drops,
+                                                               100*c)
+            else:
+                self.peak = max(self.peak, rf3)
+        else:
+            self.nadir = min(self.nadir, rf3)
+            if rf3 > (1+c)*self.nadir:
+                self.grow = True
+                self.peak = rf3
+        return None
+
+    def config(self):
+        return dict(type=self.name, num_drops=self.num_drops,
+                    criterion=self.criterion)
+
+class EndShorteningPolicy(Policy):
+    """End-shortening U3 larger than ``limit``"""
+    name = 'end_shortening'
+    def __init__(self, limit):
+        self.limit = limit
+
+    def update(self, rf3, u3):
+        if u3 is not None and abs(u3) > self.limit:
+            return 'end-shortening %g larger than %g' % (abs(u3), self.limit)
+
+    def config(self):
+        return dict(type=self.name, limit=self.limit)
+
+class StiffnessRatioPolicy(Policy):
+    """Secant stiffness RF3/U3 smaller than ``ratio`` times the initial
+    one, taken at the first point with U3 larger than ``min_u3``"""
+    name = 'stiffness_ratio'
+    def __init__(self, ratio=0.5, min_u3=0.):
+        self.ratio = ratio
+        self.min_u3 = min_u3
+        self.k0 = None
+
+    def update(self, rf3, u3):
+        if u3 is None or abs(u3) <= self.min_u3:
+            return None
+        k = abs(rf3)/abs(u3)
+        if self.k0 is None:
+            self.k0 = k
+            return None
+        if k < self.ratio*self.k0:
+            return 'stiffness ratio %g smaller than %g' % (k/self.k0,
+                                                           self.ratio)
+
+    def config(self):
+        return dict(type=self.name, ratio=self.ratio, min_u3=self.min_u3)
+
+POLICIES = dict((cls.name, cls) for cls in (BucklingDropPolicy,
+                LoadDropPolicy, DropCountPolicy, EndShorteningPolicy,
+                StiffnessRatioPolicy))
+
+def create_policies(config=None):
+    """Creates the policies from a list of dicts such as
+    ``[{'type': 'load_drop', 'drop': 0.2}, {'type': 'end_shortening',
+    'limit': 1.5}]``, from a JSON file with this list or returns policies
+    given as Policy objects. The default is [BucklingDropPolicy()].
+    """
+    if config is None:
+        return [BucklingDropPolicy()]
+    if isinstance(config, str):
+        with open(config) as f:
+            config = json.load(f)
+    policies = []
+    for c in config:
+        if isinstance(c, Policy):
+            policies.append(c)
+            continue
+        c = dict(c)
+        name = c.pop('type')
+        if name not in POLICIES:
+            raise ValueError('Invalid stopping policy: %s' % name)
+        policies.append(POLICIES[name](**dict((str(k), v)
+                                              for k, v in c.items())))
+    return policies
+
+def status_path( output_dir, jobname ):
+    return os.path.join( output_dir, jobname + '_stop.json')
+
+def write_status( output_dir, jobname, status ):
+    """Writes the status dict of a job as JSON"""
+    path = status_path( output_dir, jobname )
+    # a unique temporary file, the status is replaced only when complete
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                               prefix=os.path.basename(path) + '.',
+                               suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(status, f, indent=1, sort_keys=True)
+    if os.name == 'nt' and os.path.isfile(path):
+        os.remove(path)
+    os.rename(tmp, path)
+
+class JobMonitor(object):
+    """Keeps the RF3/U3 history and the stopping policies of a job
+
+    ``policies`` is given to create_policies(), new policies are created
+    for each JobMonitor. The first policy giving a reason stops the job.
+    """
+    def __init__(self, output_dir, jobname, policies=None):
+        self.output_dir = output_dir
+        self.jobname = jobname
+        self.reader = DatReader(os.path.join(output_dir, jobname + '.dat'))
+        self.config = policies
+        self.reset()
+
+    def reset(self):
+        self.policies = create_policies(self.config)
+        self.rf3s = []
+        self.u3s = []
+        self.policy = None
+        self.reason = None
+
+    def update(self):
+        """Parses the new output, returns the reason to stop the job or
+        None"""
+        new = self.reader.read()
+        if self.reader.restarted:
+            self.reset()
+        for rf3, u3 in new:
+            self.rf3s.append(rf3)
+            self.u3s.append(u3)
+            if self.reason is not None:
+                continue
+            for policy in self.policies:
+                reason = policy.update(rf3, u3)
+                if reason is not None and self.reason is None:
+                    self.policy = policy
+                    self.reason = reason
+        return self.reason
+
+    def status(self):
+        """Machine-readable summary of the monitored history"""
+        rf3s = [abs(rf3) for rf3 in self.rf3s]
+        status = dict(job=self.jobname,
+                      stopped=self.reason is not None,
+                      reason=self.reason,
+                      policy=None,
+                      policies=[p.config() for p in self.policies],
+                      num_increments=len(rf3s),
+                      max_rf3=max(rf3s) if rf3s else None,
+                      last_rf3=self.rf3s[-1] if rf3s else None,
+                      last_u3=self.u3s[-1] if rf3s else None,
+                      time=time.ctime())
+        if self.policy is not None:
+            status['policy'] = self.policy.config()
+        return status
+
+def terminate( output_dir, jobname, delete_dat=True, abaqus_cmd='abaqus',
+               wait=30. ):
+    """Issues ``abaqus terminate`` for the job
+
+    ``abaqus_cmd`` may be a command with arguments given as a list. The
+    function returns once the command is issued, unless the .dat file is
+    deleted, which happens after waiting ``wait`` seconds for the job to
+    exit.
+    """
+    if isinstance(abaqus_cmd, (list, tuple)):
+        cmd = list(abaqus_cmd)
+    else:
+        cmd = [abaqus_cmd]
+    try:
+        # abaqus is a batch file in Windows
+        subprocess.call(cmd + ['terminate', 'job=%s' % jobname],
+                        cwd=output_dir, shell=(os.name == 'nt'))
+    except OSError:
+        pass
+    if not delete_dat:
+        return
+    time.sleep(wait)
+    dat_path = os.path.join( output_dir, jobname + '.dat')
+    if os.name == 'nt':
+        os.system('del %s' % dat_path)
+    else:
+        os.system('rm %s' % dat_path)
+
+def stopper( output_dir, jobname, abaqus_cmd='abaqus' ):
     if jobname[-3:] == '_lb':
         return False
     rf3s = read_rf3( output_dir, jobname )
     if check_stop(rf3s):
-        os.system('abaqus terminate job=%s' % jobname)
-        time.sleep(30)
-        dat_path = os.path.join( output_dir, jobname + '.dat')
-        if os.name == 'nt':
-            os.system('del %s' % dat_path)
-        else:
-            os.system('rm %s' % dat_path)
+        terminate( output_dir, jobname, abaqus_cmd=abaqus_cmd )
 
-if __name__ == '__main__':
-    output_dir, jobname = sys.argv[1:]
-    stopper( output_dir, jobname )
+def monitor( output_dir, jobnames, interval=30., policies=None,
+             abaqus_cmd='abaqus' ):
+    """Watches many jobs from one process until they are over
 
+    Each .dat file is polled every ``interval`` seconds, unchanged files
+    are not read and only the appended output of the others is parsed.
+    The reason why a job was stopped is written with write_status() and
+    the monitoring goes on as soon as the terminate command is issued.
+    """
+    from scheduler import job_state, PENDING, RUNNING
+    monitors = [JobMonitor(output_dir, jobname, policies)
+                for jobname in jobnames if jobname[-3:] != '_lb']
+    while monitors:
+        for m in list(monitors):
+            if m.update():
+                print('Stopping: {0} at {1}, {2}'.format(m.jobname,
+                      time.ctime(), m.reason))
+                write_status( output_dir, m.jobname, m.status() )
+                terminate( output_dir, m.jobname, delete_dat=False,
+                           abaqus_cmd=abaqus_cmd )
+                monitors.remove(m)
+            elif job_state(output_dir, m.jobname) not in (PENDING, RUNNING):
+                monitors.remove(m)
+        if monitors:
+            time.sleep(interval)
 
+if __name__ == '__main__':
+    output_dir = sys.argv[1]
+    jobnames = sys.argv[2:]
+    policies = None
+    abaqus_cmd = 'abaqus'
+    for arg in list(jobnames):
+        if arg.startswith('stop_policies='):
+            policies = arg.split('=', 1)[1]
+            jobnames.remove(arg)
+        elif arg.startswith('abaqus_cmd='):
+            abaqus_cmd = arg.split('=', 1)[1]
+            jobnames.remove(arg)
+    if len(jobnames) == 1 and policies is None:
+        stopper( output_dir, jobnames[0], abaqus_cmd=abaqus_cmd )
+    else:
+        monitor( output_dir, jobnames, policies=policies,
+                 abaqus_cmd=abaqus_cmd )
@@ -0,0 +1,201 @@
+r"""
+=======================================================
+ODB histories (:mod:`desicos.abaqus.utils.odb_history`)
+=======================================================
+
+.. currentmodule:: desicos.abaqus.utils.odb_history
+
+Extraction of the load-displacement history (or of the eigenvalues of a
+linear buckling analysis) of an ODB and its cache in a ``.npz`` file
+beside the ODB. The cache is keyed by the fingerprint of the ODB (path,
+size and modification time) and is ignored once the ODB changes. It can be
+removed with :func:`.invalidate` and :func:`.cache_stats` counts the
+cache hits and misses of the current process.
+
+The module does not depend on :mod:`desicos`, it can be run as a worker
+with ``abaqus python``::
+
+    abaqus python odb_history.py model.odb Step-1 Step-2 0
+
+which writes ``model_history.npz`` (the last argument is ``1`` for linear
+buckling analyses).
+
+"""
+import os
+import sys
+
+import numpy as np
+
+HISTORY_REGION = 'Node ASSEMBLY.2'
+FINGERPRINT_KEYS = ('odb_path', 'odb_size', 'odb_mtime')
+
+_stats = dict(hits=0, misses=0, stale=0, writes=0, invalidations=0)
+
+
+def _count(stats, key):
+    if key in stats:
+        stats[key] += 1
+
+
+def extract_history(odb, step1_name, step2_name, linear_buckling):
+    """Reads the history of an opened ODB
+
+    Parameters
+    ----------
+    odb : Odb
+        The opened ODB.
+    step1_name, step2_name : str
+        The names of the first and second steps.
+    linear_buckling : bool
+        If the eigenvalues of the first step are read instead of the
+        load-displacement history of the second step.
+
+    Returns
+    -------
+    hist : dict
+        With the key ``'eigenvalues'`` for linear buckling analyses, or
+        ``'U3'`` and ``'RF3'`` with the ``(time, value)`` pairs of the
+        history outputs.
+
+    """
+    if linear_buckling:
+        pcrs = []
+        for frame in odb.steps[step1_name].frames:
+            description = frame.description
+            if description.find('EigenValue') > -1:
+                pcr = float(description.split('EigenValue =')[1].strip())
+                pcrs.append(pcr)
+        return dict(eigenvalues=np.array(pcrs, dtype=float))
+    step = odb.steps[step2_name]
+    historyRegion = step.historyRegions[HISTORY_REGION]
+    hist = {}
+    for key in ('U3', 'RF3'):
+        data = historyRegion.historyOutputs[key].data
+        hist[key] = np.array(data, dtype=float).reshape(-1, 2)
+    return hist
+
+
+def cache_path(odb_path):
+    """Path of the ``.npz`` history cache of an ODB"""
+    return os.path.splitext(odb_path)[0] + '_history.npz'
+
+
+def fingerprint(odb_path):
+    """Absolute path, size and modification time of an ODB"""
+    st = os.stat(odb_path)
+    return dict(odb_path=os.path.abspath(odb_path), odb_size=st.st_size,
+                odb_mtime=st.st_mtime)
+
+
+def save_history(odb_path, hist):
+    """Writes the history of an ODB in its cache"""
+    path = cache_path(odb_path)
+    tmp = path + '.tmp'
+    kwargs = dict(hist)
+    kwargs.update(fingerprint(odb_path))
+    with open(tmp, 'wb') as f:
+        np.savez(f, **kwargs)
+    if os.path.isfile(path):
+        os.remove(path)
+    os.rename(tmp, path)
+    _stats['writes'] += 1
+
+
+def load_history(odb_path, count=True):
+    """Reads the cached history of an ODB
+
+    Parameters
+    ----------
+    odb_path : str
+        The ODB path.
+    count : bool, optional
+        Counts the read in :func:`.cache_stats`. ``False`` when reading the
+        cache just written by a worker process.
+
+    Returns
+    -------
+    hist : dict or None
+        The history given by :func:`.extract_history`, ``None`` if there
+        is no cache or if its fingerprint differs from the one of the ODB.
+
+    """
+    stats = _stats if count else {}
+    path = cache_path(odb_path)
+    if not os.path.isfile(path) or not os.path.isfile(odb_path):
+        _count(stats, 'misses')
+        return None
+    fp = fingerprint(odb_path)
+    try:
+        tmp = np.load(path)
+    except Exception:
+        _count(stats, 'stale')
+        return None
+    try:
+        if (not all(k in tmp.files for k in FINGERPRINT_KEYS)
+            or str(tmp['odb_path']) != fp['odb_path']
+            or int(tmp['odb_size']) != fp['odb_size']
+            or float(tmp['odb_mtime']) != fp['odb_mtime']):
+            _count(stats, 'stale')
+            return None
+        _count(stats, 'hits')
+        return dict((k, tmp[k]) for k in tmp.files
+                    if k not in FINGERPRINT_KEYS)
+    finally:
+        tmp.close()
+
+
+def invalidate(odb_path):
+    """Removes the cached history of an ODB
+
+    Returns
+    -------
+    removed : bool
+        If a cache file was found.
+
+    """
+    path = cache_path(odb_path)
+    if not os.path.isfile(path):
+        return False
+    os.remove(path)
+    _stats['invalidations'] += 1
+    return True
+
+
+def cache_stats(reset=False):
+    """Statistics of the history cache in the current process
+
+    Parameters
+    ----------
+    reset : bool, optional
+        Sets the counters to zero after reading them.
+
+    Returns
+    -------
+    stats : dict
+        The counters ``'hits'``, ``'misses'`` (no cache file), ``'stale'``
+        (cache of a different or modified ODB), ``'writes'`` and
+        ``'invalidations'``.
+
+    """
+    stats = dict(_stats)
+    if reset:
+        for k in _stats:
+            _stats[k] = 0
+    return stats
+
+
+def main(argv):
+    from odbAccess import openOdb
+
+    odb_path, step1_name, step2_name, linear_buckling = argv[:4]
+    odb = openOdb(path=odb_path, readOnly=True)
+    try:
+        hist = extract_history(odb, step1_name, step2_name,
+                               linear_buckling == '1')
+    finally:
+        odb.close()
+    save_history(odb_path, hist)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,510 @@
+r"""
+=====================================================
+Job scheduler (:mod:`desicos.abaqus.utils.scheduler`)
+=====================================================
+
+.. currentmodule:: desicos.abaqus.utils.scheduler
+
+Runs the Abaqus jobs of a study concurrently. The number of simultaneous
+jobs, the cores per job and the available licence tokens are configurable.
+The queue is ordered by priority (the linear buckling ``_lb`` model
+first), jobs already finished are skipped and each job may have a timeout.
+The jobs with linear buckling mode-based imperfections read the
+imperfection file (``.fil``) written by the ``_lb`` job, so they are held
+in the queue until it completes and are skipped if it ends with errors
+(cf. ``lb_dependents``).
+
+The module does not depend on :mod:`desicos`, it is copied to the study
+folder together with ``job_stopper.py`` and used by the run file written
+by :func:`.print_run_file`, which accepts ``key=value`` options in its
+command line, for example::
+
+    abaqus python run_study.py cpus=4 max_jobs=8 max_tokens=50
+
+A fake ``abaqus`` executable can be given through ``abaqus_cmd``, which
+allows the scheduler to be used without Abaqus.
+
+"""
+import os
+import time
+import heapq
+import signal
+import subprocess
+
+PENDING = 'pending'
+RUNNING = 'running'
+COMPLETED = 'completed'
+ERRORS = 'errors'
+NO_INPUT = 'no_input'
+TIMEOUT = 'timeout'
+STOPPED = 'stopped'
+SKIPPED = 'skipped'
+
+TAIL_SIZE = 4096
+
+
+def abaqus_tokens(cpus):
+    """Licence tokens required by an Abaqus/Standard job
+
+    Parameters
+    ----------
+    cpus : int
+        Number of cores of the job.
+
+    Returns
+    -------
+    tokens : int
+        ``int(5*cpus**0.422)``.
+
+    """
+    return int(5*max(cpus, 1)**0.422)
+
+
+def read_tail(path, size=TAIL_SIZE):
+    """Reads the last lines of a file without reading the whole file
+
+    Parameters
+    ----------
+    path : str
+        The file path.
+    size : int, optional
+        Number of bytes read from the end of the file.
+
+    Returns
+    -------
+    lines : list
+        The lines found in the last ``size`` bytes, ``[]`` if the file does
+        not exist.
+
+    """
+    if not os.path.isfile(path):
+        return []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        f.seek(max(end - size, 0))
+        data = f.read()
+    lines = data.decode('latin-1').splitlines()
+    if end > size:
+        lines = lines[1:]
+    return [line for line in lines if line.strip()]
+
+
+def job_state(output_dir, job_name):
+    """State of a job given by its input and log files
+
+    Parameters
+    ----------
+    output_dir : str
+        Folder of the job files.
+    job_name : str
+        The job name.
+
+    Returns
+    -------
+    state : str
+        One of ``'no_input'``, ``'completed'``, ``'errors'``, ``'running'``
+        (log file existing but not finished) or ``'pending'``.
+
+    """
+    if not os.path.isfile(os.path.join(output_dir, job_name + '.inp')):
+        return NO_INPUT
+    log_path = os.path.join(output_dir, job_name + '.log')
+    if not os.path.isfile(log_path):
+        return PENDING
+    lines = read_tail(log_path)
+    if len(lines) > 1:
+        if lines[-2].find('End Abaqus/Standard Analysis') > -1:
+            return COMPLETED
+        if lines[-1].find('Abaqus/Analysis exited with errors') > -1:
+            return ERRORS
+    return RUNNING
+
+
+def is_lb_job(job_name):
+    """If the job is the linear buckling analysis of a study"""
+    return job_name[-3:] == '_lb'
+
+
+def job_priority(job_name):
+    """Default priority, the lower the earlier: ``_lb`` models go first"""
+    if is_lb_job(job_name):
+        return 0
+    return 1
+
+
+class Job(object):
+    """A job in the queue of the :class:`.Scheduler`"""
+    def __init__(self, name, priority, cpus, tokens, timeout):
+        self.name = name
+        self.priority = priority
+        self.cpus = cpus
+        self.tokens = tokens
+        self.timeout = timeout
+        self.state = PENDING
+        self.process = None
+        self.monitor = None
+        self.last_monitor_time = 0.
+        self.start_time = None
+        self.end_time = None
+        self.terminate_time = None
+        self.depends_on = []
+
+
+class Scheduler(object):
+    """Concurrent runner of Abaqus jobs
+
+    Parameters
+    ----------
+    output_dir : str
+        Folder with the ``.inp`` files, where the jobs are run.
+    job_names : list
+        The job names.
+    max_jobs : int, optional
+        Maximum number of simultaneous jobs.
+    cpus_per_job : int, optional
+        Cores given to each job through ``cpus=``.
+    max_tokens : int or None, optional
+        Available licence tokens, no limit if ``None``.
+    tokens_per_job : int or None, optional
+        Tokens used by each job, by default given by
+        :func:`.abaqus_tokens`.
+    timeout : float or None, optional
+        Maximum duration of a job in seconds, the job is terminated when it
+        is exceeded.
+    abaqus_cmd : str or list, optional
+        The Abaqus executable, it may be a command with arguments.
+    extra_args : list, optional
+        Additional arguments passed to each Abaqus job.
+    poll_interval : float, optional
+        Seconds between the checks of the running jobs.
+    use_stopper : bool, optional
+        Watches the ``.dat`` files of the running jobs with
+        :class:`.JobMonitor` and terminates the jobs for which one of the
+        stopping policies is met. The reason is written to the
+        ``<job>_stop.json`` status file.
+    stop_policies : list or str, optional
+        The stopping policies, given to :func:`.create_policies`: a list of
+        dicts or a JSON file, by default the buckling-drop criteria of
+        :func:`.check_stop`.
+    stopper_interval : float, optional
+        Seconds between the reads of the ``.dat`` file of each job.
+    terminate_timeout : float or None, optional
+        Seconds given to a job to exit after ``abaqus terminate``, its
+        process tree is killed afterwards. By default three times
+        ``stopper_interval``.
+    lb_dependents : list, optional
+        Names of the jobs reading the results of the ``_lb`` job, i.e. the
+        models with linear buckling mode-based imperfections. They are held
+        until the ``_lb`` job is completed and skipped if it does not
+        complete. The other jobs do not wait for it.
+    rerun_errors : bool, optional
+        Reruns the jobs whose last run exited with errors, which are
+        otherwise skipped.
+    priority : function, optional
+        Gives the priority of a job from its name, the lower the earlier,
+        the default is :func:`.job_priority`.
+
+    """
+    def __init__(self, output_dir, job_names, max_jobs=1, cpus_per_job=1,
+                 max_tokens=None, tokens_per_job=None, timeout=None,
+                 abaqus_cmd='abaqus', extra_args=(), poll_interval=5.,
+                 use_stopper=False, stop_policies=None,
+                 stopper_interval=30., terminate_timeout=None,
+                 lb_dependents=(), rerun_errors=False,
+                 priority=job_priority):
+        self.output_dir = output_dir
+        self.max_jobs = max(int(max_jobs), 1)
+        self.cpus_per_job = max(int(cpus_per_job), 1)
+        self.max_tokens = max_tokens
+        if tokens_per_job is None:
+            tokens_per_job = abaqus_tokens(self.cpus_per_job)
+        if max_tokens is not None and tokens_per_job > max_tokens:
+            raise ValueError('tokens_per_job > max_tokens')
+        self.abaqus_cmd = abaqus_cmd
+        self.extra_args = list(extra_args)
+        self.poll_interval = poll_interval
+        self.use_stopper = use_stopper
+        self.stop_policies = stop_policies
+        self.stopper_interval = stopper_interval
+        if terminate_timeout is None:
+            terminate_timeout = 3*stopper_interval
+        self.terminate_timeout = terminate_timeout
+        self.rerun_errors = rerun_errors
+        self.jobs = []
+        for name in job_names:
+            self.jobs.append(Job(name, priority(name), self.cpus_per_job,
+                                 tokens_per_job, timeout))
+        lb_jobs = [job for job in self.jobs if is_lb_job(job.name)]
+        for job in self.jobs:
+            if job.name in lb_dependents and not is_lb_job(job.name):
+                job.depends_on = lb_jobs
+        self.running = []
+        self._queue = []
+
+    def _command(self, *args):
+        if isinstance(self.abaqus_cmd, (list, tuple)):
+            cmd = list(self.abaqus_cmd)
+        else:
+            cmd = [self.abaqus_cmd]
+        return cmd + list(args)
+
+    def _popen(self, cmd):
+        # abaqus is a batch file in Windows; each job gets its own process
+        # group so that the solver started by the driver can be killed
+        if os.name == 'nt':
+            return subprocess.Popen(cmd, cwd=self.output_dir, shell=True,
+                    creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
+        return subprocess.Popen(cmd, cwd=self.output_dir,
+                                preexec_fn=os.setsid)
+
+    def tokens_in_use(self):
+        return sum(job.tokens for job in self.running)
+
+    def _can_start(self, job):
+        if len(self.running) >= self.max_jobs:
+            return False
+        if self.max_tokens is None:
+            return True
+        return self.tokens_in_use() + job.tokens <= self.max_tokens
+
+    def _dependency_state(self, job):
+        """``None`` if the job can start, ``'pending'`` while a job it
+        depends on is not over, otherwise the state of the failed job"""
+        for dep in job.depends_on:
+            if dep.state in (PENDING, RUNNING):
+                return PENDING
+            if dep.state != COMPLETED:
+                return dep.state
+        return None
+
+    def _next_job(self):
+        """Removes from the queue and returns the next job to start
+
+        The jobs waiting for a dependency are passed over, the ones whose
+        dependency failed are skipped. Returns ``None`` if no job can start
+        now.
+
+        """
+        for item in sorted(self._queue):
+            job = item[2]
+            dep_state = self._dependency_state(job)
+            if dep_state == PENDING:
+                continue
+            if dep_state is not None:
+                self._queue.remove(item)
+                heapq.heapify(self._queue)
+                job.state = SKIPPED
+                print('Skipping: {0} at {1}, a required job ended with '
+                      'state {2}'.format(job.name, time.ctime(), dep_state))
+                continue
+            if not self._can_start(job):
+                return None
+            self._queue.remove(item)
+            heapq.heapify(self._queue)
+            return job
+        return None
+
+    def _enqueue(self):
+        self._queue = []
+        for order, job in enumerate(self.jobs):
+            state = job_state(self.output_dir, job.name)
+            if state == NO_INPUT:
+                print('Not found .inp  for: {0} at {1}'.format(job.name,
+                      time.ctime()))
+                job.state = NO_INPUT
+                continue
+            if state == COMPLETED:
+                print('Skipping: {0} at {1}'.format(job.name, time.ctime()))
+                job.state = COMPLETED
+                continue
+            if state == ERRORS and not self.rerun_errors:
+                print('Skipping (with ERRORS): {0} at {1}'.format(job.name,
+                      time.ctime()))
+                job.state = ERRORS
+                continue
+            job.state = PENDING
+            heapq.heappush(self._queue, (job.priority, order, job))
+
+    def _start(self, job):
+        lck = os.path.join(self.output_dir, job.name + '.lck')
+        if os.path.isfile(lck):
+            os.remove(lck)
+        log_path = os.path.join(self.output_dir, job.name + '.log')
+        if os.path.isfile(log_path):
+            os.remove(log_path)
+        input_file = os.path.join(self.output_dir, job.name + '.inp')
+        cmd = self._command('job={0}'.format(job.name),
+                            'input={0}'.format(input_file),
+                            'cpus={0:d}'.format(job.cpus),
+                            'interactive', *self.extra_args)
+        job.process = self._popen(cmd)
+        job.start_time = time.time()
+        job.state = RUNNING
+        self.running.append(job)
+        print('Started  ABAQUS for: {0} at {1}'.format(job.name,
+              time.ctime()))
+
+    def _terminate(self, job, state):
+        """Asks Abaqus to terminate the job
+
+        The job stays in :attr:`running`, holding its tokens, until its
+        process exits or ``terminate_timeout`` is exceeded.
+
+        """
+        job.state = state
+        job.terminate_time = time.time()
+        try:
+            subprocess.call(self._command('terminate',
+                                          'job={0}'.format(job.name)),
+                            cwd=self.output_dir, shell=(os.name == 'nt'))
+        except OSError:
+            pass
+
+    def _kill(self, job):
+        """Kills the process tree of a job"""
+        if job.process.poll() is not None:
+            return
+        print('Killing: {0} at {1}'.format(job.name, time.ctime()))
+        try:
+            if os.name == 'nt':
+                subprocess.call(['taskkill', '/F', '/T', '/PID',
+                                 str(job.process.pid)])
+            else:
+                os.killpg(job.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        if job.process.poll() is None:
+            job.process.kill()
+        job.process.wait()
+
+    def _run_stopper(self, job):
+        """Returns the reason to stop the job or ``None``"""
+        if not self.use_stopper or job.name[-3:] == '_lb':
+            return None
+        now = time.time()
+        if now - job.last_monitor_time < self.stopper_interval:
+            return None
+        job.last_monitor_time = now
+        if job.monitor is None:
+            from job_stopper import JobMonitor
+            job.monitor = JobMonitor(self.output_dir, job.name,
+                                     self.stop_policies)
+        return job.monitor.update()
+
+    def _check(self, job):
+        """Updates a running job, returns ``True`` if it is over"""
+        if job.terminate_time is not None:
+            if job.process.poll() is None:
+                if time.time() - job.terminate_time <= self.terminate_timeout:
+                    return False
+                self._kill(job)
+            return True
+        if job.process.poll() is None:
+            if (job.timeout is not None
+                and time.time() - job.start_time > job.timeout):
+                print('TIMEOUT: {0} at {1}'.format(job.name, time.ctime()))
+                self._terminate(job, TIMEOUT)
+                return False
+            reason = self._run_stopper(job)
+            if reason is not None:
+                from job_stopper import write_status
+                write_status(self.output_dir, job.name, job.monitor.status())
+                print('Stopped: {0} at {1}, {2}'.format(job.name,
+                      time.ctime(), reason))
+                self._terminate(job, STOPPED)
+                return False
+            return False
+        state = job_state(self.output_dir, job.name)
+        if state == COMPLETED:
+            job.state = COMPLETED
+            print('Finished: {0} at {1}'.format(job.name, time.ctime()))
+        else:
+            job.state = ERRORS
+            print('Finished with ERRORS: {0} at {1}'.format(job.name,
+                  time.ctime()))
+        return True
+
+    def run(self):
+        """Runs all the pending jobs
+
+        Returns
+        -------
+        states : dict
+            The final state of each job, with the values ``'completed'``,
+            ``'errors'``, ``'timeout'``, ``'stopped'``, ``'skipped'`` (a
+            required job did not complete) or ``'no_input'``.
+
+        """
+        self._enqueue()
+        total = len(self._queue)
+        counter = 0
+        try:
+            while self._queue or self.running:
+                while True:
+                    job = self._next_job()
+                    if job is None:
+                        break
+                    counter += 1
+                    print('____________________')
+                    print('')
+                    print('Counter: job {0:05d} out of {1:05d}'.format(
+                          counter, total))
+                    self._start(job)
+                if not self.running:
+                    break
+                time.sleep(self.poll_interval)
+                for job in list(self.running):
+                    if self._check(job):
+                        job.end_time = time.time()
+                        self.running.remove(job)
+        finally:
+            for job in self.running:
+                if job.terminate_time is None:
+                    self._terminate(job, job.state)
+            end = time.time() + self.terminate_timeout
+            for job in self.running:
+                while job.process.poll() is None and time.time() < end:
+                    time.sleep(min(self.poll_interval, 1.))
+                self._kill(job)
+        return dict((job.name, job.state) for job in self.jobs)
+
+
+def _parse_value(value):
+    for conv in (int, float):
+        try:
+            return conv(value)
+        except ValueError:
+            pass
+    return value
+
+
+def main(output_dir, job_names, argv, **kwargs):
+    """Runs a :class:`.Scheduler` with the options of a run file
+
+    The ``argv`` items ``max_jobs``, ``max_tokens``, ``tokens_per_job``,
+    ``timeout``, ``poll_interval``, ``stopper_interval``,
+    ``terminate_timeout``, ``stop_policies`` (a JSON file) and
+    ``abaqus_cmd`` given as ``key=value`` and the flags
+    ``use_stopper`` and ``rerun_errors`` overwrite ``kwargs``, ``cpus=``
+    sets ``cpus_per_job`` and any other argument is passed to the Abaqus
+    jobs.
+
+    """
+    extra_args = []
+    for arg in argv:
+        if arg in ('use_stopper', 'rerun_errors'):
+            kwargs[arg] = True
+            continue
+        key, sep, value = arg.partition('=')
+        if sep and key in ('max_jobs', 'max_tokens', 'tokens_per_job',
+                           'timeout', 'poll_interval', 'stopper_interval',
+                           'terminate_timeout', 'stop_policies',
+                           'abaqus_cmd'):
+            kwargs[key] = _parse_value(value)
+        elif sep and key == 'cpus':
+            kwargs['cpus_per_job'] = int(value)
+        else:
+            extra_args.append(arg)
+    kwargs['extra_args'] = list(kwargs.get('extra_args', ())) + extra_args
+    return Scheduler(output_dir, job_names, **kwargs).run()
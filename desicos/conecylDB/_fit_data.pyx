@@ -6,150 +6,110 @@
 #cython: infer_types=False
 import numpy as np
 cimport numpy as np
+from libc.stdlib cimport malloc, free
 
-from cython.parallel import prange
+from cython.parallel import prange, parallel
 
 ctypedef np.double_t cDOUBLE
 DOUBLE = np.float64
 
-ctypedef void *cftype(int size, int m0, int n0, int num,
-                      double *zs, double *thetas, double *a) nogil
-
 cdef extern from "math.h":
     double cos(double t) nogil
     double sin(double t) nogil
 
 cdef double pi = 3.141592653589793
 
-def fa(m0, n0, np.ndarray[cDOUBLE, ndim=1] zs,
-              np.ndarray[cDOUBLE, ndim=1] thetas, funcnum):
+cdef int NUM_THREADS = 4
+
+
+cdef void ctrig(int num, int start, double x, double *s, double *c) nogil:
+    # sin(j*x) and cos(j*x) for j=start...start+num-1 using the
+    # angle-addition recurrences
+    cdef int j
+    cdef double s1, c1
+    if num <= 0:
+        return
+    s1 = sin(x)
+    c1 = cos(x)
+    s[0] = sin(start*x)
+    c[0] = cos(start*x)
+    for j in range(1, num):
+        s[j] = s[j-1]*c1 + c[j-1]*s1
+        c[j] = c[j-1]*c1 - s[j-1]*s1
 
+
+cdef void cterms(int funcnum, int m0, int n0, double z, double t,
+                 double *buf) nogil:
+    # buf = [sin(i*pi*z), cos(i*pi*z), sin(j*t), cos(j*t)]
+    if funcnum==1:
+        ctrig(m0, 1, pi*z, &buf[0], &buf[m0])
+    else:
+        ctrig(m0, 0, pi*z, &buf[0], &buf[m0])
+    ctrig(n0, 0, t, &buf[2*m0], &buf[2*m0+n0])
+
+
+cdef void cfa(int funcnum, int m0, int n0, double z, double t,
+              double *buf, double *row) nogil:
+    cdef int i, j, col
+    cdef double *sz = &buf[0]
+    cdef double *cz = &buf[m0]
+    cdef double *st = &buf[2*m0]
+    cdef double *ct = &buf[2*m0+n0]
+
+    cterms(funcnum, m0, n0, z, t, buf)
+    for j in range(n0):
+        for i in range(m0):
+            if funcnum==1:
+                col = 2*(i + j*m0)
+                row[col+0] = sz[i]*st[j]
+                row[col+1] = sz[i]*ct[j]
+            elif funcnum==2:
+                col = 2*(i + j*m0)
+                row[col+0] = cz[i]*st[j]
+                row[col+1] = cz[i]*ct[j]
+            elif funcnum==3:
+                col = 4*(i + j*m0)
+                row[col+0] = sz[i]*st[j]
+                row[col+1] = sz[i]*ct[j]
+                row[col+2] = cz[i]*st[j]
+                row[col+3] = cz[i]*ct[j]
+
+
+def fa(int m0, int n0, np.ndarray[cDOUBLE, ndim=1] zs,
+       np.ndarray[cDOUBLE, ndim=1] thetas, int funcnum,
+       int num_threads=NUM_THREADS):
     cdef np.ndarray[cDOUBLE, ndim=2] a
-    cdef cftype *cf
+    cdef int l, num, size, ncols
+    cdef double *buf
+    cdef double *pa
+    cdef double *pzs
+    cdef double *pts
 
     num = zs.shape[0]
 
     TOL = 1.e-3
-    if abs(zs.min()) > TOL or abs(1 - zs.max()) > TOL:
+    if num > 0 and (zs.min() < -TOL or zs.max() > 1 + TOL):
         raise ValueError('The zs array must be normalized!')
 
-    if funcnum==1:
+    if funcnum==1 or funcnum==2:
         size = 2
-        cf = &cf1
-    elif funcnum==2:
-        size = 2
-        cf = &cf2
     elif funcnum==3:
         size = 4
-        cf = &cf3
-
-    a = np.zeros((num, size*n0*m0), DOUBLE)
-    cf(size, m0, n0, num, &zs[0], &thetas[0], &a[0, 0])
+    else:
+        raise ValueError('Valid values for "funcnum" are 1, 2 or 3')
+
+    ncols = size*n0*m0
+    a = np.zeros((num, ncols), DOUBLE)
+    if num == 0 or ncols == 0:
+        return a
+    pa = &a[0, 0]
+    pzs = &zs[0]
+    pts = &thetas[0]
+
+    with nogil, parallel(num_threads=num_threads):
+        buf = <double *>malloc(2*(m0 + n0)*sizeof(double))
+        for l in prange(num, schedule='static'):
+            cfa(funcnum, m0, n0, pzs[l], pts[l], buf, &pa[l*ncols])
+        free(buf)
 
     return a
-
-cdef void *cf1(int size, int m0, int n0, int num,
-               double *zs, double *thetas, double *a) nogil:
-    cdef double z, theta
-    cdef int l, i, j, col
-
-    for l in prange(num, chunksize=num/20, num_threads=4, schedule='static'):
-        theta = thetas[l]
-        z = zs[l]
-        for i in range(1, m0+1):
-            for j in range(n0):
-                col = (i-1)*size + j*m0*size
-                a[l*(size*m0*n0) + (col+0)] = sin(i*pi*z)*sin(j*theta)
-                a[l*(size*m0*n0) + (col+1)] = sin(i*pi*z)*cos(j*theta)
-
-cdef void *cf2(int size, int m0, int n0, int num,
-               double *zs, double *thetas, double *a) nogil:
-    cdef double z, theta
-    cdef int l, i, j, col
-
-    for l in prange(num, chunksize=num/20, num_threads=4, schedule='static'):
-        theta = thetas[l]
-        z = zs[l]
-        for i in range(m0):
-            for j in range(n0):
-                col = i*size + j*m0*size
-                a[l*(size*m0*n0) + (col+0)] = cos(i*pi*z)*sin(j*theta)
-                a[l*(size*m0*n0) + (col+1)] = cos(i*pi*z)*cos(j*theta)
-
-cdef void *cf3(int size, int m0, int n0, int num,
-               double *zs, double *thetas, double *a) nogil:
-    cdef double z, theta
-    cdef int l, i, j, col
-
-    for l in prange(num, chunksize=num/20, num_threads=4, schedule='static'):
-        theta = thetas[l]
-        z = zs[l]
-        for i in range(m0):
-            for j in range(n0):
-                col = i*size + j*m0*size
-                a[l*(size*m0*n0) + (col+0)] = sin(i*pi*z)*sin(j*theta)
-                a[l*(size*m0*n0) + (col+1)] = sin(i*pi*z)*cos(j*theta)
-                a[l*(size*m0*n0) + (col+2)] = cos(i*pi*z)*sin(j*theta)
-                a[l*(size*m0*n0) + (col+3)] = cos(i*pi*z)*cos(j*theta)
-
-def fw0(int m0, int n0,
-        np.ndarray[cDOUBLE, ndim=1] c0,
-        np.ndarray[cDOUBLE, ndim=1] xs,
-        np.ndarray[cDOUBLE, ndim=1] ts, funcnum):
-    cdef int ix, i, j, col, size
-    cdef double x, t, sinix, cosix, sinjt, cosjt, w0
-    cdef np.ndarray[cDOUBLE, ndim=1] w0s
-    w0s = np.zeros_like(xs)
-    size = np.shape(xs)[0]
-
-    TOL = 1.e-3
-    if abs(xs.min()) > TOL or abs(1 - xs.max()) > TOL:
-        raise ValueError('The xs array must be normalized!')
-
-    if funcnum==1:
-        for ix in range(size):
-            x = xs[ix]
-            t = ts[ix]
-            w0 = 0
-            for j in range(n0):
-                sinjt = sin(j*t)
-                cosjt = cos(j*t)
-                for i in range(1, m0+1):
-                    sinix = sin(i*pi*x)
-                    col = (i-1)*2 + j*m0*2
-                    w0 += c0[col+0]*sinix*sinjt
-                    w0 += c0[col+1]*sinix*cosjt
-            w0s[ix] = w0
-    elif funcnum==2:
-        for ix in range(size):
-            x = xs[ix]
-            t = ts[ix]
-            w0 = 0
-            for j in range(n0):
-                sinjt = sin(j*t)
-                cosjt = cos(j*t)
-                for i in range(m0):
-                    cosix = cos(i*pi*x)
-                    col = i*2 + j*m0*2
-                    w0 += c0[col+0]*cosix*sinjt
-                    w0 += c0[col+1]*cosix*cosjt
-            w0s[ix] = w0
-    elif funcnum==3:
-        for ix in range(size):
-            x = xs[ix]
-            t = ts[ix]
-            w0 = 0
-            for j in range(n0):
-                sinjt = sin(j*t)
-                cosjt = cos(j*t)
-                for i in range(m0):
-                    sinix = sin(i*pi*x)
-                    cosix = cos(i*pi*x)
-                    col = i*4 + j*m0*4
-                    w0 += c0[col+0]*sinix*sinjt
-                    w0 += c0[col+1]*sinix*cosjt
-                    w0 += c0[col+2]*cosix*sinjt
-                    w0 += c0[col+3]*cosix*cosjt
-            w0s[ix] = w0
-
-    return w0s
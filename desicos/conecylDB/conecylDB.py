@@ -101,10 +101,18 @@ def update_imps():
         - ``imps_theta_z``: similar to ``imps``
         - ``t_measured``: contains the measured shell thickness for a
           correponding entry access doing ``t_measured[key]``
-        - ``R_best_fit``
+        - ``R_best_fit``: taken from the ``ccs`` entry, from the metadata
+          of the binary cache of the imperfection file (cf.
+          :func:`.read_cached`) or assumed to be ``rbot``
         - ``H_measured``
 
+    The imperfection files are read through their binary caches by the
+    reader functions, the paths returned here are the ones of the original
+    ASCII files.
+
     """
+    from desicos.conecylDB.read_write import read_cache_meta
+
     ccs = fetch('ccs')
     imps = {}
     imps_theta_z = {}
@@ -161,7 +169,10 @@ def update_imps():
             if 'R_best_fit' in cc.keys():
                 R_best_fit[imp] = cc['R_best_fit']
             else:
-                R_best_fit[imp] = cc['rbot']
+                meta = {}
+                if imp in imps_theta_z.keys():
+                    meta = read_cache_meta(imps_theta_z[imp].values()[0])
+                R_best_fit[imp] = meta.get('R_best_fit', cc['rbot'])
 
             H_measured[imp] = cc['H']
 
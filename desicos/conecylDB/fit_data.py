@@ -7,7 +7,7 @@ Fitting Data (:mod:`desicos.conecylDB.fit_data`)
 This module includes functions used to fit measured imperfection data.
 
 """
-from random import sample
+import random
 import os
 
 import numpy as np
@@ -17,8 +17,200 @@ from desicos.logger import *
 from desicos.constants import FLOAT
 
 
+def _calc_T(a, b, x0, y0, z0):
+    return np.array([[cos(b),  sin(a)*sin(b), -cos(a)*sin(b), x0],
+                     [     0,         cos(a),         sin(a), y0],
+                     [sin(b), -sin(a)*cos(b),  cos(a)*cos(b), z0]])
+
+
+def _calc_dT(a, b):
+    # derivatives of the rotation part of T with respect to a and b
+    dTda = np.array([[0,  cos(a)*sin(b),  sin(a)*sin(b)],
+                     [0,        -sin(a),         cos(a)],
+                     [0, -cos(a)*cos(b), -sin(a)*cos(b)]])
+    dTdb = np.array([[-sin(b),  sin(a)*cos(b), -cos(a)*cos(b)],
+                     [      0,              0,              0],
+                     [ cos(b),  sin(a)*sin(b), -cos(a)*sin(b)]])
+    return dTda, dTdb
+
+
+def _axis_to_angles(axis):
+    # angles a, b such that the third row of T is parallel to axis
+    axis = axis/np.linalg.norm(axis)
+    b = np.arcsin(np.clip(axis[0], -1., 1.))
+    a = np.arctan2(-axis[1], axis[2])
+    return a, b
+
+
+class _AxisymmetricFit(object):
+    # residuals and analytic Jacobian of the best-fit problem, the unknowns
+    # are p = [a, b, x0, y0, z0, R], where R is the radius at z=0
+    factor = 0.1
+
+    def __init__(self, pts, H, tana=0.):
+        self.pts = pts
+        self.H = H
+        self.tana = tana
+
+    def _transform(self, p):
+        T = _calc_T(*p[:5])
+        return T[:, :3].dot(self.pts) + T[:, 3:]
+
+    def residual(self, p):
+        xn, yn, zn = self._transform(p)
+        rho = np.sqrt(xn**2 + yn**2)
+        dr = p[5] - zn*self.tana - rho
+        dz = np.zeros_like(zn)
+        mask = zn < 0
+        dz[mask] = -zn[mask]*self.factor
+        mask = zn > self.H
+        dz[mask] = (zn[mask] - self.H)*self.factor
+        return np.concatenate((dr, dz))
+
+    def jacobian(self, p):
+        xn, yn, zn = self._transform(p)
+        rho = np.sqrt(xn**2 + yn**2)
+        rho[rho == 0] = 1.e-15
+        dTda, dTdb = _calc_dT(*p[:2])
+        num = xn.shape[0]
+        J = np.zeros((2*num, 6), dtype=FLOAT)
+        dzn = np.zeros((num, 6), dtype=FLOAT)
+        for k, dT in enumerate((dTda, dTdb)):
+            dxn, dyn, dzn[:, k] = dT.dot(self.pts)
+            J[:num, k] = -(xn*dxn + yn*dyn)/rho
+        # translations
+        J[:num, 2] = -xn/rho
+        J[:num, 3] = -yn/rho
+        dzn[:, 4] = 1.
+        J[:num] -= self.tana*dzn
+        J[:num, 5] = 1.
+        below = zn < 0
+        above = zn > self.H
+        J[num:][below] = -self.factor*dzn[below]
+        J[num:][above] = self.factor*dzn[above]
+        return J
+
+    def initial_guesses(self, both_directions=False):
+        # principal axes of the point cloud, the cylinder axis is usually
+        # the one with the most distinct variance
+        center = self.pts.mean(axis=1)
+        cov = np.cov(self.pts)
+        evals, evecs = np.linalg.eigh(cov)
+        distinct = [min(abs(evals[i] - evals[j]) for j in range(3) if j != i)
+                    for i in range(3)]
+        order = np.argsort(distinct)[::-1]
+        guesses = []
+        for i in order:
+            for sign in ((1, -1) if both_directions else (1,)):
+                axis = sign*evecs[:, i]
+                a, b = _axis_to_angles(axis)
+                T = _calc_T(a, b, 0, 0, 0)
+                x0, y0, zc = -T[:, :3].dot(center)
+                xn, yn, zn = T[:, :3].dot(self.pts) + np.array(
+                        [[x0], [y0], [zc]])
+                z0 = -zn.min() + zc
+                zn += z0 - zc
+                rho = np.sqrt(xn**2 + yn**2)
+                R = (rho + zn*self.tana).mean()
+                guesses.append(np.array([a, b, x0, y0, z0, R]))
+        return guesses
+
+    def solve(self, p, tol, maxfev):
+        from scipy.optimize import leastsq
+
+        popt, ier = leastsq(func=self.residual, x0=p, Dfun=self.jacobian,
+                            ftol=tol, xtol=tol, maxfev=maxfev)
+        cost = (self.residual(popt)**2).sum()
+        return popt, cost
+
+
+def _best_fit_axisymmetric(input_pts, H, tana, errorRtol, maxNumIter,
+        sample_size, seed):
+    rnd = np.random.RandomState(seed)
+    num = input_pts.shape[1]
+    if sample_size and sample_size < num:
+        num = int(sample_size)
+        input_pts = input_pts[:, rnd.permutation(input_pts.shape[1])[:num]]
+    # coarse-to-fine schedule, the initial guesses are tried in the
+    # coarsest level only
+    sizes = sorted(set([min(num, 2000), min(num, 20000), num]))
+    perm = rnd.permutation(num)
+    p = None
+    for level, size in enumerate(sizes):
+        if size == num:
+            # the order of the points does not matter in the last level,
+            # which avoids a copy of all of them
+            pts = input_pts
+        else:
+            pts = input_pts[:, perm[:size]]
+        fit = _AxisymmetricFit(pts, H, tana)
+        if p is None:
+            guesses = fit.initial_guesses(both_directions=(tana != 0))
+        else:
+            guesses = [p]
+        best = None
+        for guess in guesses:
+            popt, cost = fit.solve(guess, errorRtol, maxNumIter)
+            if best is None or cost < best[1]:
+                best = popt, cost
+        p, cost = best
+        log('Level {0}: {1} points, RMS error: {2}'.format(
+            level+1, size, np.sqrt(cost/size)), level=1)
+    a, b = p[:2]
+    p[0] = a % (2*np.pi)
+    p[1] = b % (2*np.pi)
+    return p
+
+
+def _fit_output(input_pts, p, save, return_output):
+    T = _calc_T(*p[:5])
+    alpha, beta = p[:2]
+    log('')
+    log('Transformation matrix:\n{0}'.format(T))
+    log('')
+    log('Z versor: {0}*i + {1}*j + {2}*k'.format(*T[-1,:-1]))
+    log('')
+    log('alpha: {0} rad; beta: {1} rad'.format(alpha, beta))
+    log('')
+    log('x0, y0, z0: {0}, {1}, {2}'.format(*T[:,-1]))
+    log('')
+    log('Best fit radius: {0}'.format(p[5]))
+    log('')
+
+    # the transformed points are a new 3 x N array, only created if needed
+    output_pts = None
+    if save or return_output:
+        output_pts = T[:, :3].dot(input_pts) + T[:, 3:]
+    if save:
+        np.savetxt('output_best_fit.txt', output_pts.T)
+    if not return_output:
+        output_pts = None
+
+    Tinv = np.zeros_like(T)
+    Tinv[:3, :3] = T[:3, :3].T
+    Tinv[:, 3] = -T[:3, :3].T.dot(T[:, 3])
+    return dict(R_best_fit=p[5],
+                input_pts=input_pts,
+                output_pts=output_pts,
+                T=T, Tinv=Tinv)
+
+
+def _read_input_pts(path):
+    from desicos.conecylDB.read_write import read_cached
+
+    if isinstance(path, np.ndarray):
+        input_pts = path.T
+    else:
+        input_pts = read_cached(path).T
+
+    if input_pts.shape[0] != 3:
+        raise ValueError('Input does not have the format: "x, y, z"')
+    return input_pts
+
+
 def best_fit_cylinder(path, H, R_expected=10., save=True, errorRtol=1.e-9,
-                      maxNumIter=1000, sample_size=None):
+                      maxNumIter=1000, sample_size=None, seed=None,
+                      output_pts=True):
     r"""Fit a best cylinder for a given set of measured data
 
     The coordinate transformation which must be performed in order to adjust
@@ -39,16 +231,18 @@ def best_fit_cylinder(path, H, R_expected=10., save=True, errorRtol=1.e-9,
      \\
            \end{bmatrix}
 
-    Note that **five** variables are unknowns:
+    Note that **six** variables are unknowns:
 
     - the rotation angles `\alpha` and `\beta`
     - the three components of the translation `\Delta x_0`, `\Delta y_0` and
       `\Delta z_0`
+    - the radius `R`
 
-    The five unknowns are calculated iteratively in a non-linear least-sqares
-    problem (solved with ``scipy.optimize.leastsq``), where the measured data
-    is transformed to the reference coordinate system and there compared with
-    a reference cylinder in order to compute the residual error using:
+    The six unknowns are calculated in a non-linear least-sqares problem
+    (solved with ``scipy.optimize.leastsq`` using an analytic Jacobian),
+    where the measured data is transformed to the reference coordinate
+    system and there compared with a reference cylinder in order to compute
+    the residual error using:
 
     .. math::
         \begin{Bmatrix} x_{ref} \\ y_{ref} \\ z_{ref} \end{Bmatrix} =
@@ -74,9 +268,10 @@ def best_fit_cylinder(path, H, R_expected=10., save=True, errorRtol=1.e-9,
                          z_{ref} - H, & \text{if } z_{ref} > H \\
                        \end{cases}
 
-    Since the measured data may have an unknown radius `R`, the solution of
-    these equations has to be performed iteratively with one additional
-    external loop in order to update `R`.
+    The initial guesses are obtained from the principal axes of the point
+    cloud, each principal axis is tried as the cylinder axis in a sample
+    of ``2000`` points and the best solution is refined using samples of
+    ``20000`` points and finally all points (or ``sample_size`` points).
 
     Parameters
     ----------
@@ -91,19 +286,26 @@ def best_fit_cylinder(path, H, R_expected=10., save=True, errorRtol=1.e-9,
     H : float
         The nominal height of the cylinder.
     R_expected : float, optional
-        The nominal radius of the cylinder, used as a first guess to find
-        the best-fit radius (``R_best_fit``). Note that if not specified more
-        iterations may be required.
+        The nominal radius of the cylinder. Not used by the fitting
+        algorithm anymore, since the initial radius is estimated from the
+        data.
     save : bool, optional
         Whether to save an ``"output_best_fit.txt"`` in the working directory.
     errorRtol : float, optional
-        The error tolerance for the best-fit radius to stop the iterations.
+        The relative tolerance for the unknowns and for the error used to
+        stop the iterations.
     maxNumIter : int, optional
-        The maximum number of iterations for the best-fit radius.
+        The maximum number of function evaluations in each level.
     sample_size : int, optional
         If the input file containing the measured data is too big it may
         be convenient to use only a sample of it in order to calculate the
         best fit.
+    seed : int or None, optional
+        Seed used to select the samples.
+    output_pts : bool, optional
+        Whether the transformed points are returned in
+        ``out['output_pts']``, otherwise it is ``None``. Useful for large
+        inputs, where only the transformation matrix is needed.
 
     Returns
     -------
@@ -120,8 +322,9 @@ def best_fit_cylinder(path, H, R_expected=10., save=True, errorRtol=1.e-9,
             This matrix does the transformation: output_pts --> input_pts.
         ``out['input_pts']`` : np.ndarray
             The input points in a `3 \times N` 2-D array.
-        ``out['output_pts']`` : np.ndarray
-            The transformed points in a `3 \times N` 2-D array.
+        ``out['output_pts']`` : np.ndarray or None
+            The transformed points in a `3 \times N` 2-D array, ``None``
+            if ``output_pts=False``.
 
     Examples
     --------
@@ -155,125 +358,77 @@ def best_fit_cylinder(path, H, R_expected=10., save=True, errorRtol=1.e-9,
 
 
     """
-    from scipy.optimize import leastsq
-
-    if isinstance(path, np.ndarray):
-        input_pts = path.T
-    else:
-        input_pts = np.loadtxt(path, unpack=True)
+    input_pts = _read_input_pts(path)
+    p = _best_fit_axisymmetric(input_pts, H, 0., errorRtol, maxNumIter,
+                               sample_size, seed)
+    return _fit_output(input_pts, p, save, output_pts)
 
-    if input_pts.shape[0] != 3:
-        raise ValueError('Input does not have the format: "x, y, z"')
 
-    if sample_size:
-        num = input_pts.shape[1]
-        if sample_size < num:
-            input_pts = input_pts[:, sample(range(num), int(sample_size))]
-
-    pts = np.vstack((input_pts, np.ones_like(input_pts[0, :])))
-
-    def fT(p):
-        a, b, x0, y0, z0 = p
-        a %= 2*np.pi
-        b %= 2*np.pi
-        # rotation in x, y
-        T = np.array([[cos(b),  sin(a)*sin(b), -cos(a)*sin(b), x0],
-                      [     0,         cos(a),         sin(a), y0],
-                      [sin(b), -sin(a)*cos(b),  cos(a)*cos(b), z0]])
-        return T
-
-    i = 0
-    R = R_expected
-    while i <= maxNumIter:
-        i += 1
-
-        def calc_dist(p, pts):
-            T = fT(p)
-            xn, yn, zn = T.dot(pts)
-            dz = np.zeros_like(zn)
-            factor = 0.1
-            # point below the bottom edge
-            mask = zn < 0
-            dz[mask] = -zn[mask]*factor
-
-            # point inside the cylinder
-            pass
-            #dz[(zn >= 0) & (zn <= H)] *= 0
-
-            # point above the top edge
-            mask = zn > H
-            dz[mask] = (zn[mask] - H)*factor
-
-            dr = R - np.sqrt(xn**2 + yn**2)
-            dist = np.sqrt(dr**2 + dz**2)
-            return dist
-
-        # initial guess for the optimization variables
-        # the variables are alpha, beta, x0, y0, z0
-        x, y, z = input_pts
-        p = [0.5, 0.5, 2*x.mean(), 2*y.mean(), 2*z.mean()]
-
-        # performing the leastsq analysis
-        popt, pcov = leastsq(func=calc_dist, x0=p, args=(pts,),
-                             ftol=1.e-12, xtol=1.e-12, maxfev=1000000)
-        T = fT(popt)
-        output_pts = T.dot(pts)
-        x, y, z = output_pts
-        mask = (z>=0) & (z<=H)
-        R_best_fit = np.sqrt(x[mask]**2 + y[mask]**2).mean()
-        errorR = abs(R_best_fit - R)/R_best_fit
-
-        log('Iteration: {0}, R_best_fit: {1}, errorR: {2}'.format(
-            i, R_best_fit, errorR), level=1)
-
-        if errorR < errorRtol:
-            break
-        else:
-            R = R_best_fit
-    else:
-        warn('The maximum number of iterations was achieved!')
-
-    alpha, beta = popt[:2]
-    alpha %= 2*np.pi
-    beta %= 2*np.pi
-    log('')
-    log('Transformation matrix:\n{0}'.format(T))
-    log('')
-    log('Z versor: {0}*i + {1}*j + {2}*k'.format(*T[-1,:-1]))
-    log('')
-    log('alpha: {0} rad; beta: {1} rad'.format(alpha, beta))
-    log('')
-    log('x0, y0, z0: {0}, {1}, {2}'.format(*T[:,-1]))
-    log('')
-    log('Best fit radius: {0}'.format(R_best_fit))
-    log('    errorR: {0}, numiter: {1}'.format(errorR, i))
-    log('')
+def best_fit_cone(path, H, alphadeg, R_expected=10., save=True,
+        errorRtol=1.e-9, maxNumIter=1000, sample_size=None, seed=None,
+        output_pts=True):
+    r"""Fit a best cone for a given set of measured data
 
-    if save:
-        np.savetxt('output_best_fit.txt', np.vstack((x, y, z)).T)
+    Uses the same transformation and algorithm of
+    :func:`.best_fit_cylinder`, with the radial error computed using the
+    radius of the cone at each height:
 
-    Tinv = np.zeros_like(T)
-    Tinv[:3, :3] = T[:3, :3].T
-    Tinv[:, 3] = -T[:, 3]
-    return dict(R_best_fit=R_best_fit,
-                input_pts=input_pts,
-                output_pts=output_pts,
-                T=T, Tinv=Tinv)
+    .. math::
+        \Delta r = R_{bot} - z_{ref} tan(\alpha) - \sqrt{x_{ref}^2 + y_{ref}^2}
 
+    where `\alpha` is the semi-vertex angle and `R_{bot}` is the radius at
+    the bottom edge (`z_{ref}=0`), which is the sixth unknown. Both
+    directions of each principal axis of the point cloud are tried as
+    initial guesses, since the bottom edge is unknown.
 
-def best_fit_cone(path, H, alphadeg, R_expected=10., save=True,
-        errorRtol=1.e-9, maxNumIter=1000, sample_size=None):
-    r"""Fit a best cone for a given set of measured data
+    Parameters
+    ----------
+    path : str or np.ndarray
+        The path of the file containing the data, with the same format of
+        :func:`.best_fit_cylinder`.
+    H : float
+        The nominal height of the cone.
+    alphadeg : float
+        The semi-vertex angle in degrees.
+    R_expected : float, optional
+        The nominal bottom radius of the cone. Not used by the fitting
+        algorithm, since the initial radius is estimated from the data.
+    save : bool, optional
+        Whether to save an ``"output_best_fit.txt"`` in the working directory.
+    errorRtol : float, optional
+        The relative tolerance for the unknowns and for the error used to
+        stop the iterations.
+    maxNumIter : int, optional
+        The maximum number of function evaluations in each level.
+    sample_size : int, optional
+        If the input file containing the measured data is too big it may
+        be convenient to use only a sample of it in order to calculate the
+        best fit.
+    seed : int or None, optional
+        Seed used to select the samples.
+    output_pts : bool, optional
+        Whether the transformed points are returned in
+        ``out['output_pts']``, otherwise it is ``None``. Useful for large
+        inputs, where only the transformation matrix is needed.
 
-    .. note:: NOT IMPLEMENTED YET
+    Returns
+    -------
+    out : dict
+        The same entries of :func:`.best_fit_cylinder`, where
+        ``out['R_best_fit']`` is the best-fit bottom radius.
 
     """
-    raise NotImplementedError('Function not implemented yet!')
+    input_pts = _read_input_pts(path)
+    tana = np.tan(deg2rad(alphadeg))
+    p = _best_fit_axisymmetric(input_pts, H, tana, errorRtol, maxNumIter,
+                               sample_size, seed)
+    return _fit_output(input_pts, p, save, output_pts)
 
 
 def calc_c0(path, m0=50, n0=50, funcnum=2, fem_meridian_bot2top=True,
         rotatedeg=None, filter_m0=None, filter_n0=None, sample_size=None,
-        maxmem=8):
+        maxmem=8, solver='lstsq', sketch_size=None, seed=None,
+        grid_shape=None):
     r"""Find the coefficients that best fit the `w_0` imperfection
 
     The measured data will be fit using one of the following functions,
@@ -356,6 +511,42 @@ def calc_c0(path, m0=50, n0=50, funcnum=2, fem_meridian_bot2top=True,
     maxmem : int, optional
         Maximum RAM memory in GB allowed to compute the base functions.
         The ``scipy.interpolate.lstsq`` will go beyond this limit.
+    solver : str, optional
+        The least-squares solver:
+
+        - ``'lstsq'``: the whole matrix `[g]` is built and solved with
+          ``scipy.linalg.lstsq``. When ``maxmem`` is exceeded a random
+          sample of the measured points is used
+        - ``'normal'``: the rows of `[g]` are computed in blocks that fit in
+          ``maxmem`` and the normal equations `[g]^T[g]\{c_0\} =
+          [g]^T\{w_0\}` are accumulated, such that all measured points
+          are used
+        - ``'qr'``: like ``'normal'``, but accumulating an incremental QR
+          factorization of `[g]`, which is more accurate for
+          ill-conditioned problems and about twice as expensive
+        - ``'sketch'``: each block is compressed with a random CountSketch
+          matrix `[S]` and the much smaller problem `[S][g]\{c_0\} =
+          [S]\{w_0\}` is solved with ``scipy.linalg.lstsq``
+
+        - ``'fft'``: the measured points must form, or are resampled to, a
+          regular `\theta`-`z` grid with uniformly spaced angles covering
+          the whole circumference. The circumferential terms are obtained
+          with one real FFT per grid row and the meridional terms with the
+          pseudo-inverse of the small `z`-basis matrix, which gives the
+          least-squares solution over the grid points in `O(N \log N)`
+
+        For the block solvers the residual of each block is reported in a
+        second pass over the measured points.
+    sketch_size : int or None, optional
+        The number of rows of the sketched problem when
+        ``solver='sketch'``, by default ``4*size*m0*n0``.
+    seed : int or None, optional
+        Seed for the random sampling and for the sketching matrix.
+    grid_shape : tuple or None, optional
+        The number of points ``(nz, ntheta)`` of the grid used when
+        ``solver='fft'`` and the measured points do not form a regular grid,
+        by default ``(4*m0, 4*n0)``. The measured data is resampled using
+        :func:`.calc_inv_weighted_operator`.
 
     Returns
     -------
@@ -375,11 +566,13 @@ def calc_c0(path, m0=50, n0=50, funcnum=2, fem_meridian_bot2top=True,
     """
     from scipy.linalg import lstsq
 
+    from desicos.conecylDB.read_write import read_cached
+
     if isinstance(path, np.ndarray):
         input_pts = path
         path = 'unmamed.txt'
     else:
-        input_pts = np.loadtxt(path)
+        input_pts = read_cached(path)
 
     if input_pts.shape[1] != 3:
         raise ValueError('Input does not have the format: "theta, z, imp"')
@@ -390,6 +583,11 @@ def calc_c0(path, m0=50, n0=50, funcnum=2, fem_meridian_bot2top=True,
     log('Finding c0 coefficients for {0}'.format(str(os.path.basename(path))))
     log('using funcnum {0}'.format(funcnum), level=1)
 
+    if solver not in ('lstsq', 'normal', 'qr', 'sketch', 'fft'):
+        raise ValueError('Invalid solver: {0}'.format(solver))
+
+    sample = random.Random(seed).sample
+
     if sample_size:
         num = input_pts.shape[0]
         if sample_size < num:
@@ -410,7 +608,7 @@ def calc_c0(path, m0=50, n0=50, funcnum=2, fem_meridian_bot2top=True,
 
     maxnum = int(maxmem*1024*1024*1024*8/(64.*size*m0*n0)/memfac)
     num = input_pts.shape[0]
-    if num >= maxnum:
+    if num >= maxnum and solver == 'lstsq':
         input_pts = input_pts[sample(range(num), int(maxnum))]
         warn('Using {0} measured points due to the "maxmem" specified'.
                 format(maxnum), level=1)
@@ -428,11 +626,18 @@ def calc_c0(path, m0=50, n0=50, funcnum=2, fem_meridian_bot2top=True,
         zs *= -1
         zs += 1
 
-    a = fa(m0, n0, zs, ts, funcnum)
+    if solver == 'lstsq':
+        a = fa(m0, n0, zs, ts, funcnum)
 
-    log('Base functions calculated', level=1)
-    c0, residues, rank, s = lstsq(a, w0pts)
-    log('Finished scipy.linalg.lstsq', level=1)
+        log('Base functions calculated', level=1)
+        c0, residues, rank, s = lstsq(a, w0pts)
+        log('Finished scipy.linalg.lstsq', level=1)
+    elif solver == 'fft':
+        c0, residues = _calc_c0_fft(m0, n0, zs, ts, w0pts, funcnum,
+                grid_shape)
+    else:
+        c0, residues = _calc_c0_blocks(m0, n0, zs, ts, w0pts, funcnum,
+                maxmem, solver, sketch_size, seed)
 
     if filter_m0 is not None or filter_n0 is not None:
         c0 = filter_c0(m0, n0, c0, filter_m0, filter_n0, funcnum=funcnum)
@@ -440,6 +645,281 @@ def calc_c0(path, m0=50, n0=50, funcnum=2, fem_meridian_bot2top=True,
     return c0, residues
 
 
+def _calc_c0_blocks(m0, n0, zs, ts, w0pts, funcnum, maxmem, solver,
+        sketch_size, seed):
+    from scipy.linalg import (lstsq, qr, cho_factor, cho_solve,
+                              solve_triangular, LinAlgError)
+    from scipy.sparse import coo_matrix
+
+    size = 4 if funcnum==3 else 2
+    num = zs.shape[0]
+    # base functions that are zero at all points (e.g. sin(0*theta)) are
+    # kept with zero amplitude
+    probe = _fa_block(m0, n0, np.linspace(0.1, 0.9, 7),
+                      np.linspace(0.3, 2.9, 7), funcnum)
+    valid = np.any(probe != 0, axis=0)
+    nterms = valid.sum()
+
+    # memory kept during the whole analysis, in number of doubles
+    if solver == 'sketch':
+        if sketch_size is None:
+            sketch_size = 4*nterms
+        sketch_size = int(sketch_size)
+        fixed = sketch_size*(nterms + 1)
+    else:
+        fixed = (nterms + 1)**2
+    avail = maxmem*1024*1024*1024/8. - fixed
+    if solver == 'qr':
+        # the QR of the stacked matrix [R; block] needs a copy of it
+        block_size = int(avail/(2.2*(nterms + 1))) - nterms
+    else:
+        block_size = int(avail/(2.2*(nterms + 1)))
+    if block_size < 1000:
+        warn('The "maxmem" specified is too small for {0} terms'.format(
+             nterms), level=1)
+        block_size = 1000
+    blocks = [(i, min(i + block_size, num))
+              for i in range(0, num, block_size)]
+    log('Using solver "{0}" with {1} blocks of up to {2} points'.format(
+        solver, len(blocks), block_size), level=1)
+
+    if solver == 'normal':
+        gtg = np.zeros((nterms, nterms), dtype=FLOAT)
+        gtw = np.zeros(nterms, dtype=FLOAT)
+    elif solver == 'qr':
+        raug = np.zeros((0, nterms + 1), dtype=FLOAT)
+    elif solver == 'sketch':
+        rnd = np.random.RandomState(seed)
+        sg = np.zeros((sketch_size, nterms), dtype=FLOAT)
+        sw = np.zeros(sketch_size, dtype=FLOAT)
+
+    for k, (i1, i2) in enumerate(blocks):
+        g = _fa_block(m0, n0, zs[i1:i2], ts[i1:i2], funcnum)[:, valid]
+        w = w0pts[i1:i2]
+        if solver == 'normal':
+            gtg += g.T.dot(g)
+            gtw += g.T.dot(w)
+        elif solver == 'qr':
+            aug = np.vstack((raug, np.column_stack((g, w))))
+            raug = qr(aug, mode='r', overwrite_a=True)[0]
+            raug = raug[:min(raug.shape[0], nterms + 1)]
+        elif solver == 'sketch':
+            rows = rnd.randint(0, sketch_size, size=i2-i1)
+            signs = rnd.randint(0, 2, size=i2-i1)*2. - 1
+            S = coo_matrix((signs, (rows, np.arange(i2-i1))),
+                           shape=(sketch_size, i2-i1)).tocsr()
+            sg += S.dot(g)
+            sw += S.dot(w)
+        del g
+        log('Block {0}/{1} accumulated'.format(k+1, len(blocks)), level=2)
+
+    if solver == 'normal':
+        try:
+            c0 = cho_solve(cho_factor(gtg, overwrite_a=True), gtw)
+        except LinAlgError:
+            warn('Singular normal equations, using scipy.linalg.lstsq',
+                 level=1)
+            c0 = lstsq(gtg, gtw)[0]
+        del gtg
+    elif solver == 'qr':
+        r = np.zeros((nterms, nterms), dtype=FLOAT)
+        qtw = np.zeros(nterms, dtype=FLOAT)
+        nr = min(raug.shape[0], nterms)
+        r[:nr] = raug[:nr, :nterms]
+        qtw[:nr] = raug[:nr, nterms]
+        diag = np.abs(np.diag(r))
+        if diag.min() > 1.e-12*diag.max():
+            c0 = solve_triangular(r, qtw)
+        else:
+            c0 = lstsq(r, qtw)[0]
+        del raug, r
+    elif solver == 'sketch':
+        c0 = lstsq(sg, sw)[0]
+        del sg
+    c0_valid = c0
+    c0 = np.zeros(valid.shape[0], dtype=FLOAT)
+    c0[valid] = c0_valid
+    log('Finished solver "{0}"'.format(solver), level=1)
+
+    residues = 0.
+    for k, (i1, i2) in enumerate(blocks):
+        g = _fa_block(m0, n0, zs[i1:i2], ts[i1:i2], funcnum)
+        res = ((g.dot(c0) - w0pts[i1:i2])**2).sum()
+        residues += res
+        log('Block {0}/{1}: {2} points, RMS residual {3:1.6g}'.format(
+            k+1, len(blocks), i2-i1, np.sqrt(res/(i2-i1))), level=2)
+    log('Total RMS residual {0:1.6g}'.format(np.sqrt(residues/num)),
+        level=1)
+
+    return c0, np.array([residues])
+
+
+def _find_grid(zs, ts, decimals=8):
+    # returns the grid values with shape (nz, ntheta) and the grid
+    # coordinates when the points form a regular theta-z grid. The rounded
+    # coordinates are used only to group the points, the grid coordinates
+    # are the means of the actual coordinates of each group
+    uz, iz = np.unique(np.round(zs, decimals), return_inverse=True)
+    ut, it = np.unique(np.round(ts, decimals), return_inverse=True)
+    nz, nt = uz.shape[0], ut.shape[0]
+    if nz*nt != zs.shape[0] or nt < 2:
+        return None
+    dt = np.diff(ut)
+    if (np.abs(dt - 2*pi/nt).max() > 1.e-6
+        or np.bincount(iz*nt + it, minlength=nz*nt).min() != 1):
+        return None
+    gz = np.bincount(iz, weights=zs)/np.bincount(iz)
+    gt = np.bincount(it, weights=ts)/np.bincount(it)
+    return iz, it, gz, gt
+
+
+def _calc_c0_fft(m0, n0, zs, ts, w0pts, funcnum, grid_shape):
+    from scipy.linalg import pinv
+
+    grid = _find_grid(zs, ts)
+    if grid is not None:
+        iz, it, gz, gt = grid
+        nz, nt = gz.shape[0], gt.shape[0]
+        W = np.zeros((nz, nt), dtype=FLOAT)
+        W[iz, it] = w0pts
+        # origin of the uniform theta grid assumed by the FFT
+        t0 = (gt - np.arange(nt)*2*pi/nt).mean()
+        log('Regular grid with {0}x{1} points found'.format(nz, nt),
+            level=1)
+    else:
+        from desicos.conecylDB.interpolate import calc_inv_weighted_operator
+
+        if grid_shape is None:
+            grid_shape = (4*m0, 4*n0)
+        nz, nt = grid_shape
+        log('Resampling to a regular grid with {0}x{1} points'.format(
+            nz, nt), level=1)
+        gz = np.linspace(0., 1., nz)
+        t0 = 0.
+        gt = np.arange(nt)*2*pi/nt
+        # periodic metric with square grid cells: points on a cylinder of
+        # unit radius with z scaled by the cell aspect ratio
+        zscale = (2*pi/nt)*(nz - 1)
+        def cyl(z, t):
+            return np.column_stack((cos(t), sin(t), z*zscale))
+        Z, T = np.meshgrid(gz, gt, indexing='ij')
+        op = calc_inv_weighted_operator(cyl(zs, ts), cyl(Z.ravel(),
+                T.ravel()), ncp=4, power_parameter=2)
+        W = op.apply(w0pts).reshape(nz, nt)
+    if n0 > nt//2 + (nt % 2):
+        raise ValueError('n0={0} requires at least {1} points along theta'
+                         .format(n0, 2*n0 - 1))
+
+    # circumferential terms, exact least-squares for uniform full-period
+    # grids with j < nt/2
+    F = np.fft.rfft(W, axis=1)[:, :n0]*np.exp(-1j*np.arange(n0)*t0)
+    fac = np.full(n0, 2./nt)
+    fac[0] = 1./nt
+    Ws = -F.imag*fac
+    Wc = F.real*fac
+
+    # meridional terms
+    i = np.arange(m0)
+    if funcnum==1:
+        zbases = [sin(np.outer(gz, (i+1)*pi))]
+    elif funcnum==2:
+        zbases = [cos(np.outer(gz, i*pi))]
+    elif funcnum==3:
+        zbases = [sin(np.outer(gz, i*pi)), cos(np.outer(gz, i*pi))]
+    Zm = np.hstack(zbases)
+    Zinv = pinv(Zm)
+    Cs = Zinv.dot(Ws)
+    Cc = Zinv.dot(Wc)
+
+    size = 2*len(zbases)
+    c0 = np.zeros((n0, m0, size), dtype=FLOAT)
+    for k in range(len(zbases)):
+        c0[:, :, 2*k+0] = Cs[k*m0:(k+1)*m0].T
+        c0[:, :, 2*k+1] = Cc[k*m0:(k+1)*m0].T
+
+    # residual over the grid points
+    j = np.arange(n0)
+    Wfit = (Zm.dot(Cs).dot(sin(np.outer(j, gt))) +
+            Zm.dot(Cc).dot(cos(np.outer(j, gt))))
+    residues = ((W - Wfit)**2).sum()
+    log('Grid RMS residual {0:1.6g}'.format(np.sqrt(residues/W.size)),
+        level=1)
+
+    return c0.ravel(), np.array([residues])
+
+
+def _trig_terms(x, start, num):
+    # sin(j*x) and cos(j*x) for j=start...start+num-1 with shape (num, M),
+    # using the angle-addition recurrences instead of num evaluations of
+    # sin() and cos()
+    x = np.asarray(x, dtype=FLOAT)
+    s = np.empty((num, x.shape[0]), dtype=FLOAT)
+    c = np.empty((num, x.shape[0]), dtype=FLOAT)
+    if num == 0:
+        return s, c
+    s1 = sin(x)
+    c1 = cos(x)
+    s[0] = sin(start*x)
+    c[0] = cos(start*x)
+    for j in range(1, num):
+        np.multiply(s[j-1], c1, out=s[j])
+        s[j] += c[j-1]*s1
+        np.multiply(c[j-1], c1, out=c[j])
+        c[j] -= s[j-1]*s1
+    return s, c
+
+
+def _z_terms(m0, zs, funcnum):
+    # the meridional parts of the base functions, each with shape (m0, M)
+    if funcnum==1:
+        return [_trig_terms(pi*zs, 1, m0)[0]]
+    elif funcnum==2:
+        return [_trig_terms(pi*zs, 0, m0)[1]]
+    elif funcnum==3:
+        return list(_trig_terms(pi*zs, 0, m0))
+
+
+def _fa_block(m0, n0, zs, ts, funcnum):
+    # base functions for a block of points without the normalization check
+    # of fa(), the columns follow the c0 layout: size*(i + j*m0) + k
+    sinjt, cosjt = _trig_terms(ts, 0, n0)
+    zterms = _z_terms(m0, zs, funcnum)
+    size = 2*len(zterms)
+    a = np.empty((zs.shape[0], n0, m0, size), dtype=FLOAT)
+    for k, zt in enumerate(zterms):
+        a[:, :, :, 2*k+0] = zt.T[:, None, :]*sinjt.T[:, :, None]
+        a[:, :, :, 2*k+1] = zt.T[:, None, :]*cosjt.T[:, :, None]
+    return a.reshape(zs.shape[0], -1)
+
+
+def _fw0_block(m0, n0, c0, zs, ts, funcnum):
+    # separable evaluation: w0 = sum_j (C^T Z)_j*S_j + (D^T Z)_j*C_j, where
+    # Z (m0 x M) and S, C (n0 x M) are the meridional and circumferential
+    # parts of the base functions
+    sinjt, cosjt = _trig_terms(ts, 0, n0)
+    zterms = _z_terms(m0, zs, funcnum)
+    size = 2*len(zterms)
+    c0 = c0.reshape(n0, m0, size)
+    w0s = np.zeros(zs.shape[0], dtype=FLOAT)
+    for k, zt in enumerate(zterms):
+        w0s += np.einsum('ij,ij->j', c0[:, :, 2*k+0].dot(zt), sinjt)
+        w0s += np.einsum('ij,ij->j', c0[:, :, 2*k+1].dot(zt), cosjt)
+    return w0s
+
+
+def _num_threads(num_threads):
+    if num_threads is None or num_threads < 1:
+        from multiprocessing import cpu_count
+        return cpu_count()
+    return int(num_threads)
+
+
+def _block_size(m0, n0):
+    # number of points per block keeping the temporary arrays of
+    # _fw0_block() around 64 MB per thread
+    return max(1024, 2**23//(4*(m0 + n0)))
+
+
 def filter_c0(m0, n0, c0, filter_m0, filter_n0, funcnum=2):
     r"""Apply filter to the imperfection coefficients `\{c_0\}`
 
@@ -502,7 +982,7 @@ def filter_c0(m0, n0, c0, filter_m0, filter_n0, funcnum=2):
     return c0_filtered
 
 
-def fa(m0, n0, zs_norm, thetas, funcnum=2):
+def fa(m0, n0, zs_norm, thetas, funcnum=2, num_threads=None):
     """Calculates the matrix with the base functions for `w_0`
 
     The calculated matrix is directly used to calculate the `w_0` displacement
@@ -524,16 +1004,25 @@ def fa(m0, n0, zs_norm, thetas, funcnum=2):
         The angles in radians representing the circumferential positions.
     funcnum : int, optional
         The function used for the approximation (see function :func:`.calc_c0`)
+    num_threads : int or None, optional
+        Number of threads used by the Cython module, ``None`` uses one
+        thread per CPU.
 
     """
     try:
         import _fit_data
-        return _fit_data.fa(m0, n0, zs_norm, thetas, funcnum)
-    except:
+    except ImportError:
+        _fit_data = None
         warn('_fit_data.pyx could not be imported, executing in Python/NumPy'
-                + '\n\t\tThis mode is slower and needs more memory than the'
-                + '\n\t\tPython/NumPy/Cython mode',
+                + '\n\t\tThis mode is slower than the Python/NumPy/Cython'
+                + '\n\t\tmode',
              level=1)
+    if _fit_data is not None:
+        zs = np.ascontiguousarray(zs_norm.ravel(), dtype=FLOAT)
+        ts = np.ascontiguousarray(thetas.ravel(), dtype=FLOAT)
+        return _fit_data.fa(m0, n0, zs, ts, funcnum,
+                            _num_threads(num_threads))
+    else:
         zs = zs_norm.ravel()
         ts = thetas.ravel()
         n = zs.shape[0]
@@ -543,23 +1032,18 @@ def fa(m0, n0, zs_norm, thetas, funcnum=2):
             log('zs.min()={0}'.format(zsmin))
             log('zs.max()={0}'.format(zsmax))
             raise ValueError('The zs array must be normalized!')
-        if funcnum==1:
-            a = np.array([[sin(i*pi*zs)*sin(j*ts), sin(i*pi*zs)*cos(j*ts)]
-                           for j in range(n0) for i in range(1, m0+1)])
-            a = a.swapaxes(0,2).swapaxes(1,2).reshape(n,-1)
-        elif funcnum==2:
-            a = np.array([[cos(i*pi*zs)*sin(j*ts), cos(i*pi*zs)*cos(j*ts)]
-                           for j in range(n0) for i in range(m0)])
-            a = a.swapaxes(0,2).swapaxes(1,2).reshape(n,-1)
-        elif funcnum==3:
-            a = np.array([[sin(i*pi*zs)*sin(j*ts), sin(i*pi*zs)*cos(j*ts),
-                           cos(i*pi*zs)*sin(j*ts), cos(i*pi*zs)*cos(j*ts)]
-                           for j in range(n0) for i in range(m0)])
-            a = a.swapaxes(0,2).swapaxes(1,2).reshape(n,-1)
+        if funcnum not in (1, 2, 3):
+            raise ValueError('Valid values for "funcnum" are 1, 2 or 3')
+        size = 4 if funcnum==3 else 2
+        a = np.empty((n, size*m0*n0), dtype=FLOAT)
+        block = _block_size(m0, n0)
+        for i in range(0, n, block):
+            a[i:i+block] = _fa_block(m0, n0, zs[i:i+block], ts[i:i+block],
+                                     funcnum)
     return a
 
 
-def fw0(m0, n0, c0, xs_norm, ts, funcnum=2):
+def fw0(m0, n0, c0, xs_norm, ts, funcnum=2, num_threads=None):
     r"""Calculates the imperfection field `w_0` for a given input
 
     Parameters
@@ -578,6 +1062,9 @@ def fw0(m0, n0, c0, xs_norm, ts, funcnum=2):
         (`\theta`).
     funcnum : int, optional
         The function used for the approximation (see function :func:`.calc_c0`)
+    num_threads : int or None, optional
+        Number of threads evaluating the blocks of points, ``None`` uses
+        one thread per CPU.
 
     Returns
     -------
@@ -589,6 +1076,15 @@ def fw0(m0, n0, c0, xs_norm, ts, funcnum=2):
     -----
     The inputs ``xs_norm`` and ``ts`` must be of the same size.
 
+    The base functions are products of a meridional and a circumferential
+    part. For each block of points the matrices `[Z]` (`m_0 \times M`) and
+    `[\Theta]` (`n_0 \times M`) are built with trigonometric recurrences and
+    `w_0` is obtained as the column-wise sum of `([C]^T[Z]) \circ [\Theta]`,
+    where `[C]` are the coefficients ``c0`` rearranged as a
+    `m_0 \times n_0` matrix, using one matrix product (BLAS) per
+    combination of base functions. The blocks are evaluated in parallel
+    threads, since NumPy releases the GIL in the matrix products.
+
     The inputs must satisfy ``c0.shape[0] == size*m0*n0``, where:
 
     - ``size=2`` if ``funcnum==1 or funcnum==2``
@@ -605,15 +1101,140 @@ def fw0(m0, n0, c0, xs_norm, ts, funcnum=2):
         size = 4
     if c0.shape[0] != size*m0*n0:
         raise ValueError('Invalid c0 for the given m0 and n0!')
-    try:
-        import _fit_data
-        w0s = _fit_data.fw0(m0, n0, c0, xs_norm.ravel(), ts.ravel(), funcnum)
-    except:
-        a = fa(m0, n0, xs_norm.ravel(), ts.ravel(), funcnum)
-        w0s = a.dot(c0)
+    from desicos.conecylDB.interpolate import parallel_map
+
+    xs = xs_norm.ravel()
+    ts = ts.ravel()
+    w0s = np.empty(xs.shape[0], dtype=FLOAT)
+    block = _block_size(m0, n0)
+    starts = range(0, xs.shape[0], block)
+
+    def calc(i):
+        w0s[i:i+block] = _fw0_block(m0, n0, c0, xs[i:i+block],
+                                    ts[i:i+block], funcnum)
+
+    parallel_map(calc, starts, workers=_num_threads(num_threads))
     return w0s.reshape(xs_norm.shape)
 
 
+class W0Basis(object):
+    r"""Base functions of `w_0` evaluated once for a set of points
+
+    Used to evaluate many coefficient vectors `\{c_0\}` (different
+    measurements, filtered or scaled variants, generated samples) on the
+    same points, for example the nodes of a finite element model::
+
+        basis = W0Basis(m0, n0, xs_norm, ts, funcnum=2)
+        w0s = basis.evaluate(c0s)
+
+    where ``c0s`` has shape ``(K, size*m0*n0)`` and ``w0s`` has shape
+    ``(K, M)``. The points are processed in chunks and each chunk requires
+    one matrix product, the matrix with the base functions (see
+    :func:`.fa`) of all chunks is kept in memory when it fits in
+    ``maxmem``, otherwise it is recomputed in each call to
+    :meth:`evaluate`.
+
+    Parameters
+    ----------
+    m0 : int
+        The number of terms along the meridian.
+    n0 : int
+        The number of terms along the circumference.
+    xs_norm : np.ndarray
+        The meridian coordinate (`x`) normalized to be between ``0.`` and
+        ``1.``.
+    ts : np.ndarray
+        The angles in radians representing the circumferential coordinate
+        (`\theta`).
+    funcnum : int, optional
+        The function used for the approximation (see function :func:`.calc_c0`)
+    maxmem : float, optional
+        Maximum RAM memory in GB used to store the base functions.
+
+    """
+    def __init__(self, m0, n0, xs_norm, ts, funcnum=2, maxmem=2):
+        if xs_norm.shape != ts.shape:
+            raise ValueError('xs_norm and ts must have the same shape')
+        if funcnum not in (1, 2, 3):
+            raise ValueError('Valid values for "funcnum" are 1, 2 or 3')
+        self.m0 = m0
+        self.n0 = n0
+        self.funcnum = funcnum
+        self.shape = xs_norm.shape
+        self.xs = np.asarray(xs_norm, dtype=FLOAT).ravel()
+        self.ts = np.asarray(ts, dtype=FLOAT).ravel()
+        self.size = 4 if funcnum==3 else 2
+        self.nterms = self.size*m0*n0
+        num = self.xs.shape[0]
+        maxnum = int(maxmem*1024**3/(8.*max(self.nterms, 1)))
+        # chunks with up to 64 MB each
+        chunk = max(1, min(num, 2**23//max(self.nterms, 1)))
+        self.chunks = [(i, min(i + chunk, num)) for i in range(0, num, chunk)]
+        self.cached = None
+        if num <= maxnum:
+            self.cached = [self._calc_chunk(i1, i2) for i1, i2 in self.chunks]
+        else:
+            warn('The base functions do not fit in "maxmem", they will be '
+                 'recomputed in each evaluation', level=1)
+
+    def _calc_chunk(self, i1, i2):
+        return _fa_block(self.m0, self.n0, self.xs[i1:i2], self.ts[i1:i2],
+                         self.funcnum)
+
+    def evaluate(self, c0s):
+        r"""Calculates `w_0` for a stack of coefficient vectors
+
+        Parameters
+        ----------
+        c0s : np.ndarray
+            A 2-D array with shape ``(K, size*m0*n0)``, or a 1-D array with
+            one coefficient vector.
+
+        Returns
+        -------
+        w0s : np.ndarray
+            An array with shape ``(K, M)``, or with the shape of ``xs_norm``
+            when ``c0s`` is a 1-D array.
+
+        """
+        c0s = np.asarray(c0s, dtype=FLOAT)
+        single = c0s.ndim == 1
+        c0s = np.atleast_2d(c0s)
+        if c0s.shape[1] != self.nterms:
+            raise ValueError('Invalid c0s for the given m0 and n0!')
+        w0s = np.empty((c0s.shape[0], self.xs.shape[0]), dtype=FLOAT)
+        for k, (i1, i2) in enumerate(self.chunks):
+            if self.cached is not None:
+                a = self.cached[k]
+            else:
+                a = self._calc_chunk(i1, i2)
+            w0s[:, i1:i2] = c0s.dot(a.T)
+        if single:
+            return w0s[0].reshape(self.shape)
+        return w0s
+
+
+def fw0_batch(m0, n0, c0s, xs_norm, ts, funcnum=2, maxmem=2):
+    r"""Calculates the imperfection field `w_0` for many coefficient vectors
+
+    Convenience function for :class:`.W0Basis`, see :func:`.fw0` for a
+    description of the parameters.
+
+    Parameters
+    ----------
+    c0s : np.ndarray
+        A 2-D array with shape ``(K, size*m0*n0)``.
+
+    Returns
+    -------
+    w0s : np.ndarray
+        A 2-D array with shape ``(K, M)``, where ``M`` is the number of points.
+
+    """
+    basis = W0Basis(m0, n0, xs_norm, ts, funcnum=funcnum, maxmem=maxmem)
+    return basis.evaluate(c0s)
+
+
 def transf_matrix(alphadeg, betadeg, gammadeg, x0, y0, z0):
     r"""Calculates the transformation matrix
 
@@ -9,6 +9,8 @@ modules.
 
 """
 from collections import Iterable
+import hashlib
+import os
 
 import numpy as np
 from numpy import sin, cos, tan
@@ -18,7 +20,269 @@ from desicos.constants import FLOAT
 from read_write import read_theta_z_imp
 
 
-def inv_weighted(data, mesh, num_sub, col, ncp=5, power_parameter=2):
+def parallel_map(func, args, workers=None):
+    """Applies a function to a sequence of arguments using a thread pool
+
+    The threads share the memory of the calling process, so that the large
+    arrays used by the interpolation routines are not copied. NumPy and
+    ``scipy.spatial.cKDTree`` release the GIL during the heavy operations,
+    so the work is effectively done concurrently.
+
+    Parameters
+    ----------
+    func : callable
+        Function taking a single argument.
+    args : iterable
+        The arguments.
+    workers : int or None, optional
+        Number of threads. ``None`` or ``1`` runs serially in the calling
+        thread and ``-1`` uses one thread per CPU.
+
+    Returns
+    -------
+    results : list
+        The results in the same order of ``args``, regardless of the number
+        of workers.
+
+    """
+    args = list(args)
+    if workers is not None and int(workers) < 0:
+        from multiprocessing import cpu_count
+        workers = cpu_count()
+    if workers is None or int(workers) <= 1 or len(args) <= 1:
+        return [func(arg) for arg in args]
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(min(int(workers), len(args)))
+    try:
+        return pool.map(func, args, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _kdtree_query(tree, mesh, k, workers=None):
+    # splitting the mesh in chunks does not change the neighbours found for
+    # each node, the result is identical to a single query
+    if workers is None or workers == 1 or mesh.shape[0] < 2:
+        return tree.query(mesh, k=k)
+    num_chunks = 4*(workers if workers > 0 else 8)
+    bounds = np.linspace(0, mesh.shape[0], num_chunks + 1).astype(int)
+    ranges = [(i1, i2) for i1, i2 in zip(bounds[:-1], bounds[1:]) if i2 > i1]
+    ans = parallel_map(lambda (i1, i2): tree.query(mesh[i1:i2], k=k),
+                       ranges, workers)
+    dist = np.concatenate([a[0] for a in ans])
+    asort = np.concatenate([a[1] for a in ans])
+    return dist, asort
+
+
+class InvWeightedOperator(object):
+    r"""Inverse-weighted interpolation operator
+
+    Stores, for each node of a mesh, the indices of the `n_{CP}` closest
+    measured points and the corresponding normalized weights used by the
+    inverse-weighted algorithm (cf. :func:`.inv_weighted`). Once built the
+    interpolation of any set of values given at the measured points is a
+    sparse matrix-vector product::
+
+        op = calc_inv_weighted_operator(points, mesh, ncp=5)
+        w0 = op.apply(imps)
+
+    Parameters
+    ----------
+    indices : numpy.ndarray, shape (M, ncp)
+        The indices of the closest measured points of each node.
+    weights : numpy.ndarray, shape (M, ncp)
+        The normalized weights of the closest measured points.
+    num_points : int
+        The number of measured points.
+
+    """
+    def __init__(self, indices, weights, num_points):
+        self.indices = np.asarray(indices)
+        self.weights = np.asarray(weights)
+        self.num_points = int(num_points)
+        self._matrix = None
+
+    @property
+    def shape(self):
+        return (self.indices.shape[0], self.num_points)
+
+    @property
+    def matrix(self):
+        """The operator as a ``scipy.sparse.csr_matrix``"""
+        if self._matrix is None:
+            from scipy.sparse import csr_matrix
+
+            num_nodes, ncp = self.indices.shape
+            indptr = np.arange(0, num_nodes*ncp + 1, ncp)
+            self._matrix = csr_matrix((self.weights.ravel(),
+                                       self.indices.ravel(), indptr),
+                                      shape=self.shape)
+        return self._matrix
+
+    def apply(self, values):
+        """Interpolates values given at the measured points
+
+        Parameters
+        ----------
+        values : numpy.ndarray
+            A 1-D array with the values at each measured point, or a 2-D
+            array with one set of values per column.
+
+        Returns
+        -------
+        ans : numpy.ndarray
+            The interpolated values with ``ans.shape[0] == M``.
+
+        """
+        values = np.asarray(values)
+        if values.shape[0] != self.num_points:
+            raise ValueError('Expected {0} values, got {1}'.format(
+                             self.num_points, values.shape[0]))
+        return self.matrix.dot(values)
+
+    def save(self, path):
+        """Saves the operator into a ``.npz`` file"""
+        np.savez(path, indices=self.indices, weights=self.weights,
+                 num_points=self.num_points)
+
+    @classmethod
+    def load(cls, path):
+        """Loads an operator saved with :meth:`save`"""
+        tmp = np.load(path)
+        return cls(tmp['indices'], tmp['weights'], int(tmp['num_points']))
+
+
+def calc_inv_weighted_operator(points, mesh, ncp=5, power_parameter=2,
+        workers=None):
+    r"""Builds the inverse-weighted interpolation operator
+
+    The closest points are found using a KD-tree, as in the ``'kdtree'``
+    method of :func:`.inv_weighted`.
+
+    Parameters
+    ----------
+    points : numpy.ndarray, shape (N, ndim)
+        The coordinates of the measured points.
+    mesh : numpy.ndarray, shape (M, ndim)
+        The new coordinates where the values will be interpolated to.
+    ncp : int, optional
+        Number of closest points used in the inverse-weighted interpolation.
+    power_parameter : float, optional
+        Power of inverse weighted interpolation function.
+    workers : int or None, optional
+        Number of threads used to query the KD-tree (cf.
+        :func:`.parallel_map`).
+
+    Returns
+    -------
+    op : :class:`.InvWeightedOperator`
+        The interpolation operator.
+
+    """
+    from scipy.spatial import cKDTree
+
+    if mesh.shape[1] != points.shape[1]:
+        raise ValueError('Invalid input: mesh.shape[1] != points.shape[1]')
+
+    ncp = min(int(ncp), points.shape[0])
+    tree = cKDTree(points)
+    dist, asort = _kdtree_query(tree, mesh, ncp, workers)
+    if ncp == 1:
+        dist = dist[:, None]
+        asort = asort[:, None]
+    # the slab algorithm works with the squared distances
+    dist_cp = dist**2
+    # avoiding division by zero
+    dist_cp[(dist_cp==0)] = 1.e-12
+    # weight calculation
+    weight = 1./(dist_cp**power_parameter)
+    weight /= np.sum(weight, axis=1)[:, None]
+
+    return InvWeightedOperator(asort, weight, points.shape[0])
+
+
+def inv_weighted_operator_key(points, mesh, ncp, power_parameter):
+    """Key identifying an interpolation operator
+
+    The key is a SHA-1 digest of the coordinates of the measured points,
+    the coordinates of the mesh and the interpolation parameters. The
+    coordinates of the measured points already reflect the imperfection file
+    and all the transformations applied to it (scaling, rotation, offsets).
+
+    Returns
+    -------
+    key : str
+        The hexadecimal digest.
+
+    """
+    sha = hashlib.sha1()
+    for a in (points, mesh):
+        a = np.ascontiguousarray(a, dtype=FLOAT)
+        sha.update(str(a.shape).encode())
+        sha.update(a.data)
+    sha.update('{0:d} {1!r}'.format(int(ncp),
+               float(power_parameter)).encode())
+    return sha.hexdigest()
+
+
+def get_inv_weighted_operator(points, mesh, ncp=5, power_parameter=2,
+        cache_dir=None, workers=None):
+    """Returns an interpolation operator, using a disk cache if possible
+
+    Parameters
+    ----------
+    points : numpy.ndarray, shape (N, ndim)
+        The coordinates of the measured points.
+    mesh : numpy.ndarray, shape (M, ndim)
+        The new coordinates where the values will be interpolated to.
+    ncp : int, optional
+        Number of closest points used in the inverse-weighted interpolation.
+    power_parameter : float, optional
+        Power of inverse weighted interpolation function.
+    cache_dir : str or None, optional
+        Directory where the operators are stored. If ``None`` the operator
+        is always calculated.
+    workers : int or None, optional
+        Number of threads used when the operator has to be calculated (cf.
+        :func:`.parallel_map`).
+
+    Returns
+    -------
+    op : :class:`.InvWeightedOperator`
+        The interpolation operator.
+
+    """
+    if cache_dir is None:
+        return calc_inv_weighted_operator(points, mesh, ncp, power_parameter,
+                                          workers)
+
+    key = inv_weighted_operator_key(points, mesh, ncp, power_parameter)
+    path = os.path.join(cache_dir, 'inv_weighted_{0}.npz'.format(key))
+    if os.path.isfile(path):
+        log('Loading interpolation operator: {0}'.format(path), level=1)
+        try:
+            op = InvWeightedOperator.load(path)
+            if op.shape == (mesh.shape[0], points.shape[0]):
+                return op
+        except:
+            pass
+        warn('Invalid interpolation operator, recalculating...', level=1)
+    op = calc_inv_weighted_operator(points, mesh, ncp, power_parameter,
+                                    workers)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        op.save(path)
+        log('Interpolation operator saved: {0}'.format(path), level=1)
+    except:
+        warn('Interpolation operator could not be saved in {0}'.format(
+             cache_dir), level=1)
+    return op
+
+
+def inv_weighted(data, mesh, num_sub, col, ncp=5, power_parameter=2,
+        method='slab', cache_dir=None, workers=None):
     r"""Interpolates the values taken at one group of points into
     another using an inverse-weighted algorithm
 
@@ -41,6 +305,30 @@ def inv_weighted(data, mesh, num_sub, col, ncp=5, power_parameter=2):
     with `p` being a power parameter that when increased will increase the
     relative influence of a closest point.
 
+    Two methods are available to find the `n_{CP}` closest points:
+
+    - ``'slab'``: the points are sorted along column ``col`` and divided in
+      ``num_sub`` sub-sets, for each sub-set a full distance matrix is
+      computed. The memory consumption grows with the square of the sub-set
+      size
+    - ``'kdtree'``: a KD-tree (``scipy.spatial.cKDTree``) is built with the
+      points of ``data`` and only the ``ncp`` closest points are queried for
+      each node of ``mesh``, which makes the computational cost and the
+      memory consumption grow almost linearly with the mesh size. The
+      parameters ``num_sub`` and ``col`` are ignored
+
+    When ``cache_dir`` is given the neighbour indices and weights are stored
+    as an :class:`.InvWeightedOperator` (always built with the KD-tree) and
+    reused in later calls with the same mesh, measured points, ``ncp`` and
+    ``power_parameter``.
+
+    With ``workers > 1`` the sub-sets (or chunks of the mesh for the KD-tree)
+    are processed by a pool of threads sharing the input arrays. Each node is
+    always computed with exactly the same operations, so that the result is
+    bit-for-bit identical to the serial one. With the ``'slab'`` method the
+    peak memory grows with the number of workers, since each thread holds
+    the distance matrix of one sub-set.
+
     Parameters
     ----------
     data : numpy.ndarray, shape (N, ndim+1)
@@ -58,6 +346,14 @@ def inv_weighted(data, mesh, num_sub, col, ncp=5, power_parameter=2):
         Number of closest points used in the inverse-weighted interpolation.
     power_parameter : float, optional
         Power of inverse weighted interpolation function.
+    method : str, optional
+        The method used to find the closest points, ``'slab'`` or
+        ``'kdtree'``.
+    cache_dir : str or None, optional
+        Directory where the interpolation operators are stored (cf.
+        :func:`.get_inv_weighted_operator`).
+    workers : int or None, optional
+        Number of threads (cf. :func:`.parallel_map`).
 
     Returns
     -------
@@ -69,6 +365,24 @@ def inv_weighted(data, mesh, num_sub, col, ncp=5, power_parameter=2):
     if mesh.shape[1] != data.shape[1]-1:
         raise ValueError('Invalid input: mesh.shape[1] != data.shape[1]')
 
+    if cache_dir is not None:
+        log('Interpolating using a cached operator... ')
+        ndim = mesh.shape[1]
+        op = get_inv_weighted_operator(data[:, :ndim], mesh, ncp,
+                                       power_parameter, cache_dir, workers)
+        ans = op.apply(data[:, -1])
+        log('Interpolation completed!')
+        return ans
+
+    if method == 'kdtree':
+        log('Interpolating using a KD-tree... ')
+        ans = _inv_weighted_kdtree(data, mesh, ncp, power_parameter,
+                                   workers)
+        log('Interpolation completed!')
+        return ans
+    elif method != 'slab':
+        raise ValueError('Invalid method: {0}'.format(method))
+
     log('Interpolating... ')
     num_sub = int(num_sub)
     mesh_size = mesh.shape[0]
@@ -106,7 +420,7 @@ def inv_weighted(data, mesh, num_sub, col, ncp=5, power_parameter=2):
             limit = int(num_sub/den)
             break
 
-    for i in range(num_sub+1):
+    def calc_sub_mesh(i):
         i_inf = sec_size*i
         i_sup = sec_size*(i+1)
 
@@ -115,7 +429,7 @@ def inv_weighted(data, mesh, num_sub, col, ncp=5, power_parameter=2):
                   min(i_sup, mesh_size), mesh_size))
         sub_mesh = mesh[i_inf : i_sup]
         if not np.any(sub_mesh):
-            continue
+            return None
         inf = sub_mesh[:, col].min()
         sup = sub_mesh[:, col].max()
 
@@ -144,7 +458,7 @@ def inv_weighted(data, mesh, num_sub, col, ncp=5, power_parameter=2):
         # getting the distance of the closest points
         dist_cp = np.take(dist, asort_mesh[:, :ncp])
         # avoiding division by zero
-        dist_cp[(dist_cp==0)] == 1.e-12
+        dist_cp[(dist_cp==0)] = 1.e-12
         # fetching the imperfection of the sub-data
         imp = sub_data[:, -1]
         # taking only the imperfection of the closest points
@@ -153,9 +467,14 @@ def inv_weighted(data, mesh, num_sub, col, ncp=5, power_parameter=2):
         total_weight = np.sum(1./(dist_cp**power_parameter), axis=1)
         weight = 1./(dist_cp**power_parameter)
         # computing the new imp
-        imp_new = np.sum(imp_cp*weight, axis=1)/total_weight
+        return np.sum(imp_cp*weight, axis=1)/total_weight
+
+    sub_results = parallel_map(calc_sub_mesh, range(num_sub+1), workers)
+    for i, imp_new in enumerate(sub_results):
+        if imp_new is None:
+            continue
         # updating the answer array
-        ans[i_inf : i_sup] = imp_new
+        ans[sec_size*i : sec_size*(i+1)] = imp_new
 
     ans = ans[back_argsort]
 
@@ -164,6 +483,29 @@ def inv_weighted(data, mesh, num_sub, col, ncp=5, power_parameter=2):
     return ans
 
 
+def _inv_weighted_kdtree(data, mesh, ncp, power_parameter, workers=None):
+    from scipy.spatial import cKDTree
+
+    ndim = mesh.shape[1]
+    ncp = min(int(ncp), data.shape[0])
+    tree = cKDTree(data[:, :ndim])
+    dist, asort = _kdtree_query(tree, mesh, ncp, workers)
+    if ncp == 1:
+        dist = dist[:, None]
+        asort = asort[:, None]
+    # the slab algorithm works with the squared distances
+    dist_cp = dist**2
+    # avoiding division by zero
+    dist_cp[(dist_cp==0)] = 1.e-12
+    # taking only the imperfection of the closest points
+    imp_cp = np.take(data[:, -1], asort)
+    # weight calculation
+    weight = 1./(dist_cp**power_parameter)
+    total_weight = np.sum(weight, axis=1)
+
+    return np.sum(imp_cp*weight, axis=1)/total_weight
+
+
 def interp(x, xp, fp, left=None, right=None, period=None):
     """
     One-dimensional linear interpolation
@@ -273,7 +615,8 @@ def interp(x, xp, fp, left=None, right=None, period=None):
 
 def interp_theta_z_imp(data, mesh, alphadeg, H_measured, H_model, R_bottom,
         stretch_H=False, z_offset_bot=None, rotatedeg=0., num_sub=10, ncp=5,
-        power_parameter=2, ignore_bot_h=None, ignore_top_h=None, T=None):
+        power_parameter=2, ignore_bot_h=None, ignore_top_h=None, T=None,
+        method='slab', cache_dir=None, workers=None):
     r"""Interpolates a data set in the `\theta, z, imp` format
 
     This function uses the inverse-weighted algorithm (:func:`.inv_weighted`).
@@ -326,6 +669,15 @@ def interp_theta_z_imp(data, mesh, alphadeg, H_measured, H_model, R_bottom,
     T : None or np.ndarray, optional
         A transformation matrix (cf. :func:`.transf_matrix`) required when the
         mesh is not in the :ref:`default coordinate system <figure_conecyl>`.
+    method : str, optional
+        The method used to find the closest points, ``'slab'`` or
+        ``'kdtree'`` (cf. :func:`.inv_weighted`).
+    cache_dir : str or None, optional
+        Directory where the interpolation operators are stored (cf.
+        :func:`.get_inv_weighted_operator`).
+    workers : int or None, optional
+        Number of threads used in the interpolation (cf.
+        :func:`.inv_weighted`).
 
     Returns
     -------
@@ -375,7 +727,8 @@ def interp_theta_z_imp(data, mesh, alphadeg, H_measured, H_model, R_bottom,
         mesh = np.dot(T, tmp).T
         del tmp
     ans = inv_weighted(data3D, mesh, col=2, ncp=ncp, num_sub=num_sub,
-            power_parameter=power_parameter)
+            power_parameter=power_parameter, method=method,
+            cache_dir=cache_dir, workers=workers)
 
     z_mesh = mesh[:, 2]
     if ignore_bot_h is not None:
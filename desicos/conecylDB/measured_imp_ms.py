@@ -5,6 +5,8 @@ import numpy as np
 
 from desicos.logger import log, warn
 from desicos.constants import FLOAT
+from desicos.conecylDB.read_write import read_cached
+from desicos.conecylDB.interpolate import parallel_map
 
 DOC_COMMON = '''
     scaling_factor     - scales the original imperfection (default = 1.)
@@ -16,6 +18,8 @@ DOC_COMMON = '''
                          (default = 2.)
     num_sec_z          - number of cross-sections in Z to classify the measured
                          points (default = 25)
+    workers            - number of threads processing the cross-sections, the
+                         result does not depend on it (default = None)
 '''
 def read_file(file_name,
                frequency             = 1,
@@ -33,7 +37,7 @@ def read_file(file_name,
                  'consider setting z_offset_bot to None')
     # reading the imperfection file
     ignore = False
-    mps = np.loadtxt(file_name, dtype=FLOAT)
+    mps = read_cached(file_name)
     r = np.sqrt(mps[:, 0]**2 + mps[:, 1]**2)
     # measuring model dimensions
     if R_best_fit is None:
@@ -148,7 +152,8 @@ def calc_nodal_translations(imperfection_file_name,
                             num_closest_points,
                             power_parameter,
                             num_sec_z,
-                            sample_size):
+                            sample_size,
+                            workers=None):
     # reading imperfection file
     m, o, mps = read_file(file_name = imperfection_file_name,
                           H_measured = H_measured,
@@ -196,7 +201,7 @@ def calc_nodal_translations(imperfection_file_name,
     mps = mps[np.argsort(mps[:, 2])]
     nodal_t = np.zeros(nodes.shape, dtype=nodes.dtype)
     limit = int(num_sec_z/5)
-    for i in xrange(num_sec_z+1):
+    def calc_sub_nodes(i):
         i_inf = sec_size*i
         i_sup = sec_size*(i+1)
         if i % limit == 0:
@@ -204,7 +209,7 @@ def calc_nodal_translations(imperfection_file_name,
                 min(i_sup, num_nodes), num_nodes), level=1)
         sub_nodes = nodes[i_inf : i_sup]
         if not np.any(sub_nodes):
-            continue
+            return None
         inf_z = sub_nodes[:, 2].min()
         sup_z = sub_nodes[:, 2].max()
         tol = 0.01
@@ -255,11 +260,18 @@ def calc_nodal_translations(imperfection_file_name,
         # calculating the scaling factor required for the new assumption
         sf = R_model/r_local_nodes
         theta = np.arctan2(sub_nodes[:, 1], sub_nodes[:, 0])
-        nodal_t[i_inf : i_sup][:, 0] = \
-                (r_new*np.cos(theta) - sub_nodes[:, 0])*sf
-        nodal_t[i_inf : i_sup][:, 1] = \
-                (r_new*np.sin(theta) - sub_nodes[:, 1])*sf
-        nodal_t[i_inf : i_sup][:, 3] = sub_nodes[:, 3]
+        return ((r_new*np.cos(theta) - sub_nodes[:, 0])*sf,
+                (r_new*np.sin(theta) - sub_nodes[:, 1])*sf)
+
+    sub_results = parallel_map(calc_sub_nodes, xrange(num_sec_z+1), workers)
+    for i, sub_t in enumerate(sub_results):
+        if sub_t is None:
+            continue
+        i_inf = sec_size*i
+        i_sup = sec_size*(i+1)
+        nodal_t[i_inf : i_sup][:, 0] = sub_t[0]
+        nodal_t[i_inf : i_sup][:, 1] = sub_t[1]
+        nodal_t[i_inf : i_sup][:, 3] = nodes[i_inf : i_sup][:, 3]
     nodal_t = nodal_t[np.argsort(nodal_t[:, 3])]
     log('Nodal translations calculated!')
 
@@ -289,7 +301,8 @@ def disturb_my_model(imperfection_file_name,
                      num_closest_points=5,
                      power_parameter=2,
                      num_sec_z=25,
-                     sample_size=None):
+                     sample_size=None,
+                     workers=None):
     # reading nodes data
     log('Reading nodes data from {0} ...'.format(nodes_file_name))
     nodes = get_nodes_from_txt_file(nodes_file_name)
@@ -309,7 +322,8 @@ def disturb_my_model(imperfection_file_name,
                                      num_closest_points = num_closest_points,
                                      power_parameter = power_parameter,
                                      num_sec_z = num_sec_z,
-                                     sample_size=sample_size)
+                                     sample_size=sample_size,
+                                     workers=workers)
     # writing output file
     log('Writing output file "{0}" ...'.format(output_file_name))
     outfile = open(output_file_name, 'w')
@@ -5,6 +5,8 @@ import numpy as np
 
 from desicos.abaqus.utils import vec_calc_elem_cg, index_within_linspace
 from desicos.constants import FLOAT
+from desicos.conecylDB.read_write import read_cached
+from desicos.conecylDB.interpolate import parallel_map
 
 def read_file(file_name,
               R_best_fit,
@@ -19,7 +21,7 @@ def read_file(file_name,
             print 'WARNING! Because of the stretch_H option,'
             print '         consider setting z_offset_bot to None'
     # reading the imperfection file
-    mps = np.loadtxt(file_name, dtype=FLOAT)
+    mps = read_cached(file_name)
     t_set = set(mps[:, 3])
     # measuring model dimensions
     z_min = mps[:, 2].min()
@@ -72,7 +74,8 @@ def calc_elems_t(imperfection_file_name,
                  z_offset_bot,
                  num_closest_points,
                  power_parameter,
-                 num_sec_z):
+                 num_sec_z,
+                 workers=None):
     # reading imperfection file
     m, mps, t_set_norm = read_file(file_name     = imperfection_file_name,
                                    R_best_fit    = R_best_fit,
@@ -113,7 +116,7 @@ def calc_elems_t(imperfection_file_name,
     elems_t = np.zeros((nodes.shape[0], 2), dtype=nodes.dtype)
     elems_t[:, 0] = nodes[:, 3]
     limit = int(num_sec_z/5)
-    for i in xrange(num_sec_z + 1):
+    def calc_sub_nodes(i):
         i_inf = sec_size*i
         i_sup = sec_size*(i+1)
         if i % limit == 0:
@@ -121,7 +124,7 @@ def calc_elems_t(imperfection_file_name,
                   (min(i_sup, nodes.shape[0]), nodes.shape[0])
         sub_nodes = nodes[i_inf : i_sup]
         if not np.any(sub_nodes):
-            continue
+            return None
         inf_z = sub_nodes[:, 2].min()
         sup_z = sub_nodes[:, 2].max()
         c = 0
@@ -151,8 +154,13 @@ def calc_elems_t(imperfection_file_name,
         thicks_ncp = np.take(thicks, a[:, :ncp])
         total_weight = np.sum(1./dist_ncp**power_parameter, axis=1)
         weight = 1./(dist_ncp**power_parameter)
-        elems_t[i_inf:i_sup, 1] = (
-                        np.sum(thicks_ncp*weight, axis=1)/total_weight)
+        return np.sum(thicks_ncp*weight, axis=1)/total_weight
+
+    sub_results = parallel_map(calc_sub_nodes, xrange(num_sec_z + 1), workers)
+    for i, sub_t in enumerate(sub_results):
+        if sub_t is None:
+            continue
+        elems_t[sec_size*i:sec_size*(i+1), 1] = sub_t
     elems_t = elems_t[np.argsort(elems_t[:, 1])]
     print 'New thicknesses calculated!'
 
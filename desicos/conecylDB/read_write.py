@@ -7,13 +7,477 @@ Read/Write (:mod:`desicos.conecylDB.read_write`)
 This module includes functions to read and write imperfection files.
 
 """
+from itertools import islice
+import json
 import os
+import tempfile
 
 import numpy as np
 
 from desicos.constants import *
 from desicos.logger import *
-from desicos.conecylDB.fit_data import best_fit_cylinder
+from desicos.conecylDB.fit_data import best_fit_cylinder, best_fit_cone
+
+
+CHUNK_SIZE = 200000
+CACHE_VERSION = 1
+USE_CACHE = True
+STACK_SEP = '::'
+
+
+def _values_per_line(text):
+    # number of whitespace separated values in each non-empty line
+    if not isinstance(text, bytes):
+        text = text.encode('latin-1')
+    c = np.frombuffer(text, dtype=np.uint8)
+    newline = c == ord('\n')
+    blank = newline | (c == ord(' ')) | (c == ord('\t')) | (c == ord('\r'))
+    start = ~blank
+    start[1:] &= blank[:-1]
+    line = np.cumsum(newline) - newline
+    counts = np.bincount(line[start])
+    return counts[counts > 0]
+
+
+def _parse_lines(lines, ncols):
+    # fast C-level parser, falling back to np.loadtxt when comments are found
+    # or when a line does not have ncols values
+    text = ''.join(lines)
+    if '#' not in text:
+        counts = _values_per_line(text)
+        if (counts == ncols).all():
+            values = np.fromstring(text, dtype=FLOAT, sep=' ')
+            if values.shape[0] == counts.shape[0]*ncols:
+                return values.reshape(-1, ncols)
+    values = np.loadtxt(lines, dtype=FLOAT, ndmin=2)
+    if values.shape[0] and values.shape[1] != ncols:
+        raise ValueError('Expected {0} columns, found {1}'.format(ncols,
+                         values.shape[1]))
+    return values
+
+
+def _iter_txt_chunks(path, ncols, chunk_size):
+    with open(path, 'r') as f:
+        while True:
+            lines = list(islice(f, chunk_size))
+            if not lines:
+                break
+            if ncols is None:
+                for line in lines:
+                    line = line.split('#')[0].strip()
+                    if line:
+                        ncols = len(line.split())
+                        break
+                else:
+                    continue
+            chunk = _parse_lines(lines, ncols)
+            if chunk.shape[0]:
+                yield chunk, sum(len(line) for line in lines)
+
+
+def iter_txt_chunks(path, ncols=None, chunk_size=CHUNK_SIZE):
+    r"""Iterates over an ASCII file returning chunks of rows
+
+    The file is read ``chunk_size`` lines at a time and each chunk is parsed
+    with ``np.fromstring``, which is much faster and requires much less
+    memory than ``np.loadtxt``.
+
+    Parameters
+    ----------
+    path : str
+        The path to the ASCII file with whitespace separated columns.
+    ncols : int or None, optional
+        The number of columns. If ``None`` it is obtained from the first
+        line containing data.
+    chunk_size : int, optional
+        The number of lines parsed at a time.
+
+    Returns
+    -------
+    chunks : generator
+        Yields 2-D arrays with ``ncols`` columns.
+
+    """
+    for chunk, nbytes in _iter_txt_chunks(path, ncols, chunk_size):
+        yield chunk
+
+
+def read_txt(path, ncols=None, func=None, chunk_size=CHUNK_SIZE):
+    r"""Reads an ASCII file with bounded memory usage
+
+    Replaces ``np.loadtxt`` for the large measured imperfection files. The
+    file is parsed in chunks (see :func:`.iter_txt_chunks`) and the results
+    are stored into a preallocated array, whose size is estimated from the
+    file size and grown when necessary.
+
+    Parameters
+    ----------
+    path : str or np.ndarray
+        The path to the ASCII file. If a ``np.ndarray`` is given ``func`` is
+        applied to it in chunks.
+    ncols : int or None, optional
+        The number of columns. If ``None`` it is obtained from the first
+        line containing data.
+    func : callable or None, optional
+        A function applied to each chunk, ``func(chunk) -> new_chunk``,
+        where ``new_chunk`` may have a different number of rows and
+        columns, e.g. transformations, clipping or filtering.
+    chunk_size : int, optional
+        The number of lines parsed at a time.
+
+    Returns
+    -------
+    ans : np.ndarray
+        A 2-D array with the output rows.
+
+    """
+    if isinstance(path, np.ndarray):
+        if func is None:
+            return path
+        total = path.shape[0]
+        chunks = ((path[i:i+chunk_size], None)
+                  for i in range(0, total, chunk_size))
+    else:
+        total = os.path.getsize(path)
+        chunks = _iter_txt_chunks(path, ncols, chunk_size)
+    ans = None
+    num = 0
+    for chunk, nbytes in chunks:
+        nrows = chunk.shape[0]
+        if func is not None:
+            chunk = np.asarray(func(chunk), dtype=FLOAT)
+        if ans is None:
+            if nbytes is None:
+                size = total
+            else:
+                # estimating the number of rows from the first chunk
+                size = int(1.02*total*nrows/nbytes) + 1
+            size = max(size, chunk.shape[0])
+            ans = np.empty((size, chunk.shape[1]), dtype=FLOAT)
+        if num + chunk.shape[0] > ans.shape[0]:
+            size = max(int(1.5*ans.shape[0]), num + chunk.shape[0])
+            ans.resize((size, ans.shape[1]), refcheck=False)
+        ans[num:num+chunk.shape[0]] = chunk
+        num += chunk.shape[0]
+    if ans is None:
+        return np.zeros((0, ncols or 0), dtype=FLOAT)
+    if num < ans.shape[0]:
+        ans.resize((num, ans.shape[1]), refcheck=False)
+    return ans
+
+
+class SampleStack(object):
+    r"""Lazy reader of a stack of generated imperfection samples
+
+    A stack stores a batch of samples in the `(\theta, z)` grid format as a
+    single binary ``.npy`` file with shape ``(num_samples, num_z,
+    num_theta)``, which is memory-mapped, and a JSON header next to it
+    (``.npy`` replaced by ``.json``) containing:
+
+    - ``imp_type``: ``'ms'`` for mid-surface imperfections, where the
+      values are the radial deviations, or ``'thick'`` for thicknesses
+    - ``theta``, ``z``: the coordinate vectors shared by all samples
+    - ``R_bottom``, ``H``, ``alpharad``: the geometry of the samples
+    - ``names``, ``seeds``: optional name and seed of each sample
+
+    A single sample can be referenced with the path
+    ``'<stack path>::<index>'`` (cf. :meth:`sample_path`), which is
+    understood by :func:`.read_cached` and therefore by all the functions
+    reading imperfection files in the `(\theta, z, imp)` format, e.g. by
+    setting the ``path`` of an :class:`.MSI` object with
+    ``use_theta_z_format=True``.
+
+    Parameters
+    ----------
+    path : str
+        The path to the ``.npy`` file.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(stack_header_path(path)) as f:
+            self.header = json.load(f)
+        self.imp_type = self.header['imp_type']
+        self.theta = np.array(self.header['theta'], dtype=FLOAT)
+        self.z = np.array(self.header['z'], dtype=FLOAT)
+        self.names = self.header.get('names')
+        self.grids = np.load(path, mmap_mode='r')
+
+    def __len__(self):
+        return self.grids.shape[0]
+
+    def __getitem__(self, index):
+        """The `(z, \theta)` grid of a sample, read from disk on demand"""
+        return self.grids[index]
+
+    def index(self, name):
+        """The index of a sample given its name"""
+        return self.names.index(name)
+
+    def sample_path(self, index):
+        """The path referencing one sample of the stack"""
+        return '{0}{1}{2:d}'.format(self.path, STACK_SEP, int(index))
+
+    def theta_z_imp(self, index):
+        r"""A sample in the `(\theta, z, imp)` format
+
+        Returns
+        -------
+        mps : np.ndarray
+            A 2-D array with `\theta`, `z` and the imperfection value (radial
+            deviation or thickness) in the three columns.
+
+        """
+        grid = np.asarray(self.grids[index], dtype=FLOAT)
+        mps = np.empty((grid.size, 3), dtype=FLOAT)
+        mps[:, 0] = np.tile(self.theta, self.z.shape[0])
+        mps[:, 1] = np.repeat(self.z, self.theta.shape[0])
+        mps[:, 2] = grid.ravel()
+        return mps
+
+    def meta(self):
+        """Metadata similar to the one given by :func:`.read_cache_meta`"""
+        return dict(H_measured=self.header['H'],
+                    R_best_fit=self.header['R_bottom'])
+
+
+def stack_header_path(path):
+    """The path of the JSON header of a :class:`.SampleStack`"""
+    return os.path.splitext(path)[0] + '.json'
+
+
+def split_stack_path(path):
+    """Splits ``'<stack path>::<index>'``, returns ``None`` for other paths
+
+    Returns
+    -------
+    out : tuple or None
+        The stack path and the sample index.
+
+    """
+    if not isinstance(path, basestring) or STACK_SEP not in path:
+        return None
+    stack_path, index = path.rsplit(STACK_SEP, 1)
+    try:
+        return stack_path, int(index)
+    except ValueError:
+        return None
+
+
+def _cache_paths(path):
+    return path + '.cache.npy', path + '.cache.json'
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return dict(version=CACHE_VERSION, size=stat.st_size,
+                mtime=stat.st_mtime)
+
+
+def _read_cache_header(path):
+    npy_path, header_path = _cache_paths(path)
+    if not (os.path.isfile(npy_path) and os.path.isfile(header_path)):
+        return None
+    try:
+        with open(header_path) as f:
+            header = json.load(f)
+    except:
+        return None
+    stamp = _source_stamp(path)
+    if any(header.get(k) != v for k, v in stamp.items()):
+        return None
+    return header
+
+
+def _replace_file(path, write, mode='wb'):
+    # writes a file through a unique temporary file in the same directory,
+    # so that processes creating the same cache at once never write to the
+    # same file and the file is replaced only when complete
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                                    prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        # mkstemp() creates the file readable only by its owner
+        os.chmod(tmp_path, 0o644)
+        if os.name == 'nt' and os.path.isfile(path):
+            # os.rename() does not replace files on Windows
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_cache_header(path, header):
+    npy_path, header_path = _cache_paths(path)
+    _replace_file(header_path, lambda f: json.dump(header, f, indent=1),
+                  mode='w')
+
+
+def read_cached(path, ncols=None, meta=None):
+    r"""Reads an ASCII file through a binary sidecar cache
+
+    On the first read the file is parsed with :func:`.read_txt` and stored
+    in a ``.npy`` file next to it (``path + '.cache.npy'``), together with
+    a small JSON header (``path + '.cache.json'``) containing the size and
+    modification time of the ASCII file and optional metadata such as
+    ``H_measured``, ``R_best_fit`` or the transformation matrix ``T``.
+    Subsequent reads memory-map the ``.npy`` file, such that large files
+    are loaded instantly and shared among processes through the page
+    cache. The cache is invalidated when the size or the modification time
+    of the ASCII file changes.
+
+    Parameters
+    ----------
+    path : str
+        The path to the ASCII file.
+    ncols : int or None, optional
+        The number of columns. If ``None`` it is obtained from the first
+        line containing data.
+    meta : dict or None, optional
+        Metadata stored in the header when the cache is created. When an
+        outdated cache is rewritten its metadata is kept, updated with
+        ``meta``.
+
+    Returns
+    -------
+    ans : np.ndarray
+        A read-only 2-D array, memory-mapped to the cache whenever it
+        exists, also when it was just created. Use ``ans.copy()`` to modify
+        the values.
+
+    Notes
+    -----
+    The cache can be disabled setting ``read_write.USE_CACHE = False``.
+    When the directory is not writable the ASCII file is parsed on every
+    read.
+
+    A path in the form ``'<stack path>::<index>'`` returns one sample of a
+    :class:`.SampleStack` in the `(\theta, z, imp)` format.
+
+    """
+    stack = split_stack_path(path)
+    if stack is not None:
+        return SampleStack(stack[0]).theta_z_imp(stack[1])
+    if not USE_CACHE:
+        ans = read_txt(path, ncols=ncols)
+        ans.flags.writeable = False
+        return ans
+    npy_path, header_path = _cache_paths(path)
+    header = _read_cache_header(path)
+    if header is not None:
+        try:
+            ans = np.load(npy_path, mmap_mode='r')
+            if ncols is None or ans.shape[1] == ncols:
+                return ans
+        except:
+            pass
+    new_meta = dict(header.get('meta', {})) if header is not None else {}
+    new_meta.update(meta or {})
+    ans = read_txt(path, ncols=ncols)
+    ans.flags.writeable = False
+    try:
+        # an outdated cache still mapped cannot be replaced on Windows, the
+        # parsed array is returned in that case
+        _replace_file(npy_path, lambda f: np.save(f, ans))
+        header = _source_stamp(path)
+        header['shape'] = list(ans.shape)
+        header['meta'] = new_meta
+        _write_cache_header(path, header)
+        log('Binary cache created: {0}'.format(npy_path), level=1)
+    except:
+        warn('Binary cache could not be created for {0}'.format(path),
+             level=1)
+        return ans
+    try:
+        cached = np.load(npy_path, mmap_mode='r')
+    except:
+        # replaced meanwhile by another process
+        return ans
+    if cached.shape != ans.shape:
+        return ans
+    return cached
+
+
+def read_cache_meta(path):
+    """Returns the metadata stored in the binary cache of a file
+
+    Parameters
+    ----------
+    path : str
+        The path to the ASCII file.
+
+    Returns
+    -------
+    meta : dict
+        The metadata, empty if the cache does not exist or is outdated.
+
+    """
+    stack = split_stack_path(path)
+    if stack is not None:
+        return SampleStack(stack[0]).meta()
+    header = _read_cache_header(path)
+    if header is None:
+        return {}
+    return header.get('meta', {})
+
+
+def write_cache_meta(path, **meta):
+    """Updates the metadata stored in the binary cache of a file
+
+    The cache is created if necessary. Numpy arrays are stored as lists.
+
+    Parameters
+    ----------
+    path : str
+        The path to the ASCII file.
+    meta : keyword arguments
+        The metadata, e.g. ``R_best_fit=400.1``.
+
+    """
+    meta = dict((k, v.tolist() if isinstance(v, np.ndarray) else v)
+                for k, v in meta.items())
+    header = _read_cache_header(path)
+    if header is None:
+        read_cached(path, meta=meta)
+        return
+    header.setdefault('meta', {}).update(meta)
+    try:
+        _write_cache_header(path, header)
+    except:
+        warn('Binary cache metadata could not be saved for {0}'.format(path),
+             level=1)
+
+
+def transform_pts(T, pts, chunk_size=CHUNK_SIZE):
+    r"""Applies a transformation matrix to an array of points in chunks
+
+    Equivalent to ``T.dot(np.vstack((pts.T, np.ones(N)))).T`` without
+    building the augmented array.
+
+    Parameters
+    ----------
+    T : np.ndarray
+        The `3 \times 4` transformation matrix (cf. :func:`.transf_matrix`).
+    pts : np.ndarray
+        A 2-D array with `x`, `y`, `z` in the first three columns.
+    chunk_size : int, optional
+        The number of points transformed at a time.
+
+    Returns
+    -------
+    ans : np.ndarray
+        A `N \times 3` 2-D array with the transformed points.
+
+    """
+    R = T[:, :3].T
+    t = T[:, 3]
+    return read_txt(pts, func=lambda c: c[:, :3].dot(R) + t,
+                    chunk_size=chunk_size)
+
 
 def read_theta_z_imp(path,
                      H_measured=None,
@@ -73,7 +537,7 @@ def read_theta_z_imp(path,
         mps = path
     else:
         log('Reading imperfection file: {0} ...'.format(path))
-        mps = np.loadtxt(path, dtype=FLOAT)
+        mps = read_cached(path, ncols=3)
 
     # measuring model dimensions
     z_min = mps[:, 1].min()
@@ -176,7 +640,7 @@ def read_xyz(path,
     if isinstance(path, np.ndarray):
         mps = path
     else:
-        mps = np.loadtxt(path, dtype=FLOAT)
+        mps = read_cached(path, ncols=3)
     r = np.sqrt(mps[:, 0]**2 + mps[:, 1]**2)
     # measuring model dimensions
     if R_best_fit is None:
@@ -279,7 +743,9 @@ def xyz2thetazimp(path,
         If ``True`` it overwrites the values for: ``R_expected`` (for
         cylinders and cones) and ``z_offset_bot`` (for cones), which are
         automatically determined with functions :func:`.best_fit_cylinder` and
-        :func:`.best_fit_cone`.
+        :func:`.best_fit_cone`. For cones ``R_best_fit`` is the bottom
+        radius, `z` starts at the bottom edge of the best-fit cone and
+        ``imp`` is measured normal to its surface.
     best_fit_output : bool, optional
         If the output from the best fit routines should be also returned. In
         case ``True`` the output of this function will be a tuple with
@@ -308,6 +774,9 @@ def xyz2thetazimp(path,
         top edge.
     save : bool, optional
         If the returned array ``mps`` should also be saved to a ``.txt`` file.
+        The binary cache of the saved file (cf. :func:`.read_cached`) is
+        created with ``H_measured``, ``R_best_fit`` and the transformation
+        matrix ``T`` in its metadata.
     fmt : str or sequence of strs, optional
         See ``np.savetxt()`` documentation for more details.
     rotatedeg : float or None, optional
@@ -326,62 +795,102 @@ def xyz2thetazimp(path,
 
     """
     if use_best_fit:
+        log('Reading the data ...')
+        input_pts = read_cached(path, ncols=3)
         log('Finding the best-fit ...')
         if alphadeg_measured==0.:
-            out = best_fit_cylinder(path, R_expected=R_expected, H=H_measured,
-                    save=False, sample_size=sample_size,
-                    errorRtol=errorRtol)
-            R_best_fit = out['R_best_fit']
-            input_pts = np.loadtxt(path, unpack=True)
-            pts = np.vstack((input_pts, np.ones_like(input_pts[0, :])))
-            x, y, z = out['T'].dot(pts)
-            zmin = z.min()
-            zmax = z.max()
-            z -= zmin
-            H_points = zmax - zmin
-            if z_offset_bot:
-                z += z_offset_bot
-            else:
-                z += (H_measured - H_points)/2. # centralizes the points
+            out = best_fit_cylinder(input_pts, R_expected=R_expected,
+                    H=H_measured, save=False, sample_size=sample_size,
+                    errorRtol=errorRtol, output_pts=best_fit_output)
+        else:
+            out = best_fit_cone(input_pts, H=H_measured,
+                    alphadeg=alphadeg_measured, R_expected=R_expected,
+                    save=False, sample_size=sample_size, errorRtol=errorRtol,
+                    output_pts=best_fit_output)
+        R_best_fit = out['R_best_fit']
+        R = out['T'][:, :3].T
+        t = out['T'][:, 3]
+        # z range of the transformed points, one chunk at a time
+        zmin = np.inf
+        zmax = -np.inf
+        for i in range(0, input_pts.shape[0], CHUNK_SIZE):
+            zc = input_pts[i:i+CHUNK_SIZE].dot(R[:, 2]) + t[2]
+            zmin = min(zmin, zc.min())
+            zmax = max(zmax, zc.max())
+        H_points = zmax - zmin
+        if alphadeg_measured!=0.:
+            # the bottom edge of the best-fit cone is already at z=0
+            z_shift = 0.
+        elif z_offset_bot:
+            z_shift = z_offset_bot - zmin
+        else:
+            # centralizes the points
+            z_shift = (H_measured - H_points)/2. - zmin
+        zmin += z_shift
+        zmax += z_shift
+        def transform(chunk):
+            chunk = chunk.dot(R) + t
+            chunk[:, 2] += z_shift
+            return chunk
     else:
         R_best_fit = R_expected
         log('Reading the data ...')
-        d, data, d = read_xyz(path, alphadeg_measured, R_best_fit,
-                              H_measured, None, z_offset_bot, r_TOL)
-        x, y, z = data.T
-
+        d, input_pts, d = read_xyz(path, alphadeg_measured, R_best_fit,
+                                   H_measured, None, z_offset_bot, r_TOL)
+        zmin = input_pts[:, 2].min()
+        zmax = input_pts[:, 2].max()
+        transform = None
+
+    zlow = -np.inf
+    zhigh = np.inf
+    if clip_bottom:
+        zlow = zmin + clip_bottom
+        log('Removing points with z <= {0:1.6f}'.format(zlow))
+    if clip_top:
+        zhigh = zmax - clip_top
+        log('Removing points with z >= {0:1.6f}'.format(zhigh))
+
+    def calc_theta_z_imp(chunk):
+        if transform is not None:
+            chunk = transform(chunk)
+        x, y, z = chunk.T
+        if clip_bottom or clip_top:
+            mask = (z > zlow) & (z < zhigh)
+            x = x[mask]
+            y = y[mask]
+            z = z[mask]
+        theta = np.arctan2(y, x)
+        if rotatedeg is not None:
+            theta += np.deg2rad(rotatedeg)
+        if use_best_fit and alphadeg_measured!=0.:
+            # normal distance to the best-fit cone
+            alpharad = np.deg2rad(alphadeg_measured)
+            imp = (np.sqrt(x**2 + y**2) - R_best_fit
+                   + z*np.tan(alpharad))*np.cos(alpharad)
+        else:
+            imp = np.sqrt(x**2 + y**2) - R_best_fit
+        return np.vstack((theta, z, imp)).T
+
+    # the points are converted one chunk at a time. The best fit above
+    # still uses all the points in its last level, unless sample_size is
+    # given
+    num = input_pts.shape[0]
+    mps = read_txt(input_pts, func=calc_theta_z_imp)
+    del input_pts
     if clip_bottom or clip_top:
-        mask = np.ones(z.shape[0], dtype=bool)
-        if clip_bottom:
-            zmin = z.min()
-            log('Removing points with z <= {0:1.6f}'.format(zmin+clip_bottom))
-            mask &= (z > (zmin + clip_bottom))
-        if clip_top:
-            zmax = z.max()
-            log('Removing points with z >= {0:1.6f}'.format(zmax-clip_top))
-            mask &= (z < (zmax - clip_top))
-        shape1 = x.shape[0]
-        x = x[mask]
-        y = y[mask]
-        z = z[mask]
-        shape2 = x.shape[0]
-        log('Total of {0} points excluded.'.format(shape1 - shape2),
+        log('Total of {0} points excluded.'.format(num - mps.shape[0]),
                 level=1)
+    log('Minimum imperfection: {0}'.format(mps[:, 2].min()))
+    log('Maximum imperfection: {0}'.format(mps[:, 2].max()))
 
-    r = np.sqrt(x**2 + y**2)
-    theta = np.arctan2(y, x)
-    imp = r - R_best_fit
-    log('Minimum imperfection: {0}'.format(imp.min()))
-    log('Maximum imperfection: {0}'.format(imp.max()))
-
-    if rotatedeg is not None:
-        theta += np.deg2rad(rotatedeg)
-
-    mps = np.vstack((theta, z, imp)).T
     if save:
         outpath = ('.'.join(os.path.basename(path).split('.')[:-1]) +
                    '_theta_z_imp.txt')
         np.savetxt(outpath, mps, fmt=fmt)
+        meta = dict(H_measured=H_measured, R_best_fit=R_best_fit)
+        if use_best_fit:
+            meta['T'] = out['T']
+        write_cache_meta(outpath, **meta)
     if best_fit_output:
         return mps, out
     else:
@@ -461,7 +970,7 @@ def xyzthick2thetazthick(path,
         and third columns, respectively.
 
     """
-    inputa = np.loadtxt(path)
+    inputa = read_cached(path)
     if inputa.shape[1] != 4:
         raise ValueError('Input file does not have the format: "x y z thick"')
 
@@ -472,17 +981,22 @@ def xyzthick2thetazthick(path,
         log('Finding the best-fit ...')
         if alphadeg_measured == 0.:
             out = best_fit_cylinder(xyz, R_expected=R_expected, H=H_measured,
-                    save=False, sample_size=sample_size)
+                    save=False, sample_size=sample_size, output_pts=False)
             R_best_fit = out['R_best_fit']
-            input_pts = np.loadtxt(path, unpack=True)[:, :3]
-            pts = np.vstack((input_pts, np.ones_like(input_pts[0, :])))
-            x, y, z = out['T'].dot(pts)
+            x, y, z = transform_pts(out['T'], xyz).T
             z -= z.min()
             H_points = z.max() - z.min()
             if z_offset_bot:
                 z += z_offset_bot
             else:
                 z += (H_measured - H_points)/2. # centralizes the points
+        else:
+            out = best_fit_cone(xyz, H=H_measured, alphadeg=alphadeg_measured,
+                    R_expected=R_expected, save=False,
+                    sample_size=sample_size, output_pts=False)
+            R_best_fit = out['R_best_fit']
+            # the bottom edge of the best-fit cone is at z=0
+            x, y, z = transform_pts(out['T'], xyz).T
     else:
         R_best_fit = R_expected
         log('Reading the data ...')
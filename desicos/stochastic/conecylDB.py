@@ -123,6 +123,18 @@ class ConeCylDBEntry(object):
 	def getGeometry(self):
 		return (self.getProperty('H'),self.getProperty('R'),self.getProperty('alpha'))
 
+	def _getImperfectionPath(self,key):
+		inType=type(self.getProperty(key))
+		if not inType in [unicode, str]:
+			return None
+		return self.abspath+'/'+self.getProperty(key)
+
+	def getGeometricImperfectionPath(self):
+		return self._getImperfectionPath('imp_geom')
+
+	def getThicknessImperfectionPath(self):
+		return self._getImperfectionPath('imp_thick')
+
 	def getGeometricImperfection(self):
 		inType=type(self.getProperty('imp_geom')) 
 		if not inType in [unicode, str]:
@@ -25,6 +25,66 @@ def getImperfectionArray(tht,z,IM,fx,fy):
     return griddata( (tht,z),IM,(X,Y),method='linear')
 
 
+def getImperfectionArrayBinned(tht,z,IM,fx,fy,maxSigma=8.0):
+    """ Resamples scattered (tht,z,IM) data onto the regular grid (fx,fy)
+        without triangulation. Each point is binned to its closest grid
+        node and the nodes with data take the mean value of their points.
+        Empty nodes are filled by normalized convolution (ratio of the
+        Gaussian-filtered sums and counts), with the width of the kernel
+        doubled up to maxSigma nodes until the gaps are closed.
+        If fx covers [0,2*pi] the theta direction is periodic and the
+        last column repeats the first one.
+        The rows outside the z range of the data are NaN, like in
+        getImperfectionArray
+    """
+    from scipy.ndimage import gaussian_filter1d
+    tht=np.asarray(tht,dtype=float)
+    z=np.asarray(z,dtype=float)
+    IM=np.asarray(IM,dtype=float)
+    fx=np.asarray(fx,dtype=float)
+    fy=np.asarray(fy,dtype=float)
+    periodic=abs(fx[-1]-fx[0]-2.0*np.pi) < TOL
+    nt=len(fx)-1 if periodic else len(fx)
+    nz=len(fy)
+    dt=(fx[-1]-fx[0])/(len(fx)-1)
+    dz=(fy[-1]-fy[0])/(nz-1)
+
+    it=np.rint((tht-fx[0])/dt).astype(int)
+    if periodic:
+        it%=nt
+    iz=np.rint((z-fy[0])/dz).astype(int)
+    keep=(it>=0) & (it<nt) & (iz>=0) & (iz<nz) & np.isfinite(IM)
+    idx=iz[keep]*nt+it[keep]
+    S=np.bincount(idx,weights=IM[keep],minlength=nz*nt).reshape(nz,nt)
+    W=np.bincount(idx,minlength=nz*nt).astype(float).reshape(nz,nt)
+
+    res=np.empty((nz,nt))
+    res.fill(np.nan)
+    hasData=W>0
+    res[hasData]=S[hasData]/W[hasData]
+    rows=np.flatnonzero(hasData.any(axis=1))
+    if len(rows) > 0:
+        # gaps are only closed between the first and last rows with data
+        inside=np.zeros((nz,nt),dtype=bool)
+        inside[rows[0]:rows[-1]+1]=True
+        modeT='wrap' if periodic else 'constant'
+        sigma=1.0
+        while sigma <= maxSigma:
+            empty=inside & np.isnan(res)
+            if not empty.any():
+                break
+            Sc=gaussian_filter1d(S,sigma,axis=1,mode=modeT)
+            Sc=gaussian_filter1d(Sc,sigma,axis=0,mode='constant')
+            Wc=gaussian_filter1d(W,sigma,axis=1,mode=modeT)
+            Wc=gaussian_filter1d(Wc,sigma,axis=0,mode='constant')
+            fill=empty & (Wc > 1.e-12)
+            res[fill]=Sc[fill]/Wc[fill]
+            sigma*=2
+    if periodic:
+        res=np.hstack((res,res[:,:1]))
+    return res
+
+
 def getImperfectionArray3D(data,nx,ny,H,RB,RT=None):
     if RT is None:
         RT=RB
@@ -46,7 +106,10 @@ def getImperfectionArray3D(data,nx,ny,H,RB,RT=None):
     pI=np.array([xi,yi,zi]).transpose()
 
     im0=getGeomImperfection(r,z,RB,RT)
-    imNew=griddata( pP ,im0, pI, method='nearest' )
+    # same as griddata(method='nearest'), without building the
+    # interpolator object around the KD-tree
+    from scipy.spatial import cKDTree
+    imNew=im0[cKDTree(pP).query(pI)[1]]
 
     return fx,fy,imNew.reshape(nx,ny)
 
@@ -17,6 +17,236 @@ def nextpow2(n):
     m_i = np.ceil(m_f)
     return int(m_i)
 
+def fftLength(n,padding=16,fastLengths=False):
+    """ Length of the zero-padded FFT of n points: padding*2**nextpow2(n)
+        or, with fastLengths, the smallest 2**a*3**b*5**c >= padding*n
+    """
+    if fastLengths:
+        return int(fftpack.next_fast_len(int(np.ceil(padding*n))))
+    return int(padding*2**nextpow2(n))
+
+try:
+    # scipy >= 1.4, multithreaded with workers
+    import scipy.fft as _sfft
+    def _rfft(a,n,axis,workers):
+        return _sfft.rfft(a,n=n,axis=axis,workers=workers)
+    def _fft(a,n,axis,workers):
+        return _sfft.fft(a,n=n,axis=axis,workers=workers)
+except ImportError:
+    def _rfft(a,n,axis,workers):
+        return np.fft.rfft(a,n=n,axis=axis)
+    def _fft(a,n,axis,workers):
+        return np.fft.fft(a,n=n,axis=axis)
+
+class SpectralStats(object):
+
+    """
+        Running statistics of an ensemble of samples given on the same
+        (x,y) grid: mean and variance fields and power spectral density
+        of the windowed deviations from the mean. They are updated with
+        Welford's algorithm in O(one sample) per added sample, stored
+        with save() / load() and combined with merge(), so that
+        ensembles can be joined without the raw samples.
+
+        For the spectra the running mean of the (linear) FFTs and the
+        sum of the squared deviations from it are kept, which gives the
+        same PSD as transforming the deviations from the final mean.
+
+        The FFT lengths are given by fftLength(n,padding,fastLengths),
+        the defaults reproduce the original 16x power-of-two padding.
+        Only the kept quadrant is transformed: a real FFT of the non-zero
+        rows followed by a complex FFT of the kept columns, for a stack
+        of samples at once (workers threads with scipy >= 1.4).
+    """
+
+    chunkSize=8
+
+    def __init__(self,x,y,fil=('none',()),padding=16,fastLengths=False,
+                 workers=None):
+        self.x=np.asarray(x,dtype=float)
+        self.y=np.asarray(y,dtype=float)
+        self.fil=(str(fil[0]),tuple(fil[1]))
+        self.nx=len(self.x)
+        self.ny=len(self.y)
+        FilterWindows2D.setInputArray(self.y,self.x)
+        self.winFilter=FilterWindows2D.filters[self.fil[0]]( *self.fil[1] )
+
+        self.padding=padding
+        self.fastLengths=bool(fastLengths)
+        self.workers=workers
+        self.nFFT1 = fftLength(self.nx,padding,fastLengths)
+        self.nFFT2 = fftLength(self.ny,padding,fastLengths)
+        self.a1 = self.nFFT1//2
+        self.a2 = self.nFFT2//2
+
+        self.n=0
+        self.mean=np.zeros((self.ny,self.nx))
+        self.M2=np.zeros((self.ny,self.nx))
+        self.meanF=np.zeros((self.a1,self.a2),dtype=complex)
+        self.S=np.zeros((self.a1,self.a2))
+
+    def _spectra(self,datas):
+        # quadrant [0:a1,0:a2] of fft2(data*winFilter,s=[nFFT1,nFFT2])
+        z=_rfft(datas*self.winFilter,self.nFFT2,-1,self.workers)
+        z=_fft(z[...,0:self.a2],self.nFFT1,-2,self.workers)
+        return z[...,0:self.a1,:]
+
+    def add(self,data):
+        self.addMany([data])
+
+    def addMany(self,datas):
+        """ Adds several samples, transformed in stacks of chunkSize
+        """
+        for i in range(0,len(datas),self.chunkSize):
+            chunk=np.asarray(datas[i:i+self.chunkSize],dtype=float)
+            Fs=self._spectra(chunk)
+            for data,F in zip(chunk,Fs):
+                self.n+=1
+                delta=data-self.mean
+                self.mean+=delta/self.n
+                self.M2+=delta*(data-self.mean)
+                deltaF=F-self.meanF
+                self.meanF+=deltaF/self.n
+                self.S+=(deltaF*np.conj(F-self.meanF)).real
+
+    def isCompatible(self,other):
+        return (self.mean.shape == other.mean.shape and
+                np.allclose(self.x,other.x) and np.allclose(self.y,other.y)
+                and self.fil == other.fil and self.nFFT1 == other.nFFT1
+                and self.nFFT2 == other.nFFT2)
+
+    def merge(self,other):
+        """ Adds the statistics of another ensemble (Chan et al.)
+        """
+        if not self.isCompatible(other):
+            raise ValueError('Statistics with different grids or filters')
+        n=self.n+other.n
+        if other.n == 0:
+            return
+        delta=other.mean-self.mean
+        deltaF=other.meanF-self.meanF
+        fac=float(self.n)*other.n/n
+        self.mean+=delta*other.n/n
+        self.M2+=other.M2+delta**2*fac
+        self.meanF+=deltaF*other.n/n
+        self.S+=other.S+(deltaF*np.conj(deltaF)).real*fac
+        self.n=n
+
+    @property
+    def aveFunc(self):
+        return self.mean
+
+    @property
+    def eW(self):
+        return self.M2/self.n
+
+    @property
+    def sh(self):
+        return self.S/(self.nFFT1*self.nFFT2*self.n)
+
+    def save(self,fname):
+        np.savez(fname,x=self.x,y=self.y,filName=np.array(self.fil[0]),
+                 filArgs=np.array(self.fil[1],dtype=float),n=self.n,
+                 padding=self.padding,fastLengths=self.fastLengths,
+                 mean=self.mean,M2=self.M2,meanF=self.meanF,S=self.S)
+        logging.info('saved:'+str(fname))
+
+    @classmethod
+    def load(cls,fname):
+        tmp=np.load(fname)
+        stats=cls(tmp['x'],tmp['y'],
+                  (str(tmp['filName']),tuple(tmp['filArgs'])),
+                  float(tmp['padding']),bool(tmp['fastLengths']))
+        stats.n=int(tmp['n'])
+        stats.mean=tmp['mean']
+        stats.M2=tmp['M2']
+        stats.meanF=tmp['meanF']
+        stats.S=tmp['S']
+        return stats
+
+
+class SpectralModel(object):
+
+    """
+        Fitted spectral representation of a set of samples (mean field,
+        variance field and normalized power spectral density). It is
+        produced once by Samples.compute(), it can be stored with
+        save() / load() and new samples are drawn from it with
+        getNewSample() without the input data
+    """
+
+    arrays=('x','y','aveFunc','eW','fxIn','fyIn','bruch')
+
+    def __init__(self,x,y,aveFunc,eW,fxIn,fyIn,bruch,geometry=None):
+        self.x=np.asarray(x,dtype=float)
+        self.y=np.asarray(y,dtype=float)
+        self.aveFunc=np.asarray(aveFunc,dtype=float)
+        self.eW=np.asarray(eW,dtype=float)
+        self.fxIn=np.asarray(fxIn,dtype=float)
+        self.fyIn=np.asarray(fyIn,dtype=float)
+        self.bruch=np.asarray(bruch,dtype=float)
+        self.geometry=geometry
+        self.ny,self.nx=self.aveFunc.shape
+
+        dfx=self.fxIn[1]
+        dfy=self.fyIn[1]
+        # A1=sqrt(2*eW*bruch*dfx*dfy) is separated in a grid part and
+        # a spectral part, only the latter enters the double sum
+        self._gridAmp=np.sqrt(2.)*np.sqrt(2.0*self.eW*dfx*dfy)
+        self._specAmp=np.sqrt(self.bruch[1:,1:])
+        self._ex=np.exp(1j*np.outer(self.fxIn[1:],self.x))
+        self._ey=np.exp(1j*np.outer(self.y,self.fyIn[1:]))
+
+    def save(self,fname):
+        data=dict((k,getattr(self,k)) for k in self.arrays)
+        if self.geometry is not None:
+            data['geometry']=np.array(self.geometry,dtype=float)
+        np.savez(fname,**data)
+        logging.info('saved:'+str(fname))
+
+    @classmethod
+    def load(cls,fname):
+        tmp=np.load(fname)
+        geometry=None
+        if 'geometry' in tmp.files:
+            geometry=tuple(tmp['geometry'])
+        return cls(*[tmp[k] for k in cls.arrays],geometry=geometry)
+
+    def getPhases(self):
+        """ Draws the random phases of a new sample, the random
+            numbers are consumed in the same order as in the original
+            term-by-term generator (phi1 and phi2 alternated for each
+            (n1,n2) term), so that seeded samples are reproduced
+        """
+        n1,n2=self.bruch.shape
+        phi1=np.zeros(self.bruch.shape)
+        phi2=np.zeros(self.bruch.shape)
+        rnd=2*np.pi*np.random.rand((n1-1)*(n2-1)*2).reshape(n1-1,n2-1,2)
+        phi1[1:,1:]=rnd[:,:,0]
+        phi2[1:,1:]=rnd[:,:,1]
+        return phi1,phi2
+
+    def getNewSample(self,phases=None):
+        """ Generates a new sample using the spectral representation
+
+            The double cosine sum over the (n1,n2) terms is evaluated
+            for the whole grid at once, with matrix products of the
+            complex exponentials along x and y
+
+            phases - optional tuple (phi1,phi2) of arrays with the shape
+                     of bruch, by default they are drawn with getPhases()
+        """
+        if phases is None:
+            phases=self.getPhases()
+        phi1,phi2=phases
+        c1=self._specAmp*np.exp(1j*phi1[1:,1:])
+        c2=self._specAmp*np.exp(1j*phi2[1:,1:])
+        # cos(fx*x+fy*y+phi1)+cos(fx*x-fy*y+phi2)
+        sumCos=(np.dot(self._ey,np.dot(c1.T,self._ex)).real+
+                np.dot(self._ey.conj(),np.dot(c2.T,self._ex)).real)
+        return self._gridAmp*sumCos+self.aveFunc
+
+
 class Samples(object):
 
     """
@@ -36,9 +266,44 @@ class Samples(object):
         #self.fil=('hamming',(0.53836,-0.46164,0.53836,-0.46164) )#  ('trapezoid',(0.1,0.1))
         self.fil=('none',())
         self.strFacts=[StructurePattern()]
+        self.model=None
+        self.stats=None
+        self._nStats=0
+        self._externalStats=False
+        self.fftPadding=16
+        self.fftFastLengths=False
+        self.fftWorkers=None
+
+    def _resetStats(self):
+        if self._externalStats:
+            logging.warning('Loaded/merged statistics discarded!')
+        self.stats=None
+        self._nStats=0
+        self._externalStats=False
 
     def setFilter(self,name,args):
         self.fil=(name,args)
+        self.model=None
+        if self.stats is not None and self.stats.fil != (name,tuple(args)):
+            self._resetStats()
+
+    def setFFTOptions(self,padding=16,fastLengths=False,workers=None):
+        """ padding     - zero-padding factor of the FFTs
+            fastLengths - use the smallest 2**a*3**b*5**c FFT lengths
+                          >= padding*n instead of padding*2**nextpow2(n)
+            workers     - number of threads of the FFTs (scipy >= 1.4)
+            The defaults reproduce the original spectra
+        """
+        self.fftWorkers=workers
+        if self.stats is not None:
+            self.stats.workers=workers
+        if (padding,bool(fastLengths)) != (self.fftPadding,
+                                          self.fftFastLengths):
+            self.fftPadding=padding
+            self.fftFastLengths=bool(fastLengths)
+            self.model=None
+            if self.stats is not None:
+                self._resetStats()
 
     def getCurrentFilterName(self):
         return self.fil[0]
@@ -46,16 +311,71 @@ class Samples(object):
     def getInputsCount(self):
         return len(self.indata)
 
+    def getStats(self):
+        """ Returns the SpectralStats of the inputs, only the inputs
+            added since the last call are processed
+        """
+        if self.stats is None:
+            self.stats=SpectralStats(self.x,self.y,self.fil,
+                                     self.fftPadding,self.fftFastLengths,
+                                     self.fftWorkers)
+            self._nStats=0
+        self.stats.addMany(self.indata[self._nStats:])
+        self._nStats=len(self.indata)
+        return self.stats
+
+    def _setGridFromStats(self,stats):
+        if len(self.indata) == 0:
+            self.x=stats.x
+            self.y=stats.y
+            self.ny,self.nx=stats.ny,stats.nx
+            self.lx=self.x[-1:][0]
+            self.ly=self.y[-1:][0]
+            self.fil=stats.fil
+            self.fftPadding=stats.padding
+            self.fftFastLengths=stats.fastLengths
+
+    def saveStats(self,fname):
+        self.getStats().save(fname)
+
+    def loadStats(self,fname):
+        """ Replaces the statistics by the ones stored in fname, the
+            inputs added afterwards are accumulated on top of them
+        """
+        stats=SpectralStats.load(fname)
+        self._setGridFromStats(stats)
+        self.stats=stats
+        self._nStats=len(self.indata)
+        self._externalStats=True
+        self.model=None
+
+    def mergeStats(self,other):
+        """ Merges the statistics of another ensemble, given as a
+            SpectralStats object or a file saved with saveStats
+        """
+        if not isinstance(other,SpectralStats):
+            other=SpectralStats.load(other)
+        if self.stats is None and len(self.indata) == 0:
+            self._setGridFromStats(other)
+            self.stats=SpectralStats(other.x,other.y,other.fil,
+                                     other.padding,other.fastLengths,
+                                     self.fftWorkers)
+        self.getStats().merge(other)
+        self._externalStats=True
+        self.model=None
+
     def getFilter(self):
         return self.winFilter
     def setAmplitudeThreshold(self,val):
         self.amplThreshold=val
+        self.model=None
 
     def setFreqRng(self,ax,rng):
         if ax == 'x':
             self.fxRange=rng
         if ax == 'y':
             self.fyRange=rng
+        self.model=None
 
     def setGeometry(self,RB,H,alpha):
         self.RB=RB
@@ -78,6 +398,7 @@ class Samples(object):
             futher processing
         """
         self.nSamples+=1
+        self.model=None
         if self.nSamples == 1:
             self.indata.append(data)
             (self.ny,self.nx)=data.shape
@@ -136,41 +457,26 @@ class Samples(object):
 
 
     def compute(self):
-        if len(self.indata) < 2:
+        nStats=0
+        if self.stats is not None:
+            nStats=self.stats.n+len(self.indata)-self._nStats
+        if len(self.indata) < 2 and nStats < 2:
             logging.warning("insufficient input count!")
             return
-        FilterWindows2D.setInputArray(self.y,self.x)
-        self.winFilter=FilterWindows2D.filters[self.fil[0]]( *self.fil[1]  )
-        self.aveFunc=np.zeros(self.indata[0].shape)
-        self.eW=np.zeros(self.indata[0].shape)
-
-        for data in self.indata:
-            self.aveFunc+=data/self.nSamples
+        stats=self.getStats()
+        self.winFilter=stats.winFilter
+        self.aveFunc=stats.aveFunc.copy()
+        self.eW=stats.eW
 
-        for i in range(len(self.indata)):
-            self.data.append(self.indata[i]-self.aveFunc)
-            self.eW+= (self.data[i]**2.0)/self.nSamples
+        nFFT1 = stats.nFFT1
+        nFFT2 = stats.nFFT2
 
-        for i in range(len(self.data)):
-            self.data[i]=self.data[i]*self.winFilter
-
-        nFFT1 = 16*2**nextpow2(self.nx)
-        nFFT2 = 16*2**nextpow2(self.ny)
-
-        a1 = nFFT1/2
-        a2 = nFFT2/2
-        a2Mod = nFFT2/8/2
+        a1 = stats.a1
+        a2 = stats.a2
 
         self.a1=a1
         self.a2=a2
-        self.sh=np.zeros((a1,a2))
-
-        for data in self.data:
-            z=np.fft.fft2(data,s=[nFFT1,nFFT2])
-#            z=scipy.fftpack.fft2(data,shape=[nFFT1,nFFT2])
-            trans= (np.abs(z)**2) / (nFFT1*nFFT2)
-            self.sh+=trans[0:a1,0:a2]/self.nSamples
-            self.trans=trans
+        self.sh=stats.sh
 
         dfx=self.lx/(self.nx-1)
         dfy=self.ly/(self.ny-1)
@@ -200,40 +506,66 @@ class Samples(object):
         else:
             self.bruch=self.shMod
 
+        geometry=None
+        if hasattr(self,'RB'):
+            geometry=(self.RB,self.H,self.alpha)
+        self.model=SpectralModel(self.x,self.y,self.aveFunc,self.eW,
+                                 self.fxIn,self.fyIn,self.bruch,geometry)
 
 
-    def getNewSample(self):
-        x=self.x
-        y=self.y
-        eW=self.eW
-        bruch=self.bruch
-        fxIn=self.fxIn
-        fyIn=self.fyIn
-        res=np.zeros((self.ny,self.nx))
-        phi1=np.zeros(self.shMod.shape)
-        phi2=np.zeros(self.shMod.shape)
-        sqrt2=np.sqrt(2.)
-#        bruch=np.loadtxt('stochastic/bruch',delimiter=',')
-
-        for i in range(1,self.shMod.shape[0]):
-            for j in range(1,self.shMod.shape[1]):
-                phi1[i][j]=2*np.pi*np.random.rand()
-                phi2[i][j]=2*np.pi*np.random.rand()
-#        phi1=np.loadtxt('stochastic/phi1',delimiter=',')
-#        phi2=np.loadtxt('stochastic/phi2',delimiter=',')
-
-        dfx=fxIn[1].copy()
-        dfy=fyIn[1].copy()
-
-        for iy in range(0,self.ny):
-            for ix in range(0,self.nx):
-                for n1 in range(1,self.shMod.shape[0]):
-                    for n2 in range(1,self.shMod.shape[1]):
-                        A1=np.sqrt(2.0*eW[iy][ix]*bruch[n1][n2]*dfx*dfy)
-
-                        res[iy][ix]+=sqrt2*(A1*np.cos(fxIn[n1]*x[ix]+fyIn[n2]*y[iy]+phi1[n1][n2])+ \
-                                        A1*np.cos(fxIn[n1]*x[ix]-fyIn[n2]*y[iy]+phi2[n1][n2]))
-        res+=self.aveFunc
+    def getModel(self):
+        """ Returns the fitted SpectralModel, compute() is only called
+            when no model is available for the current inputs
+        """
+        if self.model is None:
+            self.compute()
+        return self.model
+
+    def setModel(self,model):
+        """ Uses an already fitted (e.g. loaded) SpectralModel to draw
+            new samples without any input data
+        """
+        self.model=model
+        self.x=model.x
+        self.y=model.y
+        self.ny,self.nx=model.ny,model.nx
+        self.lx=self.x[-1:][0]
+        self.ly=self.y[-1:][0]
+        self.aveFunc=model.aveFunc
+        self.eW=model.eW
+        self.fxIn=model.fxIn
+        self.fyIn=model.fyIn
+        self.bruch=model.bruch
+        if model.geometry is not None:
+            self.setGeometry(*model.geometry)
+
+    def saveModel(self,fname):
+        self.getModel().save(fname)
+
+    def loadModel(self,fname):
+        self.setModel(SpectralModel.load(fname))
+
+    def getPhases(self):
+        return self.getModel().getPhases()
+
+    def getNewSample(self,phases=None,seed=None):
+        """ Draws a new sample from the fitted SpectralModel and adds
+            the surface patterns
+
+            phases - optional tuple (phi1,phi2), see SpectralModel
+            seed   - optional seed (int or sequence of ints) of the
+                     random stream used for this sample only, both the
+                     phases and the surface patterns are drawn from it
+                     and the global np.random state is restored
+        """
+        if seed is not None:
+            state=np.random.get_state()
+            np.random.seed(seed)
+            try:
+                return self.getNewSample(phases)
+            finally:
+                np.random.set_state(state)
+        res=self.getModel().getNewSample(phases)
         self._tmp_res=res.copy()
         self._tmp_pat=np.zeros(self._tmp_res.shape)
         for strFact in self.strFacts:
@@ -244,5 +576,3 @@ class Samples(object):
             self._tmp_pat+=pat
 
         return res
-
-
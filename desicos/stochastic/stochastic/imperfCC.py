@@ -4,10 +4,18 @@ import numpy.ma as ma
 import copy
 import time
 import sys
+import os
+import json
 #sys.path.append( '/home/pavel/Documents/desicos/abaqus-conecyl-python_DEV')
 from  st_utils.coords import *
 from imperf import Samples
 from conecylDB import*
+try:
+    # chunked parser of the measured imperfection files, the rows with
+    # comments or a different number of values are parsed by np.loadtxt
+    from desicos.conecylDB.read_write import read_txt
+except ImportError:
+    read_txt=None
 
 
 class SamplesCC(Samples):
@@ -17,6 +25,7 @@ class SamplesCC(Samples):
         self.scalingFactor=1.0
         self.samplingRadial=256
         self.samplingAxial=128
+        self.resampling='binned'
         if conecylDBFile is not None:
             self.ccdb=ConeCylDB(conecylDBFile)
         else:
@@ -30,6 +39,15 @@ class SamplesCC(Samples):
     def setAxialSampling(self,val):
         self.samplingAxial=val
 
+    def setResampling(self,name):
+        """ Method used to resample the scattered input points onto the
+            (theta,z) grid: 'binned' (binning and normalized convolution,
+            see getImperfectionArrayBinned) or 'linear' (griddata)
+        """
+        if name not in ('binned','linear'):
+            raise ValueError('Invalid resampling: '+str(name))
+        self.resampling=name
+
     def setOutputName(self,name):
         self.outName=name
 
@@ -58,6 +76,15 @@ class SamplesCC(Samples):
             return
 
 
+        if self.imp_type == 'ms':
+            path=IMP.getGeometricImperfectionPath()
+        if self.imp_type == 'thick':
+            path=IMP.getThicknessImperfectionPath()
+        (H,R,alpha)=IMP.getGeometry()
+        if path is not None:
+            self.importFromFile(path,H,R,alpha)
+            return
+
         if self.imp_type == 'ms':
             b=IMP.getGeometricImperfection()
         if self.imp_type == 'thick':
@@ -65,11 +92,50 @@ class SamplesCC(Samples):
         if b is None:
             logging.warning(str(imp_name)+" with imperfection "+str(imp_type)+" is not in IMPERFECTION database!")
             return
-        (H,R,alpha)=IMP.getGeometry()
         self.importFromXYZ(b,H,R,alpha)
 
+    def _gridCacheKey(self,fname,H,RB,alpha):
+        stat=os.stat(fname)
+        return {'version':1,'size':stat.st_size,'mtime':stat.st_mtime,
+                'imp_type':self.imp_type,'resampling':self.resampling,
+                'samplingRadial':self.samplingRadial,
+                'samplingAxial':self.samplingAxial,
+                'H':H,'RB':RB,'alpha':alpha}
+
+    def importFromFile(self,fname,H,RB,alpha):
+        """ Same as importFromXYZ reading the points from a text file.
+            The resampled grid is cached in fname+'.grid.npz' and reused
+            while the file, the sampling, the resampling method and the
+            geometry stay the same
+        """
+        cache=fname+'.grid.npz'
+        key=json.dumps(self._gridCacheKey(fname,H,RB,alpha),sort_keys=True)
+        try:
+            tmp=np.load(cache)
+            if str(tmp['key']) == key:
+                self.setGeometry(RB,H,alpha)
+                self.addData(tmp['IMPERF'],tmp['ft'],tmp['fz'])
+                logging.info('using cached grid:'+cache)
+                return
+        except:
+            pass
+        if read_txt is not None:
+            # much faster than np.loadtxt for large files
+            b=read_txt(fname)
+        else:
+            b=np.loadtxt(fname,ndmin=2)
+        IMPERF,ft,fz=self._resampleXYZ(b,H,RB,alpha)
+        try:
+            np.savez(cache,key=np.array(key),IMPERF=IMPERF,ft=ft,fz=fz)
+        except:
+            logging.warning('Can not write to file: '+str(cache))
+        self.addData(IMPERF,ft,fz)
 
     def importFromXYZ(self,b,H,RB,alpha):
+        IMPERF,ft,fz=self._resampleXYZ(b,H,RB,alpha)
+        self.addData(IMPERF,ft,fz)
+
+    def _resampleXYZ(self,b,H,RB,alpha):
         RT=RB-H *( np.tan(alpha ) )
         x,y,z=b[:,0],b[:,1],b[:,2]
         r,tht,z=rec2cyl(x,y,z)
@@ -80,26 +146,28 @@ class SamplesCC(Samples):
         else:
             imp=getGeomImperfection(r,z,rPerf)
 
-        tm1=ma.masked_less(tht,0.1*np.pi).mask
-        tm2=ma.masked_greater(tht,1.9*np.pi).mask
-
-        tht=np.hstack((tht, np.pi*2.0+tht[tm1],  0.0+(-1.0)*tht[tm2]))
-        r=np.hstack((r,r[tm1],r[tm2] ))
-        z=np.hstack((z,z[tm1],z[tm2]))
-        imp=np.hstack((imp,imp[tm1],imp[tm2]))
-
         ft=np.linspace(0,2.0*np.pi,self.samplingRadial)
         fz=np.linspace(0,H,self.samplingAxial)
-        IMPERF=getImperfectionArray(tht,z,imp,ft,fz)
+        if self.resampling == 'binned':
+            IMPERF=getImperfectionArrayBinned(tht,z,imp,ft,fz)
+        else:
+            # rec2cyl gives tht in (-pi,pi], the grid ft spans [0,2*pi]
+            tht=np.mod(tht,2.0*np.pi)
+            tm1=tht<0.1*np.pi
+            tm2=tht>1.9*np.pi
+
+            tht=np.hstack((tht, np.pi*2.0+tht[tm1],  0.0+(-1.0)*tht[tm2]))
+            r=np.hstack((r,r[tm1],r[tm2] ))
+            z=np.hstack((z,z[tm1],z[tm2]))
+            imp=np.hstack((imp,imp[tm1],imp[tm2]))
 
-        mf=[]
-        for row in IMPERF[0:len(IMPERF)]:
-            mf.append( np.isnan(np.sum(row))  )
-        row1=mf.index(False)
-        mr=[]
-        for i in reversed(mf):
-            mr.append(i)
-        row2= len(mf)-1-mr.index(False)
+            IMPERF=getImperfectionArray(tht,z,imp,ft,fz)
+
+        # rows with missing values close to the edges are mirrored
+        mf=np.isnan(IMPERF).any(axis=1)
+        valid=np.flatnonzero(~mf)
+        row1=valid[0]
+        row2=valid[-1]
 
         row1+=1
         row2-=2
@@ -118,10 +186,10 @@ class SamplesCC(Samples):
         #IMPERF[0:row1]=IMPERF[row1]
         #IMPERF[row2::]=IMPERF[row2]
 
-        self.addData(IMPERF,ft,fz)
+        return IMPERF,ft,fz
 
-    def getNewSampleXYZ(self):
-        thtZ=self.getNewSample()
+    def getNewSampleXYZ(self,seed=None):
+        thtZ=self.getNewSample(seed=seed)
         tht=np.squeeze(np.tile(self.x,(1,len(self.y) )))
         z=np.repeat(self.y,len(self.x))
         r=self._getRperf(z)
@@ -136,7 +204,7 @@ class SamplesCC(Samples):
             return np.hstack((x[np.newaxis].T , y[np.newaxis].T , z[np.newaxis].T , res[np.newaxis].T ))
 
 
-    def putNewSampleToFolder(self,path):
+    def putNewSampleToFolder(self,path,seed=None):
         if self.outName is None :
             sname='AutogeneratedSample'+'_'+self.imp_type+'_'+time.strftime("%d_%B_%Y_%H_%M_%S_UTC",time.gmtime())
         else:
@@ -147,11 +215,46 @@ class SamplesCC(Samples):
         except:
             pass
 
-        np.savetxt(path+sname,self.getNewSampleXYZ() )
+        np.savetxt(path+sname,self.getNewSampleXYZ(seed) )
         logging.info('saved:'+path+sname)
 
 
-    def putNewSampleToCCDB(self,R=None,H=None,alpha=None):
+    def createStack(self,fname,n,names=None,seeds=None,dtype='float64'):
+        """ Creates a binary stack for n samples: fname (.npy) holds the
+            (z,theta) grids of all samples and is filled by
+            putNewSampleToStack, a .json header next to it holds the
+            shared coordinates, the geometry, the names and seeds.
+            The stack is read lazily with
+            desicos.conecylDB.read_write.SampleStack
+        """
+        self.getModel()
+        stack=np.lib.format.open_memmap(fname,mode='w+',dtype=dtype,
+                                        shape=(n,len(self.y),len(self.x)))
+        del stack
+        header={'imp_type':self.imp_type,
+                'theta':[float(v) for v in self.x],
+                'z':[float(v) for v in self.y],
+                'R_bottom':float(self.RB),
+                'H':float(self.H),
+                'alpharad':float(self.alpha),
+                'scaling_factor':float(self.scalingFactor),
+                'names':names,
+                'seeds':seeds}
+        fp=open(os.path.splitext(fname)[0]+'.json','w')
+        fp.write(json.dumps(header,indent=1))
+        fp.close()
+        logging.info('created:'+fname)
+
+    def putNewSampleToStack(self,fname,index,seed=None):
+        """ Writes a new sample in position index of a stack created by
+            createStack, several processes can fill the same stack
+        """
+        stack=np.load(fname,mmap_mode='r+')
+        stack[index]=self.getNewSample(seed=seed)*self.scalingFactor
+        stack.flush()
+        del stack
+
+    def putNewSampleToCCDB(self,R=None,H=None,alpha=None,seed=None):
         rcc=self.RB
         hcc=self.H
         acc=self.alpha
@@ -174,9 +277,9 @@ class SamplesCC(Samples):
 
         if self.imp_type == 'thick':
             logging.info('Adding : '+str(sname)+'_'+str(self.imp_type)+' to CCDB')
-            newCE.setThicknessImperfection(self.getNewSampleXYZ())
+            newCE.setThicknessImperfection(self.getNewSampleXYZ(seed))
             logging.info('saved:'+sname)
         else:
             logging.info('Adding : '+str(sname)+'_'+str(self.imp_type)+' to CCDB')
-            newCE.setGeometricImperfection(self.getNewSampleXYZ())
+            newCE.setGeometricImperfection(self.getNewSampleXYZ(seed))
             logging.info('saved:'+sname)
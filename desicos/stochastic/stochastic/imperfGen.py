@@ -1,11 +1,34 @@
 from stochastic.imperfCC import *
 from stochastic.filWin import FilterWindows2D
 from stochastic.strFact import *
+import os
 import logging
 import json
 #import time
 import copy
 
+# streams of the child RNG of each sample, appended to [masterSeed,index]
+SEED_MS=0
+SEED_THICK=1
+
+_batchFactory=None
+
+def _initBatchWorker(factory):
+    global _batchFactory
+    _batchFactory=factory
+
+def _batchWorker(args):
+    return _batchFactory._putNewBatchSample(*args)
+
+def childSeed(masterSeed,index):
+    """ Seed of the independent random stream of sample index, it only
+        depends on masterSeed and index (not on the number of processes)
+    """
+    return [int(masterSeed),int(index)]
+
+def sampleName(base,index,n):
+    return '%s_%0*d' % (base,max(len(str(n-1)),5),index)
+
 class ImperfFactory(object):
     def __init__(self,conecylDBFile):
         self.conecylDBFile=conecylDBFile
@@ -88,11 +111,45 @@ class ImperfFactory(object):
                 self.sMidS.addSurfacePatternFactory(fl)
 
     def compute(self):
+        """ Fits the spectral models, the samples generated afterwards
+            are drawn from them without recomputing the statistics
+        """
         if self.solveTII:
             self.sThick.compute()
         if self.solveMSI:
             self.sMidS.compute()
 
+    def _modelFiles(self,path):
+        return (os.path.join(path,'spectral_model_ms.npz'),
+                os.path.join(path,'spectral_model_thick.npz'))
+
+    def saveModels(self,path):
+        """ Stores the fitted spectral models in folder path
+        """
+        fms,fthick=self._modelFiles(path)
+        try:
+            os.makedirs(path)
+        except:
+            pass
+        if self.solveMSI:
+            self.sMidS.saveModel(fms)
+        if self.solveTII:
+            self.sThick.saveModel(fthick)
+
+    def loadModels(self,path):
+        """ Loads the spectral models stored with saveModels, new
+            samples can then be generated without any input data
+        """
+        fms,fthick=self._modelFiles(path)
+        if os.path.isfile(fms):
+            self.sMidS.setImpType('ms')
+            self.sMidS.loadModel(fms)
+            self.solveMSI=True
+        if os.path.isfile(fthick):
+            self.sThick.setImpType('thick')
+            self.sThick.loadModel(fthick)
+            self.solveTII=True
+
 
     def setFilters(self,name):
         fil=('none',())
@@ -130,25 +187,28 @@ class ImperfFactory(object):
         if self.sThick.getInputsCount() > 2:
             self.solveTII = True
 
-    def _putNewToCCDB(self,name):
+    def _putNewToCCDB(self,name,seed=None):
         self.sThick.setOutputName(str(name))
         self.sMidS.setOutputName(str(name))
 
-        self.sThick.compute()
-        self.sMidS.compute()
-
-        self.sThick.putNewSampleToCCDB()
-        self.sMidS.putNewSampleToCCDB()
+        self.sThick.putNewSampleToCCDB(seed=self._seed(seed,SEED_THICK))
+        self.sMidS.putNewSampleToCCDB(seed=self._seed(seed,SEED_MS))
 
     def putListToCCDB(self,ll):
         for l in ll:
             self._putNewToCCDB(l)
             self.outputs.append(l)
 
-    def putAutogenToCCDB(self,base,n):
+    def putAutogenToCCDB(self,base,n,masterSeed=None):
+        """ Generates n samples named base_00000, base_00001, ... into
+            the CCDB, sample i is drawn from childSeed(masterSeed,i).
+            The CCDB files are shared, so the samples are generated
+            sequentially
+        """
+        masterSeed=self._masterSeed(masterSeed)
         for i in range(0,n):
-            aname=str(base+'_'+time.strftime("%d_%B_%Y_%H_%M_%S_UTC",time.gmtime()))
-            self._putNewToCCDB(aname)
+            aname=sampleName(base,i,n)
+            self._putNewToCCDB(aname,childSeed(masterSeed,i))
             self.outputs.append(aname)
 
     ### DESICOS-STOCHASTIC-STANDALONE BLOCK:::::::::::::::::::;
@@ -165,13 +225,13 @@ class ImperfFactory(object):
         if len(msList) > 2:
             for b in msList:
                 try:
-                    self.sMidS.importFromXYZ(np.loadtxt(b),H,RB,alpha)
+                    self.sMidS.importFromFile(b,H,RB,alpha)
                 except:
                     pass
         if len(tiList) > 2:
             for b in tiList:
                 try:
-                    self.sThick.importFromXYZ(np.loadtxt(b),H,RB,alpha)
+                    self.sThick.importFromFile(b,H,RB,alpha)
                 except:
                     pass
 
@@ -180,27 +240,135 @@ class ImperfFactory(object):
         if self.sThick.getInputsCount() > 2:
             self.solveTII = True
 
-    def _putNewToFolder(self,path,name):
+    def _seed(self,seed,stream):
+        if seed is None:
+            return None
+        return list(seed)+[stream]
+
+    def _masterSeed(self,masterSeed):
+        if masterSeed is None:
+            # drawn once and recorded, so that the batch can be repeated
+            masterSeed=np.random.randint(0,2**31-1)
+            logging.info('using masterSeed: '+str(masterSeed))
+        return int(masterSeed)
+
+    def _putNewToFolder(self,path,name,seed=None):
 
         if self.solveMSI :
             self.sMidS.setOutputName(str(name)+'_inner_surf.txt')
-            self.sMidS.compute()
-            self.sMidS.putNewSampleToFolder(path)
+            self.sMidS.putNewSampleToFolder(path,self._seed(seed,SEED_MS))
         if self.solveTII:
             self.sThick.setOutputName(str(name)+'_thick.txt')
-            self.sThick.compute()
-            self.sThick.putNewSampleToFolder(path)
+            self.sThick.putNewSampleToFolder(path,
+                                             self._seed(seed,SEED_THICK))
 
 
 
+    def _stackFiles(self,path,name):
+        return (path+name+'_inner_surf.stack.npy',
+                path+name+'_thick.stack.npy')
+
+    def _putNewToStack(self,path,name,index,seed=None):
+        fms,fthick=self._stackFiles(path,name)
+        if self.solveMSI :
+            self.sMidS.putNewSampleToStack(fms,index,self._seed(seed,SEED_MS))
+        if self.solveTII:
+            self.sThick.putNewSampleToStack(fthick,index,
+                                            self._seed(seed,SEED_THICK))
+
+    def _putNewBatchSample(self,path,name,seed,index,fmt,batchName):
+        if fmt == 'stack':
+            self._putNewToStack(path,batchName,index,seed)
+        else:
+            self._putNewToFolder(path,name,seed)
+        return name
+
     def putListToFolder(self,path,ll):
         for l in ll:
             self._putNewToFolder(path,l)
             self.outputs.append(l)
 
-    def putAutogenToFolder(self,path,name,n):
-        for i in range(0,n):
-            aname=str(name+'_'+time.strftime("%d_%B_%Y_%H_%M_%S_UTC",time.gmtime()))
-            self._putNewToFolder(path,aname)
-            self.outputs.append(aname)
+    def putAutogenToFolder(self,path,name,n,masterSeed=None,processes=None):
+        return self.putBatchToFolder(path,name,n,masterSeed,processes)
+
+    def putBatchToFolder(self,path,name,n,masterSeed=None,processes=None,
+                         fmt='txt'):
+        """ Generates a reproducible batch of n samples in folder path
+
+            Sample i is named name_00000, name_00001, ... and drawn from
+            its own random stream childSeed(masterSeed,i), so the batch
+            does not depend on processes. The samples are spread over a
+            pool of processes (None or 1 runs sequentially) and a
+            manifest name_manifest.json lists the seed of each sample.
+            The spectral models are fitted once, before the pool starts.
+
+            fmt='txt' writes one XYZ(+t) text file per sample, while
+            fmt='stack' writes the whole batch in the binary stacks
+            name_inner_surf.stack.npy and name_thick.stack.npy (see
+            SamplesCC.createStack), sample i being at position i
+
+            Returns the path of the manifest file
+        """
+        masterSeed=self._masterSeed(masterSeed)
+        if self.solveMSI:
+            self.sMidS.getModel()
+        if self.solveTII:
+            self.sThick.getModel()
+        try:
+            os.makedirs(path)
+        except:
+            pass
+
+        names=[sampleName(name,i,n) for i in range(n)]
+        tasks=[(path,names[i],childSeed(masterSeed,i),i,fmt,name)
+               for i in range(n)]
+        fms,fthick=self._stackFiles(path,name)
+        if fmt == 'stack':
+            seeds=[task[2] for task in tasks]
+            if self.solveMSI:
+                self.sMidS.createStack(fms,n,names,
+                                  [self._seed(sd,SEED_MS) for sd in seeds])
+            if self.solveTII:
+                self.sThick.createStack(fthick,n,names,
+                                  [self._seed(sd,SEED_THICK) for sd in seeds])
+        elif fmt != 'txt':
+            raise ValueError('Invalid fmt: '+str(fmt))
+        if processes is not None and processes > 1 and n > 1:
+            import multiprocessing
+            pool=multiprocessing.Pool(processes,_initBatchWorker,(self,))
+            try:
+                pool.map(_batchWorker,tasks,chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for task in tasks:
+                self._putNewBatchSample(*task)
+        self.outputs.extend(names)
+
+        samples=[]
+        for aname,task in zip(names,tasks):
+            files={}
+            if fmt == 'stack':
+                fileMS=os.path.basename(fms)+'::'+str(task[3])
+                fileThick=os.path.basename(fthick)+'::'+str(task[3])
+            else:
+                fileMS=aname+'_inner_surf.txt'
+                fileThick=aname+'_thick.txt'
+            if self.solveMSI:
+                files['ms']={'file':fileMS,
+                             'seed':self._seed(task[2],SEED_MS)}
+            if self.solveTII:
+                files['thick']={'file':fileThick,
+                                'seed':self._seed(task[2],SEED_THICK)}
+            samples.append({'index':len(samples),'name':aname,
+                            'seed':task[2],'files':files})
+        manifest={'name':name,'masterSeed':masterSeed,'n':n,
+                  'samples':samples}
+        fname=path+name+'_manifest.json'
+        fp=open(fname,'w')
+        fp.write(json.dumps(manifest,indent=4))
+        fp.close()
+        logging.info('saved:'+fname)
+        return fname
 
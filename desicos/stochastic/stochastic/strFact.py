@@ -8,6 +8,32 @@ import logging
 from st_utils.coords import *
 
 
+def _linspaces(starts,stops,num,axis):
+    """ np.linspace for each pair of starts and stops, stacked along
+        axis. Same values as separate np.linspace calls
+    """
+    try:
+        return np.linspace(starts,stops,num,axis=axis)
+    except TypeError:
+        # numpy < 1.16, no array start/stop
+        ans=np.array([np.linspace(a,b,num) for a,b in zip(starts,stops)])
+        if axis == 0:
+            return ans.T
+        return ans
+
+def _blockPattern(npat,nBlk,A):
+    """ Blocks of amplitude A in the first half of each of the nBlk
+        blocks of size npat//nBlk
+    """
+    blkSize=npat//nBlk
+    pat=np.zeros(npat)
+    if blkSize > 0:
+        idx=np.arange(npat)
+        mask=(idx < nBlk*blkSize) & (idx % blkSize < blkSize//2)
+        pat[mask]=A
+    return pat
+
+
 class StructurePattern(object):
     def __init__(self):
         props={}
@@ -114,11 +140,7 @@ class StructurePattern(object):
         ntpat=800
         tpat=np.zeros((2,ntpat))
         tpat[0]=np.linspace(0,2.0*np.pi,tpat.shape[1])
-        nBlk=nBlkT
-        blkSize=ntpat/nBlk
-        for i in range(0,nBlk):
-            pos=i*blkSize
-            tpat[1][pos:pos+blkSize/2]=self.AT
+        tpat[1]=_blockPattern(ntpat,nBlkT,self.AT)
 
         tpi=np.hstack((tpat,tpat,tpat))
         tpi[0,0:tpat.shape[1]]=tpat[0]-2*np.pi
@@ -130,11 +152,7 @@ class StructurePattern(object):
         nzpat=600
         zpat=np.zeros((2,nzpat))
         zpat[0]=np.linspace(0,H,zpat.shape[1])
-        nBlk=nBlkZ
-        blkSize=nzpat/nBlk
-        for i in range(0,nBlk):
-            pos=i*blkSize
-            zpat[1][pos:pos+blkSize/2]=self.AZ
+        zpat[1]=_blockPattern(nzpat,nBlkZ,self.AZ)
 
         zpi=np.hstack((zpat,zpat,zpat))
 
@@ -154,32 +172,25 @@ class StructurePattern(object):
         kz=np.linspace(0,np.tan(self.KZ)*self.H,self.nt)
         kt=np.linspace(0,self.KT,self.nz)
 
-        imt=np.zeros((self.nz,self.nt))
-        imz=np.zeros((self.nz,self.nt))
-
-        for j in range(0,self.nt):
-            ofs=np.mod(kz[j],self.H)
-            zi=np.linspace(ofs,ofs+self.H,self.nz)
-            imz[:,j]=np.interp(zi, zpi[0], zpi[1])
+        # skewed patterns: column j of imz is shifted by kz[j] and row i
+        # of imt by kt[i], all interpolated at once
+        ofs=np.mod(kz,self.H)
+        zi=_linspaces(ofs,ofs+self.H,self.nz,axis=0)
+        imz=np.interp(zi, zpi[0], zpi[1])
 
-        for i in range(0,self.nz):
-            ofs=np.mod(kt[i],2.0*np.pi)
-            ti=np.linspace(ofs,ofs+2.0*np.pi,self.nt)
-            imt[i,:]=np.interp(ti, tpi[0], tpi[1])
+        ofs=np.mod(kt,2.0*np.pi)
+        ti=_linspaces(ofs,ofs+2.0*np.pi,self.nt,axis=1)
+        imt=np.interp(ti, tpi[0], tpi[1])
         if mode == 'add':
             im=imz+imt
         if mode == 'mul':
             im=imz*imt
         if mode == 'grt':
-            im=imt
-            for i in range(0,imz.shape[0]):
-                for j in range(0,imz.shape[1]):
-                    if im[i][j] <= 0.0:
-                        if imz[i][j] < im[i][j]:
-                            im[i][j]= imz[i][j]
-                    if im[i][j] >= 0.0:
-                        if imz[i][j] > im[i][j]:
-                            im[i][j]= imz[i][j]
+            # the value with the largest magnitude, keeping the sign of
+            # imt where it is not zero
+            grt=(((imt <= 0.0) & (imz < imt)) |
+                 ((imt >= 0.0) & (imz > imt)))
+            im=np.where(grt,imz,imt)
         return im*self.scalingFactor
 
 class StructureWithLayers(object):